@@ -7,6 +7,9 @@ from PySide2.QtGui import QIcon
 from PySide2.QtWidgets import QTableWidgetItem, QPushButton, QFileDialog, \
     QMessageBox, QInputDialog, QTableWidgetSelectionRange, QMainWindow
 
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.utilities import write_json
+
 
 class ZOIALibrarianBank(QMainWindow):
     """ The ZOIALibrarianBank class is responsible for most
@@ -30,6 +33,7 @@ class ZOIALibrarianBank(QMainWindow):
         self.path = path
         self.msg = msg
         self.util = util
+        self.index = PatchIndex.for_path(path)
 
         self.data_banks = []
         self.rows_left = []
@@ -76,13 +80,13 @@ class ZOIALibrarianBank(QMainWindow):
 
             # Check for a version extension.
             if "_" not in idx:
-                with open(os.path.join(self.path,
-                                       idx, "{}.json".format(idx)), "r") as f:
+                with open(os.path.join(self.index.patch_path(idx),
+                                       "{}.json".format(idx)), "r") as f:
                     temp = json.loads(f.read())
             else:
                 idx, ver = idx.split("_")
-                with open(os.path.join(self.path,
-                                       idx, "{}_{}.json".format(idx, ver)),
+                with open(os.path.join(self.index.patch_path(idx),
+                                       "{}_{}.json".format(idx, ver)),
                           "r") as f:
                     temp = json.loads(f.read())
 
@@ -196,19 +200,10 @@ class ZOIALibrarianBank(QMainWindow):
 
         # Keep track of patches that fail to load (because they have been
         # deleted from the backend by the user).
-        fails = []
-        for pch in self.data_banks:
-            if "_" in pch["id"] and \
-                    os.path.exists(os.path.join(self.path,
-                                                pch["id"].split("_")[0])):
-                if (pch["id"] + ".bin") not in \
-                        os.listdir(os.path.join(self.path,
-                                                pch["id"].split("_")[0])):
-                    fails.append(pch)
-                    self.data_banks.remove(pch)
-            elif pch["id"] not in os.listdir(self.path):
-                fails.append(pch)
-                self.data_banks.remove(pch)
+        fails = [pch for pch in self.data_banks
+                 if not self.index.has(pch["id"])]
+        self.data_banks = [pch for pch in self.data_banks
+                           if pch not in fails]
 
         # Notify the user of the patches that failed to load. No way to know
         # which since we don't save that info in the bank JSONs.
@@ -252,9 +247,8 @@ class ZOIALibrarianBank(QMainWindow):
                     return
 
             # Save the bank
-            with open(os.path.join(self.path, "Banks",
-                                   "{}.json".format(name)), "w") as f:
-                f.write(json.dumps(self.data_banks))
+            write_json(os.path.join(self.path, "Banks",
+                                    "{}.json".format(name)), self.data_banks)
 
             # Let the user know when the saving is done.
             self.msg.setWindowTitle("Bank Saved")
@@ -480,8 +474,7 @@ class ZOIALibrarianBank(QMainWindow):
             self.ui.btn_export_bank.setEnabled(True)
             self.ui.btn_clear_bank.setEnabled(True)
 
-        if ("_" not in idx and len(os.listdir(os.path.join(
-                self.path, idx))) == 2) or "_" in idx:
+        if "_" in idx or self.index.version_count(idx) == 1:
             # Not working within a version directory.
             # Just a single patch
             self.data_banks.append({
@@ -491,8 +484,7 @@ class ZOIALibrarianBank(QMainWindow):
 
         else:
             # An entire version directory was selected.
-            pch_num = int((len(os.listdir(os.path.join(
-                self.path, idx))) / 2) - 1)
+            pch_num = self.index.version_count(idx) - 1
             if drop_index + pch_num > 63:
                 self._set_data_bank()
                 self.msg.setWindowTitle("No Space")
@@ -516,11 +508,11 @@ class ZOIALibrarianBank(QMainWindow):
                         for i in range(drop_index, drop_index + pch_num):
                             if pch["slot"] == i:
                                 self.data_banks.remove(pch)
-                # Add all of the version patches
-                for i in range(1, pch_num + 2):
+                # Add all of the version patches, newest first.
+                for i, pch in enumerate(self.index.versions(idx)):
                     self.data_banks.append({
-                        "slot": drop_index + i - 1,
-                        "id": "{}_v{}".format(idx, i)
+                        "slot": drop_index + i,
+                        "id": "{}_v{}".format(idx, pch["revision"])
                     })
 
         self._set_data_bank()
@@ -566,8 +558,7 @@ class ZOIALibrarianBank(QMainWindow):
                         # We actually dragged it over.
                         idx = self.ui.table_bank_local.cellWidget(
                             src, 0).objectName()
-                        if ("_" not in idx and len(os.listdir(os.path.join(
-                                self.path, idx))) == 2) or "_" in idx:
+                        if "_" in idx or self.index.version_count(idx) == 1:
                             # Not working within a version directory.
                             # Just a single patch
                             if self.data_banks is not None:
@@ -591,8 +582,7 @@ class ZOIALibrarianBank(QMainWindow):
                             drop_index += 1
                         else:
                             # An entire version directory was dragged over.
-                            pch_num = int((len(os.listdir(os.path.join(
-                                self.path, idx))) / 2) - 1)
+                            pch_num = self.index.version_count(idx) - 1
                             if drop_index + pch_num > 63:
                                 self._set_data_bank()
                                 self.msg.setWindowTitle("No Space")
@@ -617,11 +607,14 @@ class ZOIALibrarianBank(QMainWindow):
                                                        + pch_num):
                                             if pch["slot"] == i:
                                                 self.data_banks.remove(pch)
-                                # Add all of the version patches
-                                for i in range(1, pch_num + 2):
+                                # Add all of the version patches,
+                                # newest first.
+                                for i, pch in enumerate(
+                                        self.index.versions(idx)):
                                     self.data_banks.append({
-                                        "slot": drop_index + i - 1,
-                                        "id": "{}_v{}".format(idx, i)
+                                        "slot": drop_index + i,
+                                        "id": "{}_v{}".format(
+                                            idx, pch["revision"])
                                     })
                                 drop_index += pch_num + 1
                         self._set_data_bank()
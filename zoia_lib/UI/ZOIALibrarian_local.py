@@ -6,6 +6,8 @@ from PySide2.QtCore import QEvent, QThread
 from PySide2.QtWidgets import QMainWindow, QMessageBox, QInputDialog, \
     QPushButton
 
+from zoia_lib.backend import patch_search
+from zoia_lib.backend.patch_index import PatchIndex
 from zoia_lib.backend.patch_update import PatchUpdate
 from zoia_lib.common import errors
 
@@ -48,11 +50,14 @@ class ZOIALibrarianLocal(QMainWindow):
         self.export = expt
         self.delete = delete
         self.sort_and_set = f1
+        self.index = PatchIndex.for_path(path)
 
         self.data_local = []
         self.data_local_version = []
         self.data_bank = []
         self.data_bank_version = []
+        # The tabs (1 or 3) whose data has been loaded from the index.
+        self.loaded = set()
         self.curr_ver = None
         self.prev_tag_cat = None
         self.prev_search = ""
@@ -123,19 +128,60 @@ class ZOIALibrarianLocal(QMainWindow):
             self.data_bank = []
             curr_data = self.data_bank
 
-        for patches in os.listdir(self.path):
-            # Look for patch directories in the backend.
-            if patches != "Banks" and patches != "data.json" and \
-                    patches != '.DS_Store' and patches != "pref.json":
-                for pch in os.listdir(os.path.join(self.path, patches)):
-                    # Read the metadata so that we can set up the tables.
-                    if pch.split(".")[-1] == "json":
-                        with open(os.path.join(self.path, patches, pch)) as f:
-                            temp = json.loads(f.read())
-                        curr_data.append(temp)
-                        break
+        # The index holds the metadata for the newest version of every
+        # patch, so there is no need to read each patch directory.
+        curr_data.extend(self.index.patches())
+        self.loaded.add(self.ui.tabs.currentIndex())
         self.sort_and_set()
 
+    def apply_changes(self, events):
+        """ Updates the loaded patch data for patches that changed in the
+        backend, leaving every other patch as it is.
+
+        events: A list of (kind, idx) tuples, as returned by
+                PatchWatcher.poll(). The index must already be refreshed
+                for these patches.
+
+        return: A set of the tabs (1 or 3) whose data changed.
+        """
+
+        ids = {idx for _, idx in events}
+        changed = set()
+        for tab, curr_data in ((1, self.data_local), (3, self.data_bank)):
+            if tab not in self.loaded:
+                continue
+            old = {str(pch["id"]): i for i, pch in enumerate(curr_data)
+                   if str(pch["id"]) in ids}
+            gone = set()
+            for idx in ids:
+                pch = self.index.patch(idx)
+                if idx not in old:
+                    if pch is not None:
+                        curr_data.append(pch)
+                        changed.add(tab)
+                elif pch is None:
+                    gone.add(old[idx])
+                    changed.add(tab)
+                elif pch != curr_data[old[idx]]:
+                    curr_data[old[idx]] = pch
+                    changed.add(tab)
+            # Drop the patches that no longer exist in one pass.
+            if gone:
+                curr_data[:] = [pch for i, pch in enumerate(curr_data)
+                                if i not in gone]
+            if tab in changed:
+                patch_search.touch(curr_data)
+
+        if self.curr_ver in ids:
+            # The versions being shown may have changed as well.
+            changed |= self.loaded & {1, 3}
+            if self.ui.back_btn_local.isEnabled():
+                self.data_local_version = self.index.versions(self.curr_ver)
+            if self.ui.back_btn_bank.isEnabled():
+                self.data_bank_version = self.index.versions(self.curr_ver)
+
+        return changed
+
     def initiate_delete(self):
         """ Attempts to delete a patch that is stored on a user's local
         filesystem.
@@ -144,8 +190,7 @@ class ZOIALibrarianLocal(QMainWindow):
         # Check to see if we are deleting in a version directory or not.
         if "_" not in self.sender().objectName():
             if not self.ui.back_btn_local.isEnabled() and \
-                    len(os.listdir(os.path.join(
-                        self.path, self.sender().objectName()))) > 2:
+                    self.index.version_count(self.sender().objectName()) > 1:
                 self.delete.delete_full_patch_directory(
                     self.sender().objectName())
             else:
@@ -264,12 +309,7 @@ class ZOIALibrarianLocal(QMainWindow):
             curr_data = self.data_bank_version
 
         # Get all of the patch versions into one place.
-        for pch in os.listdir(os.path.join(self.path, idx)):
-            if pch.split(".")[-1] == "json":
-                # Got the metadata
-                with open(os.path.join(self.path, idx, pch)) as f:
-                    temp = json.loads(f.read())
-                curr_data.append(temp)
+        curr_data.extend(self.index.versions(idx))
 
         # Reload the table.
         self.ui.update_patch_notes.setEnabled(not context)
@@ -374,13 +414,12 @@ class ZOIALibrarianLocal(QMainWindow):
         idx: The id number associated with this row.
         """
 
+        # The table already shows the new text. Edits are written once
+        # the user stops editing, at which point the backend watcher
+        # reloads the patch.
         # Case 1 - The text is empty (i.e., delete everything)
         if text == "":
-            update.update_data(idx, [], 1 if mode else 2)
-            if not self.ui.back_btn_local.isEnabled():
-                self.get_local_patches()
-            else:
-                self.get_version_patches(True)
+            update.queue_data(idx, [], 1 if mode else 2)
         # Case 2 - Leftover text from when there are no tags/categories
         elif text == "No tags" or text == "No categories":
             pass
@@ -404,17 +443,18 @@ class ZOIALibrarianLocal(QMainWindow):
                 })
             # Determine the context and update the metadata.
             if mode:
-                update.update_data(idx, done, 1)
+                update.queue_data(idx, done, 1)
             else:
-                update.update_data(idx, done, 2)
-
-            # Reload the table to show the changes.
-            if not self.ui.back_btn_local.isEnabled():
-                self.get_local_patches()
-            else:
-                self.get_version_patches(True)
+                update.queue_data(idx, done, 2)
         self.prev_tag_cat = None
 
+    @staticmethod
+    def save_edits():
+        """ Writes any tag/category edits that are still queued.
+        """
+
+        update.flush()
+
     def events(self, e):
         """ Handles events that relate updating the tags/categories
         for patches located in the Local Storage View tab's table.
@@ -1,9 +1,10 @@
 import json
 import os
+import threading
 from os.path import expanduser
 
 from PySide2 import QtCore
-from PySide2.QtCore import QEvent, Qt, QThread
+from PySide2.QtCore import QEvent, Qt, QThread, QTimer
 from PySide2.QtGui import QIcon, QFont
 from PySide2.QtWidgets import QMainWindow, QMessageBox, \
     QTableWidgetItem, QRadioButton, QDesktopWidget, QFileDialog
@@ -20,7 +21,9 @@ from zoia_lib.backend.api import PatchStorage
 from zoia_lib.backend.patch_binary import PatchBinary
 from zoia_lib.backend.patch_delete import PatchDelete
 from zoia_lib.backend.patch_export import PatchExport
+from zoia_lib.backend.patch_index import PatchIndex
 from zoia_lib.backend.patch_save import PatchSave
+from zoia_lib.backend.patch_watch import PatchWatcher
 
 api = PatchStorage()
 save = PatchSave()
@@ -28,6 +31,10 @@ export = PatchExport()
 delete = PatchDelete()
 binary = PatchBinary()
 
+# How long to wait for the user to stop typing before searching, in
+# milliseconds.
+SEARCH_DELAY = 250
+
 
 class ZOIALibrarianMain(QMainWindow):
     """ The ZOIALibrarian_Main class represents the frontend for the
@@ -63,6 +70,7 @@ class ZOIALibrarianMain(QMainWindow):
         self.ui = ui_main.Ui_MainWindow()
         self.ui.setupUi(self)
         self.path = save.get_backend_path()
+        self.index = PatchIndex.for_path(self.path)
 
         # Message box init
         self.icon = QIcon(os.path.join(os.getcwd(), "zoia_lib", "UI",
@@ -80,7 +88,6 @@ class ZOIALibrarianMain(QMainWindow):
                                         self, export, delete, self.sort_and_set)
 
         # Instance variables.
-        self.patch_cache = []
         self.prev_sort = None
         self.search_data_PS = None
         self.search_data_local = None
@@ -95,7 +102,8 @@ class ZOIALibrarianMain(QMainWindow):
         self.sd_sizes = None
         self.bank_sizes = None
         self.font = None
-        self.local_pch_count = -1
+        # The tabs (1 or 3) whose table is out of date with the backend.
+        self.stale_tabs = set()
 
         # Threads
         self.worker_mass = ImportMassWorker(self)
@@ -108,6 +116,27 @@ class ZOIALibrarianMain(QMainWindow):
         self.worker_version_sd = ImportVersionSDWorker(self)
         self.worker_version_sd.signal.connect(self._version_import_done)
 
+        # Search as the user types, once they pause, without blocking
+        # the window. Each search gets a generation, so that results for
+        # an outdated query are dropped.
+        self.search_gen = 0
+        self.worker_search = SearchWorker()
+        self.worker_search.signal.connect(self._search_done)
+        self.worker_search.finished.connect(self.worker_search.resume)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search)
+
+        # Watch the backend, so that only patches that changed need to be
+        # reloaded. Polling and refreshing the index happen in the
+        # background.
+        self.watcher = PatchWatcher()
+        self.watcher.start()
+        self.worker_watch = WatchWorker(self.watcher, self.index)
+        self.worker_watch.signal.connect(self._backend_changed)
+        self.worker_watch.start()
+
         # Get the data necessary for the PS tab.
         self.ps.metadata_init()
 
@@ -248,6 +277,9 @@ class ZOIALibrarianMain(QMainWindow):
         self.ui.searchbar_PS.returnPressed.connect(self.search)
         self.ui.searchbar_local.returnPressed.connect(self.search)
         self.ui.searchbar_bank.returnPressed.connect(self.search)
+        self.ui.searchbar_PS.textEdited.connect(self._search_typed)
+        self.ui.searchbar_local.textEdited.connect(self._search_typed)
+        self.ui.searchbar_bank.textEdited.connect(self._search_typed)
         self.ui.searchbar_PS.installEventFilter(self)
         self.ui.searchbar_local.installEventFilter(self)
         self.ui.searchbar_bank.installEventFilter(self)
@@ -348,15 +380,13 @@ class ZOIALibrarianMain(QMainWindow):
         # Figure out what tab we switched to.
         if self.ui.tabs.currentIndex() == 1 \
                 or self.ui.tabs.currentIndex() == 3:
-            # Only reload the table data if we need to (new # of patches).
-            if (self.ui.tabs.currentIndex() == 1
-                    and self.ui.table_local.rowCount() == 1) or \
-                    (self.ui.tabs.currentIndex() == 3 and
-                     self.ui.table_bank_local.rowCount() == 1) or \
-                    self.local_pch_count == -1 or \
-                    self.local_pch_count != len(os.listdir(self.path)):
+            # Only load the table data once, the watcher keeps it up to
+            # date afterwards.
+            if self.ui.tabs.currentIndex() not in self.local.loaded:
                 self.local.get_local_patches()
-                self.local_pch_count = len(os.listdir(self.path))
+            elif self.ui.tabs.currentIndex() in self.stale_tabs:
+                self._refresh_table()
+            self.stale_tabs.discard(self.ui.tabs.currentIndex())
             # Context cleanup
             if self.ui.tabs.currentIndex() == 3:
                 self.ui.text_browser_bank.setText("")
@@ -433,6 +463,8 @@ class ZOIALibrarianMain(QMainWindow):
         }[(table_index, search, version)]
 
         data_length = len(data)
+        if table_index != 0:
+            versions = self.index.version_counts()
 
         # Set the rows for the table.
         curr_table.setRowCount(data_length)
@@ -467,7 +499,7 @@ class ZOIALibrarianMain(QMainWindow):
                   not self.ui.back_btn_local.isEnabled()) \
                     or (table_index == 3 and
                         not self.ui.back_btn_bank.isEnabled()):
-                if len(os.listdir(os.path.join(self.path, idx))) > 2:
+                if versions.get(idx, 0) > 1:
                     btn_title.setText(title.rstrip() + "\n[Multiple Versions]")
                 btn_title.setObjectName(idx)
             else:
@@ -500,7 +532,7 @@ class ZOIALibrarianMain(QMainWindow):
                 # Can only edit tags/cats in Local Storage View.
                 if table_index == 1 and not \
                         self.ui.back_btn_local.isEnabled() and \
-                        len(os.listdir(os.path.join(self.path, idx))) > 2:
+                        versions.get(idx, 0) > 1:
                     text_item.setFlags(
                         Qt.ItemIsSelectable | Qt.ItemIsEnabled)
                 curr_table.setItem(i, j + 1, text_item)
@@ -667,16 +699,14 @@ class ZOIALibrarianMain(QMainWindow):
         Currently triggered via a radio button selection.
         """
 
-        skip = False
-
         # The "sender" here is every radio button, so we need to see
         # which one is actually checked.
         if self.sender().isChecked():
             if (self.ui.tabs.currentIndex() == 1
                 or self.ui.tabs.currentIndex() == 3) and \
                     "_" not in self.sender().objectName() and \
-                    len(os.listdir(os.path.join(
-                        self.path, self.sender().objectName()))) > 2:
+                    self.index.version_count(
+                        self.sender().objectName()) > 1:
                 # We are pointing to a version directory.
                 self.display_patch_versions(self.ui.tabs.currentIndex() == 1)
                 return
@@ -686,36 +716,29 @@ class ZOIALibrarianMain(QMainWindow):
             if "_" in name:
                 name, ver = name.split("_")
             curr_browser = None
-            # Special case, we are on the PS tab. We have a rolling patch cache
-            # to reference so a user can't log multiple views on a patch.
+            # Special case, we are on the PS tab. The complete metadata
+            # is usually in the synced catalog already; otherwise,
+            # responses from PS are cached on disk, so reopening a patch
+            # costs at most a conditional request.
             if self.ui.tabs.currentIndex() == 0:
                 curr_browser = self.ui.text_browser_PS
-                content = None
-                # Try to find the selected item in the patch cache.
-                for pch in self.patch_cache:
-                    if str(pch["id"]) == name:
-                        # Found it, no query needed.
-                        content = pch
-                        skip = True
-                        break
-                if content is None:
-                    try:
-                        # Didn't find it, need to query.
+                try:
+                    content = self.ps.get_meta_ps(name)
+                    if content is None or "preview_url" not in content:
                         content = api.get_patch_meta(name)
-                        # Add it to the cache for next time.
-                        self.patch_cache.append(content)
-                    except:
-                        # Let the user know they aren't connected to the
-                        # internet.
-                        self.msg.setWindowTitle("No Internet Connection")
-                        self.msg.setIcon(QMessageBox.Information)
-                        self.msg.setText(
-                            "Failed to retrieve the patch metadata "
-                            "from PatchStorage.\nPlease check your internet "
-                            "connection and try again.")
-                        self.msg.setStandardButtons(QMessageBox.Ok)
-                        self.msg.exec_()
-                        self.msg.setInformativeText(None)
+                except:
+                    # Let the user know they aren't connected to the
+                    # internet.
+                    self.msg.setWindowTitle("No Internet Connection")
+                    self.msg.setIcon(QMessageBox.Information)
+                    self.msg.setText(
+                        "Failed to retrieve the patch metadata "
+                        "from PatchStorage.\nPlease check your internet "
+                        "connection and try again.")
+                    self.msg.setStandardButtons(QMessageBox.Ok)
+                    self.msg.exec_()
+                    self.msg.setInformativeText(None)
+                    return
             else:
                 # Get the context.
                 viz_browser = None
@@ -730,35 +753,33 @@ class ZOIALibrarianMain(QMainWindow):
                 # Determine if we need to worry about a version extension.
                 if ver != "":
                     self.local.set_local_selected("{}_{}".format(name, ver))
+                pch = self.index.patch_path(name)
                 try:
-                    with open(os.path.join(self.path, name,
-                                           name + ".json")) as f:
+                    with open(os.path.join(pch, name + ".json")) as f:
                         content = json.loads(f.read())
                 except FileNotFoundError:
                     with open(os.path.join(
-                            self.path, name, name + "_{}.json".format(ver))) \
-                            as f:
+                            pch, name + "_{}.json".format(ver))) as f:
                         content = json.loads(f.read())
                 # We are on the Local Storage View, so set the viz up.
                 if viz_browser is not None:
                     try:
-                        with open(os.path.join(self.path, name,
-                                               name + ".bin"), "rb") as f:
+                        with open(os.path.join(pch, name + ".bin"),
+                                  "rb") as f:
                             viz = binary.parse_data(f.read())
                     except FileNotFoundError:
                         with open(os.path.join(
-                                self.path, name, name + "_{}.bin".format(ver)),
+                                pch, name + "_{}.bin".format(ver)),
                                 "rb") as f:
                             viz = binary.parse_data(f.read())
                     self.local.setup_viz(viz)
 
             # Oh boy HTML code for the patch preview.
-            if not skip:
-                if content["preview_url"] == "":
-                    content["preview_url"] = "None provided"
-                else:
-                    content["preview_url"] = \
-                        "<a href=" + content["preview_url"] + ">Click here</a>"
+            if content["preview_url"] == "":
+                content["preview_url"] = "None provided"
+            else:
+                content["preview_url"] = \
+                    "<a href=" + content["preview_url"] + ">Click here</a>"
             if "license" not in content or content["license"] is None or \
                     content["license"]["name"] == "":
                 legal = "None provided"
@@ -824,48 +845,86 @@ class ZOIALibrarianMain(QMainWindow):
 
     def search(self):
         """ Initiates a data search for the metadata that is retrieved
-        via the PS API or that is stored locally. The search will then
-        set the table to display the returned query matches.
-        Currently triggered via a button press.
+        via the PS API or that is stored locally. The search runs in the
+        background, after which _search_done() sets the table to display
+        the returned query matches.
+        Currently triggered via a button press, or once the user stops
+        typing in a search bar.
         """
 
+        self.search_timer.stop()
+        table_index = self.ui.tabs.currentIndex()
+
         # Case 1: PS tab
-        if self.ui.tabs.currentIndex() == 0 \
-                and self.ui.searchbar_PS.text() != "":
-            self.search_data_PS = \
-                util.search_patches(self.ps.get_data_ps(),
-                                    self.ui.searchbar_PS.text())
-            self.set_data(True)
+        if table_index == 0 and self.ui.searchbar_PS.text() != "":
+            version = False
+            data = self.ps.get_data_ps()
+            text = self.ui.searchbar_PS.text()
         # Case 2: Local tab
-        elif self.ui.tabs.currentIndex() == 1 \
-                and self.ui.searchbar_local.text() != "":
-            # Case 2.1: No version
-            if not self.ui.back_btn_local.isEnabled():
-                self.search_data_local = \
-                    util.search_patches(self.local.get_data_local(),
-                                        self.ui.searchbar_local.text())
-                self.set_data(True)
-            # Case 2.2: Version
-            else:
-                self.search_data_local_version = \
-                    util.search_patches(self.local.get_data_local_version(),
-                                        self.ui.searchbar_local.text())
-                self.set_data(True, True)
+        elif table_index == 1 and self.ui.searchbar_local.text() != "":
+            # Case 2.1: No version, Case 2.2: Version
+            version = self.ui.back_btn_local.isEnabled()
+            data = self.local.get_data_local_version() if version \
+                else self.local.get_data_local()
+            text = self.ui.searchbar_local.text()
         # Case 3: Bank tab
-        elif self.ui.tabs.currentIndex() == 3 \
-                and self.ui.searchbar_bank.text() != "":
-            # Case 3.1: No version
-            if not self.ui.back_btn_bank.isEnabled():
-                self.search_data_bank = \
-                    util.search_patches(self.local.get_data_bank(),
-                                        self.ui.searchbar_bank.text())
-                self.set_data(True)
-            # Case 3.2: Version
-            else:
-                self.search_data_bank_version = \
-                    util.search_patches(self.local.get_data_bank_version(),
-                                        self.ui.searchbar_bank.text())
-                self.set_data(True, True)
+        elif table_index == 3 and self.ui.searchbar_bank.text() != "":
+            # Case 3.1: No version, Case 3.2: Version
+            version = self.ui.back_btn_bank.isEnabled()
+            data = self.local.get_data_bank_version() if version \
+                else self.local.get_data_bank()
+            text = self.ui.searchbar_bank.text()
+        else:
+            return
+
+        # On the PS tab, the best matches out of the whole catalog come
+        # first.
+        self.search_gen += 1
+        self.worker_search.search(self.search_gen, (table_index, version),
+                                  data, text, table_index == 0)
+
+    def _search_typed(self, text):
+        """ Searches once the user stops typing in a search bar, rather
+        than after every keystroke.
+        Currently triggered via editing a search bar.
+
+        text: The text in the search bar.
+        """
+
+        if text != "":
+            self.search_timer.start()
+        else:
+            # The search bar was cleared, and the results of any search
+            # still running are no longer wanted.
+            self.search_timer.stop()
+            self.search_gen += 1
+
+    def _search_done(self, gen, context, results):
+        """ Displays the results of a search, unless another search was
+        started since, or the user moved on to another tab.
+
+        gen: The generation of the search.
+        context: A tuple holding the tab index, and whether version data
+                 was searched.
+        results: The metadata that matches the search query.
+        """
+
+        table_index, version = context
+        if gen != self.search_gen \
+                or table_index != self.ui.tabs.currentIndex():
+            return
+
+        if table_index == 0:
+            self.search_data_PS = results
+        elif table_index == 1 and version:
+            self.search_data_local_version = results
+        elif table_index == 1:
+            self.search_data_local = results
+        elif version:
+            self.search_data_bank_version = results
+        else:
+            self.search_data_bank = results
+        self.set_data(True, version)
 
     def sort_and_set(self):
         """ Sorts and sets the metadata in a table depending on the
@@ -944,7 +1003,7 @@ class ZOIALibrarianMain(QMainWindow):
         elif table_index == 1 and self.ui.searchbar_local.text() == "" \
                 and self.ui.back_btn_local.isEnabled():
             util.sort_metadata(7, self.local.get_data_local_version(),
-                               False)
+                               True)
             self.set_data(version=True)
         # ->Case 3.4: Local tab, it is a version, and text is in the search
         #             bar.
@@ -954,7 +1013,7 @@ class ZOIALibrarianMain(QMainWindow):
                 self.search_data_local_version = \
                     self.local.get_data_local_version()
             util.sort_metadata(7, self.search_data_local_version,
-                               False)
+                               True)
             self.set_data(True, True)
         # Case 4: Sorting on the Banks tab.
         # ->Case 4.1: Sorting on the Banks tab, no version, and an empty search
@@ -976,7 +1035,7 @@ class ZOIALibrarianMain(QMainWindow):
         elif table_index == 3 and self.ui.searchbar_bank.text() == "" \
                 and self.ui.back_btn_bank.isEnabled():
             util.sort_metadata(7, self.local.get_data_bank_version(),
-                               False)
+                               True)
             self.set_data(version=True)
         # ->Case 4.4: Bank tab, it is a version, and text is in the search bar.
         elif table_index == 3 and self.ui.searchbar_bank.text() != "" \
@@ -985,7 +1044,7 @@ class ZOIALibrarianMain(QMainWindow):
                 self.search_data_bank_version = \
                     self.local.get_data_bank_version()
             util.sort_metadata(7, self.search_data_bank_version,
-                               False)
+                               True)
             self.set_data(True, True)
 
     def import_patch(self):
@@ -1216,6 +1275,38 @@ class ZOIALibrarianMain(QMainWindow):
 
         return self._version_import_done(fail_cnt)
 
+    def _backend_changed(self, events):
+        """ Updates the local patch data for the patches that changed in
+        the backend since the last check.
+        Currently triggered via the WatchWorker, which has refreshed the
+        index for them already.
+
+        events: A list of (kind, idx) tuples, as returned by
+                PatchWatcher.poll().
+        """
+
+        self.stale_tabs |= self.local.apply_changes(events)
+
+        # Only the visible table needs to be redrawn right away.
+        if self.ui.tabs.currentIndex() in self.stale_tabs:
+            self.stale_tabs.discard(self.ui.tabs.currentIndex())
+            self._refresh_table()
+
+    def _refresh_table(self):
+        """ Redraws the table on the current tab, keeping the current
+        search.
+        """
+
+        if self.ui.tabs.currentIndex() == 1:
+            text = self.ui.searchbar_local.text()
+        else:
+            text = self.ui.searchbar_bank.text()
+
+        if text != "":
+            self.search()
+        else:
+            self.sort_and_set()
+
     def closeEvent(self, event):
         """ Override the default close operation so certain application
         settings can be saved.
@@ -1223,6 +1314,11 @@ class ZOIALibrarianMain(QMainWindow):
 
         self.util.save_pref(self.width(), self.height(), self.sd.get_sd_root(),
                             self.path)
+        self.local.save_edits()
+        self.worker_watch.stop()
+        self.watcher.close()
+        self.search_timer.stop()
+        self.worker_search.wait()
 
     def _try_quit(self):
         """ Forces the application to close.
@@ -1372,3 +1468,111 @@ class ImportVersionSDWorker(QThread):
 
         input_dir = self.window.sd.get_sd_path()
         self.signal.emit(save.import_to_backend(input_dir, True))
+
+
+class SearchWorker(QThread):
+    """ The SearchWorker class runs as a separate thread in the
+    application to prevent application snag. This thread searches
+    patch metadata, one search at a time. Should more searches be
+    requested while one is running, only the latest is run once it is
+    done; the others are outdated already.
+    """
+
+    # UI communication
+    signal = QtCore.Signal(int, object, object)
+
+    def __init__(self):
+        """ Initializes the thread.
+        """
+
+        QThread.__init__(self)
+        self.lock = threading.Lock()
+        self.pending = None
+
+    def search(self, gen, context, data, text, ranked):
+        """ Requests a search, replacing any search that hasn't started
+        yet.
+
+        gen: The generation of the search, passed back via the signal.
+        context: Passed back via the signal.
+        data: The metadata that is to be searched through.
+        text: The search term.
+        ranked: True to put the most relevant matches first.
+        """
+
+        # Copied here, in the GUI thread, as the application may modify
+        # data (e.g. sort it) while it is being searched.
+        with self.lock:
+            self.pending = (gen, context, data, list(data), text, ranked)
+        self.start()
+
+    def resume(self):
+        """ Starts the thread again, should a search have been requested
+        just as it was finishing.
+        """
+
+        with self.lock:
+            pending = self.pending is not None
+        if pending:
+            self.start()
+
+    def run(self):
+        """ Runs the requested searches, emitting the results of each.
+        """
+
+        while True:
+            with self.lock:
+                if self.pending is None:
+                    return
+                gen, context, data, view, text, ranked = self.pending
+                self.pending = None
+
+            # Typed in a search bar, so typos are tolerated.
+            self.signal.emit(gen, context, util.search_patches(
+                data, text, ranked, fuzzy=True, view=view))
+
+
+class WatchWorker(QThread):
+    """ The WatchWorker class runs as a separate thread in the
+    application to prevent application snag. This thread checks the
+    backend for changes every second, and refreshes the index for the
+    patches that changed before reporting them.
+    """
+
+    # UI communication
+    signal = QtCore.Signal(object)
+
+    def __init__(self, watcher, index, interval=1.0):
+        """ Initializes the thread.
+
+        watcher: The PatchWatcher for the backend, which must only be
+                 used by this thread once it has started.
+        index: The PatchIndex for the backend.
+        interval: Optional. How often to check for changes, in seconds.
+        """
+
+        QThread.__init__(self)
+        self.watcher = watcher
+        self.index = index
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def stop(self):
+        """ Stops the thread, waiting for the current check to finish.
+        """
+
+        self.stopping.set()
+        self.wait()
+
+    def run(self):
+        """ Checks for changes until stopped, emitting the changes found
+        by each check.
+        """
+
+        while not self.stopping.wait(self.interval):
+            events = self.watcher.poll()
+            if not events:
+                continue
+            for _, idx in events:
+                self.index.refresh(idx)
+            self.signal.emit(events)
@@ -1,10 +1,12 @@
-import json
 import os
 
 from PySide2 import QtCore
 from PySide2.QtCore import QThread
 from PySide2.QtWidgets import QMainWindow, QMessageBox, QPushButton
 
+from zoia_lib.backend.patch_download import PatchDownload
+from zoia_lib.backend.patch_meta import meta_cache
+from zoia_lib.backend.patch_sync import PatchSync
 from zoia_lib.common import errors
 
 
@@ -36,46 +38,28 @@ class ZOIALibrarianPS(QMainWindow):
         self.msg = msg
         self.save = save
         self.sort_and_set = f1
+        self.sync = PatchSync(self.api)
 
         # Threads
-        self.worker_dwn = DownloadAllWorker(self.ui, self.save, self.api)
+        self.worker_dwn = DownloadAllWorker(
+            PatchDownload(self.api, self.save, self.api.workers),
+            self.get_data_ps, self.path)
         self.worker_dwn.signal.connect(self._download_all_done)
         self.worker_dwn.signal_2.connect(self._download_all_progress)
+        self.worker_dwn.signal_3.connect(self._download_all_failed)
 
-        self.worker_ps = ReloadPSWorker(self.path, self.api)
+        self.worker_ps = ReloadPSWorker(self.sync)
         self.worker_ps.signal.connect(self._reload_ps_done)
+        self.worker_ps.signal_2.connect(self._reload_ps_progress)
 
     def metadata_init(self):
         """ Retrieves all PS metadata via API calls.
         """
 
         try:
-            # Check for metadata in the user's backend.
-            if "data.json" not in os.listdir(self.path):
-                ps_data = self.api.get_all_patch_data_init()
-            else:
-                # Got previous metadata, need to ensure that there are no
-                # new patches.
-                with open(os.path.join(self.path, "data.json"),
-                          "r") as f:
-                    data = json.loads(f.read())
-                if len(data) == self.api.patch_count:
-                    # Assume no new patches; allow the user to refresh manually.
-                    self.data_PS = data
-                    return
-                elif len(data) > self.api.patch_count:
-                    # Uh oh, some patches got deleted on PatchStorage.
-                    ps_data = self.api.get_all_patch_data_init()
-                else:
-                    # Get the new patch metadata that we don't have.
-                    new_patches = self.api.get_newest_patches(len(data))
-                    ps_data = new_patches + data
-
-            # Create/update the data file with the new data.
-            with open(os.path.join(self.path, "data.json"),
-                      "w") as f:
-                f.write(json.dumps(ps_data))
-                self.data_PS = ps_data
+            # Only retrieve the patches that were uploaded or modified
+            # since the last time the application was launched.
+            self.data_PS = self.sync.sync()
         except:
             # Let the user know if an internet connect can't be established.
             self.msg.setWindowTitle("No Internet Connection")
@@ -102,12 +86,24 @@ class ZOIALibrarianPS(QMainWindow):
         # Execute
         self.worker_ps.start()
 
+    def _reload_ps_progress(self, done, total):
+        """ Progress update provided by the worker to display how
+        many pages of patches have been retrieved.
+
+        done: The number of pages retrieved so far.
+        total: The total number of pages being retrieved.
+        """
+
+        self.ui.statusbar.showMessage(
+            "Retrieved page {} of {}".format(done, total))
+
     def _reload_ps_done(self):
         """ Notifies the user once all PatchStorage patches have been
         retrieved.
         """
 
         # Set the data and notify the user via a popup.
+        self.data_PS = self.worker_ps.get_data()
         self.ui.searchbar_PS.setText("")
         self.sort_and_set()
         self.ui.btn_dwn_all.setEnabled(True)
@@ -134,16 +130,16 @@ class ZOIALibrarianPS(QMainWindow):
         # Execute
         self.worker_dwn.start()
 
-    def _download_all_progress(self, i):
+    def _download_all_progress(self, done, total):
         """ Progress update provided by the worker to display how
         many patches have been downloaded.
 
-        i: The current patch that is being downloaded.
+        done: The number of patches that have been dealt with.
+        total: The number of patches that are being downloaded.
         """
 
         self.ui.statusbar.showMessage(
-            "Trying to download patch #{} of {}".format(
-                i + 1, self.ui.table_PS.rowCount()))
+            "Downloaded patch #{} of {}".format(done, total))
 
     def _download_all_done(self, cnt, fails):
         """ Notifies the user once all PatchStorage patches have been
@@ -167,7 +163,36 @@ class ZOIALibrarianPS(QMainWindow):
         self.msg.exec_()
         self.msg.setInformativeText(None)
 
-        # Re-enable the necessary UI components.
+        # Refresh the download buttons, then re-enable the necessary UI
+        # components.
+        self.sort_and_set()
+        self._download_all_enable()
+
+    def _download_all_failed(self):
+        """ Notifies the user should the connection to PatchStorage be
+        lost while downloading all patches. The patches that have yet
+        to be downloaded are kept, so that the download resumes the
+        next time it is started.
+        """
+
+        # Let the user know if an internet connect can't be established.
+        self.msg.setWindowTitle("No Internet Connection")
+        self.msg.setIcon(QMessageBox.Information)
+        self.msg.setText("Failed to download patches from PatchStorage.\n"
+                         "Please check your internet connection and try "
+                         "again.")
+        self.msg.setStandardButtons(QMessageBox.Ok)
+        self.msg.exec_()
+        self.msg.setInformativeText(None)
+
+        self.sort_and_set()
+        self._download_all_enable()
+
+    def _download_all_enable(self):
+        """ Re-enables the UI components that were disabled while all
+        patches were being downloaded.
+        """
+
         self.ui.statusbar.showMessage("", timeout=10)
         self.ui.btn_dwn_all.setEnabled(True)
         self.ui.refresh_pch_btn.setEnabled(True)
@@ -231,7 +256,7 @@ class ZOIALibrarianPS(QMainWindow):
         dwn.setFont(self.ui.table_PS.horizontalHeader().font())
         dwn.clicked.connect(self.initiate_download)
         # Only enable it if we haven't already downloaded the patch.
-        if idx in os.listdir(self.path):
+        if os.path.isdir(self.save.patch_path(idx)):
             dwn.setEnabled(False)
             dwn.setText("Downloaded!")
         self.ui.table_PS.setCellWidget(i, 4, dwn)
@@ -244,6 +269,19 @@ class ZOIALibrarianPS(QMainWindow):
 
         return self.data_PS
 
+    def get_meta_ps(self, idx):
+        """ Getter method to get the complete metadata for a patch in
+        the PS table, which is only kept on disk.
+
+        idx: The id of the patch.
+
+        return: The patch metadata, or None if it isn't available.
+        """
+
+        meta = meta_cache.get(int(idx), self.sync.catalog.meta)
+
+        return None if meta is None else dict(meta)
+
 
 class DownloadAllWorker(QThread):
     """ The DownloadAllWorker class runs as a separate thread in the
@@ -253,20 +291,23 @@ class DownloadAllWorker(QThread):
 
     # UI communication
     signal = QtCore.Signal(int, int)
-    signal_2 = QtCore.Signal(int)
+    signal_2 = QtCore.Signal(int, int)
+    signal_3 = QtCore.Signal()
 
-    def __init__(self, ui, save, api):
+    def __init__(self, engine, f_data, path):
         """ Initializes the thread.
 
-        ui: The UI component of ZOIALibrarianMain.
-        save: Backend class to aid with the saving of patches.
-        api: Backend class to aid with PS API requests.
+        engine: Backend class to aid with downloading many patches.
+        f_data: Provides access to the get_data_ps() method located in
+                the ZOIALibrarianPS class.
+        path: A String representing the path to the backend application
+              directory.
         """
 
         QThread.__init__(self)
-        self.ui = ui
-        self.save = save
-        self.api = api
+        self.engine = engine
+        self.get_data_ps = f_data
+        self.path = path
 
         self.fails = 0
         self.cnt = 0
@@ -274,37 +315,23 @@ class DownloadAllWorker(QThread):
     def run(self):
         """ Attempts to download all patches currently stored on
         PatchStorage. This method will ignore failures and continue
-        on to the next patch until it has exhausted the list.
+        on to the next patch until it has exhausted the list. Should a
+        previous attempt have been interrupted, it is resumed instead.
         """
 
         try:
-            self.fails = 0
-            self.cnt = 0
-
-            for i in range(self.ui.table_PS.rowCount()):
-                btn = self.ui.table_PS.cellWidget(i, 4)
-                if btn.isEnabled():
-                    # Try to download the patch.
-                    try:
-                        self.save.save_to_backend(self.api.download(
-                            btn.objectName()))
-                        btn.setEnabled(False)
-                        btn.setText("Downloaded!")
-                        self.cnt += 1
-                    except errors.SavingError:
-                        self.fails += 1
-                    self.signal_2.emit(i)
+            if not self.engine.pending():
+                # Queue every patch that hasn't been downloaded yet.
+                downloaded = set(self.engine.patch_ids())
+                self.engine.enqueue(
+                    [str(pch["id"]) for pch in self.get_data_ps()
+                     if str(pch["id"]) not in downloaded])
+
+            self.cnt, self.fails = self.engine.run(self.signal_2.emit)
             self.signal.emit(self.cnt, self.fails)
         except:
-            # Let the user know if an internet connect can't be established.
-            self.msg.setWindowTitle("No Internet Connection")
-            self.msg.setIcon(QMessageBox.Information)
-            self.msg.setText("Failed to download patches from PatchStorage.\n"
-                             "Please check your internet connection and try"
-                             "again.")
-            self.msg.setStandardButtons(QMessageBox.Ok)
-            self.msg.exec_()
-            self.msg.setInformativeText(None)
+            # The queue is kept, so the next attempt resumes from here.
+            self.signal_3.emit()
 
 
 class ReloadPSWorker(QThread):
@@ -315,28 +342,26 @@ class ReloadPSWorker(QThread):
 
     # UI communication
     signal = QtCore.Signal()
+    signal_2 = QtCore.Signal(int, int)
 
-    def __init__(self, path, api):
+    def __init__(self, sync):
         """ Initializes the thread.
 
-        path: A string to the backend .ZoiaLibraryApp directory.
-        api: Backend class to aid with PS API requests.
+        sync: Backend class to aid with syncing the PS catalog.
         """
 
         QThread.__init__(self)
-        self.path = path
-        self.api = api
+        self.sync = sync
+        self.data = None
 
     def run(self):
-        """ Attempts to download all patches currently stored on
-        PatchStorage. This method will ignore failures and continue
-        on to the next patch until it has exhausted the list.
+        """ Attempts to retrieve the metadata for all patches currently
+        stored on PatchStorage, replacing the local catalog.
         """
 
         # Try to download the patch.
         try:
-            with open(os.path.join(self.path, "data.json"), "w") as f:
-                f.write(json.dumps(self.api.get_all_patch_data_init()))
+            self.data = self.sync.sync(True, self.signal_2.emit)
             self.signal.emit()
         except:
             # Let the user know if an internet connect can't be established.
@@ -348,3 +373,11 @@ class ReloadPSWorker(QThread):
             self.msg.setStandardButtons(QMessageBox.Ok)
             self.msg.exec_()
             self.msg.setInformativeText(None)
+
+    def get_data(self):
+        """ Getter method to get the catalog retrieved by the thread.
+
+        return: The PatchStorage data as a list.
+        """
+
+        return self.data
@@ -3,7 +3,8 @@ import platform
 from PySide2.QtGui import QFont
 from PySide2.QtWidgets import QFontDialog, QApplication
 import os
-import json
+
+from zoia_lib.backend.utilities import write_json
 
 
 class ZOIALibrarianUtil:
@@ -237,10 +238,9 @@ class ZOIALibrarianUtil:
         }
 
         # Write the data to pref.json for subsequent launches.
-        with open(os.path.join(path, "pref.json"), "w") as f:
-            f.write(json.dumps([window, ps_sizes, local_sizes,
-                                sd_sizes, bank_sizes, dark_mode,
-                                row_invert]))
+        write_json(os.path.join(path, "pref.json"),
+                   [window, ps_sizes, local_sizes, sd_sizes, bank_sizes,
+                    dark_mode, row_invert])
 
     def toggle_dark(self):
         """ Toggles the theme for the application.
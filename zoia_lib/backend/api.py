@@ -1,15 +1,82 @@
+import hashlib
 import json
 import math
 import os
-from urllib.request import urlopen, Request
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 
 import certifi
 import urllib3
-from bs4 import BeautifulSoup
 from furl import furl
-from numpy import unicode
 
-http = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
+from zoia_lib.backend.api_cache import ResponseCache
+from zoia_lib.backend.api_throttle import RateLimiter, RetryPolicy
+
+# Base URL of the PS API. Can be pointed elsewhere (e.g. a local
+# stand-in server) via the ZOIA_PS_URL environment variable.
+API_URL = os.environ.get('ZOIA_PS_URL', 'https://patchstorage.com/api/alpha/')
+
+# Upper bound on the number of requests made to PS at the same time.
+# The pool manager keeps that many connections alive so that concurrent
+# page requests can reuse them instead of opening new ones.
+MAX_WORKERS = 8
+
+# Seconds to wait for a connection to PS and for each read from it.
+TIMEOUT = urllib3.Timeout(connect=5.0, read=30.0)
+
+# Average number of requests per second made to PS, across every
+# PatchStorage instance and thread.
+RATE = 10
+
+# Number of redirects followed per request.
+MAX_REDIRECTS = 5
+
+# Retries are handled by retry_policy, which also covers 429 and 5xx
+# responses and shares its backoff with the rate limiter, so urllib3
+# raises connection and read errors straight away and leaves Retry-After
+# to it. Redirects (e.g. http to https) are still followed. The total
+# bounds the errors urllib3 has no separate count for.
+http = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where(),
+                           maxsize=MAX_WORKERS, timeout=TIMEOUT,
+                           retries=urllib3.Retry(
+                               total=MAX_REDIRECTS, connect=False,
+                               read=False, status=0,
+                               redirect=MAX_REDIRECTS,
+                               respect_retry_after_header=False))
+
+rate_limiter = RateLimiter(RATE, MAX_WORKERS)
+retry_policy = RetryPolicy(rate_limiter,
+                           exceptions=(urllib3.exceptions.HTTPError,))
+
+# Number of seconds the patch count is reused for before PS is asked
+# for it again.
+COUNT_TTL = 300
+
+# Number of bytes read at a time when streaming a patch file to disk.
+CHUNK_SIZE = 64 * 1024
+
+# On-disk cache shared by every PatchStorage instance. Only created once
+# a request goes through it, as it sets up the backend directory.
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def response_cache():
+    """ Retrieves the on-disk cache shared by every PatchStorage
+    instance, creating it the first time.
+
+    return: The shared ResponseCache.
+    """
+
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+
+        return _response_cache
 
 
 class PatchStorage:
@@ -21,20 +88,106 @@ class PatchStorage:
         https://patchstorage.com/docs/
     """
 
-    def __init__(self):
+    def __init__(self, workers=MAX_WORKERS, use_cache=True, url=API_URL):
         """ Initializes the PatchStorage class.
+
+        workers: Optional. The maximum number of requests that will be
+                 made concurrently when multiple pages of metadata are
+                 retrieved. Capped at MAX_WORKERS.
+        use_cache: Optional. False to bypass the on-disk response cache.
+        url: Optional. The base URL of the PS API.
         """
 
         # Set defaults for query params
-        self.url = 'https://patchstorage.com/api/alpha/'
+        self.url = url if url.endswith('/') else url + '/'
         self.platform = 3003  # ZOIA
-        try:
-            self.patch_count = self._determine_patch_count()
-        except:
-            # No internet connection.
-            pass
+        self.workers = max(1, min(workers, MAX_WORKERS))
+        self.use_cache = use_cache
+
+        # The patch count is only retrieved once something asks for it,
+        # so that creating this class never touches the network.
+        self._patch_count = None
+        self._patch_count_time = 0
+
+    @property
+    def patch_count(self):
+        """ The number of ZOIA patches currently stored on PS. The
+        count is retrieved the first time it is needed and reused until
+        it is older than COUNT_TTL seconds.
+
+        return: An integer representing the total of ZOIA patches.
+        """
+
+        if self._patch_count is None or \
+                time.monotonic() - self._patch_count_time > COUNT_TTL:
+            self._patch_count = self._determine_patch_count()
+            self._patch_count_time = time.monotonic()
+
+        return self._patch_count
+
+    @property
+    def cache(self):
+        """ The on-disk response cache, or None if it is bypassed.
+        """
+
+        return response_cache() if self.use_cache else None
+
+    def batch(self):
+        """ Groups several requests, such that the response cache only
+        writes its index once they are done. See ResponseCache.batch().
+
+        return: A context manager.
+        """
+
+        return nullcontext() if self.cache is None else self.cache.batch()
 
-    def _search(self, more_params=None):
+    def _get(self, url, immutable=False):
+        """ Makes a GET request to PS. Responses are kept in the on-disk
+        response cache, so repeated requests for the same URL only cost
+        a conditional request, or no request at all.
+
+        url: The URL to request.
+        immutable: Optional. True if the content behind the URL never
+                   changes, so that a cached copy can be used as is.
+
+        return: The response, with the body available via its data
+                attribute.
+        """
+
+        if self.cache is None:
+            return self._fetch(url, {})
+
+        return self.cache.request(url, self._fetch, immutable)
+
+    @staticmethod
+    def _fetch(url, headers):
+        """ Makes a GET request to PS, bypassing the response cache.
+        Every attempt is subject to the shared rate limiter, and
+        transient failures are retried with exponential backoff.
+
+        url: The URL to request.
+        headers: A dict of additional request headers.
+
+        return: The urllib3 response.
+        """
+
+        return retry_policy.call(
+            lambda: http.request('GET', url, headers=headers))
+
+    def stats(self):
+        """ Reports on the traffic between the application and PS.
+
+        return: A dict containing the retry, throttling and (if in use)
+                response cache counters.
+        """
+
+        stats = {**retry_policy.stats(), **rate_limiter.stats()}
+        if self.cache is not None:
+            stats.update(self.cache.stats())
+
+        return stats
+
+    def _search(self, more_params=None, cached=True):
         """ Make a query to the PS API.
         Default args:
             - page (int): current page, default 1
@@ -68,9 +221,25 @@ class PatchStorage:
         Beta 3 of the ZOIA Librarian. Should the implementation be
         needed, please consult the repo for the previous implementation.
 
+        cached: Optional. False to bypass the response cache, for
+                queries whose results must be current.
+
         return: The retrieved metadata in JSON form.
         """
 
+        # make request
+        url = self._search_url(more_params)
+        r = self._get(url) if cached else self._fetch(url, {})
+
+        return json.loads(r.data)
+
+    def _search_url(self, more_params=None):
+        """ Builds the URL used to query the PS API. See _search() for
+        the supported args.
+
+        return: The URL for the query, as a string.
+        """
+
         if more_params is None:
             more_params = {}
         endpoint = os.path.join(self.url, 'patches/')
@@ -86,11 +255,7 @@ class PatchStorage:
 
         params = {**default_params, **more_params}
 
-        # make request
-        url = str(furl(endpoint).add(params))
-        r = http.request('GET', url)
-
-        return json.loads(r.data)
+        return str(furl(endpoint).add(params))
 
     def get_patch_meta(self, idx: str):
         """ Get the metadata associated with a specific
@@ -104,14 +269,18 @@ class PatchStorage:
         endpoint = os.path.join(self.url, 'patches/{}/'.format(idx))
 
         # Make the request
-        raw_data = json.loads(http.request('GET', endpoint).data)
+        raw_data = json.loads(self._get(endpoint).data)
 
         # Return the metadata
         return raw_data
 
-    def download(self, idx: str):
+    def download(self, idx: str, meta=None):
         """ Download a file using patch id
 
+        idx: The id of the patch that will be downloaded.
+        meta: Optional. The metadata for the patch, if it has already
+              been retrieved. Otherwise, it is retrieved from PS.
+
         Returns: The raw binary data for the patch if it was found,
                  None otherwise.
         """
@@ -122,17 +291,130 @@ class PatchStorage:
             return None
 
         try:
-            body = self.get_patch_meta(idx)
-            f = http.request('GET', str(body['files'][0]['url'])).data, body
+            body = self.get_patch_meta(idx) if meta is None else meta
+            # Uploading a new file gives it a new URL, so the contents
+            # behind a file URL never change.
+            f = self._get(str(body['files'][0]['url']), True).data, body
             return f
         except KeyError:
             # No patch with the supplied id was found.
             return None
 
-    def get_all_patch_data_init(self):
+    def download_to_file(self, idx: str, directory, meta=None):
+        """ Download a file using patch id, streaming it straight to disk
+        so that it never has to be held in memory, and computing its
+        SHA-256 digest along the way.
+
+        idx: The id of the patch that will be downloaded.
+        directory: The directory the file will be downloaded to. It
+                   should be on the same filesystem as the backend, so
+                   that the file can be moved into place.
+        meta: Optional. The metadata for the patch, if it has already
+              been retrieved. Otherwise, it is retrieved from PS.
+
+        Returns: A tuple containing the path to the downloaded file, the
+                 patch metadata and the digest as a hex string if the
+                 patch was found, None otherwise. The caller is
+                 responsible for removing the file.
+        """
+
+        # Patches stored on PS use a 6-digit unique id number.
+        if idx is None or len(idx) != 6:
+            return None
+
+        try:
+            body = self.get_patch_meta(idx) if meta is None else meta
+            url = str(body['files'][0]['url'])
+        except KeyError:
+            # No patch with the supplied id was found.
+            return None
+
+        fd, path = tempfile.mkstemp(suffix=".part", dir=directory)
+        os.close(fd)
+        try:
+            digest = self._stream(url, path)
+        except BaseException:
+            os.remove(path)
+            raise
+        if digest is None:
+            os.remove(path)
+            return None
+
+        return path, body, digest
+
+    def _stream(self, url, path):
+        """ Streams the content behind a file URL to disk, copying it
+        from the response cache instead if it was downloaded before.
+
+        url: The URL of the file.
+        path: The path the file will be written to.
+
+        return: The SHA-256 digest of the file as a hex string, or None
+                if PS could not supply the file.
+        """
+
+        cached = None if self.cache is None else self.cache.lookup_file(url)
+        if cached is not None:
+            try:
+                with open(cached, "rb") as f:
+                    return self._write_chunks(
+                        iter(lambda: f.read(CHUNK_SIZE), b""), path)
+            except FileNotFoundError:
+                # Evicted in the meantime.
+                pass
+
+        digest = None
+
+        def request():
+            nonlocal digest
+            r = http.request('GET', url, preload_content=False)
+            try:
+                if r.status == 200:
+                    # Starts over from scratch should the request be
+                    # retried part way through.
+                    digest = self._write_chunks(r.stream(CHUNK_SIZE), path)
+                else:
+                    r.read()
+            finally:
+                r.release_conn()
+            return r
+
+        r = retry_policy.call(request)
+        if r.status != 200:
+            return None
+
+        if self.cache is not None:
+            self.cache.store_file(url, path, r.headers)
+
+        return digest
+
+    @staticmethod
+    def _write_chunks(chunks, path):
+        """ Writes chunks of data to a file, hashing them as they are
+        written.
+
+        chunks: An iterable of bytes objects.
+        path: The path to the file that will be written.
+
+        return: The SHA-256 digest of the data as a hex string.
+        """
+
+        digest = hashlib.sha256()
+        with open(path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def get_all_patch_data_init(self, progress=None):
         """ Retrieves the initial amount of information needed for
         display purposes once the user starts the application.
 
+        progress: Optional. A function that is called with the number of
+                  pages retrieved so far and the total number of pages
+                  each time a page finishes downloading.
+
         return: A list of data, where each item contains the
                  information outlined above.
         """
@@ -142,35 +424,115 @@ class PatchStorage:
             'per_page': per_page
         }
 
-        all_patches = []
+        return self._search_pages(search,
+                                  math.ceil(self.patch_count / per_page),
+                                  progress)
+
+    def _search_pages(self, params, pages, progress=None):
+        """ Queries the PS API for several pages of the same search at
+        once.
 
-        for page in range(1, math.ceil(self.patch_count / per_page) + 1):
-            # Get all the patches on the current page.
-            all_patches.extend(self._search({**search, **{'page': page}}))
+        params: The query parameters shared by every page.
+        pages: The number of pages to retrieve, starting from page 1.
+        progress: Optional. A function that is called with the number of
+                  pages retrieved so far and the total number of pages
+                  each time a page finishes downloading.
+
+        return: The metadata for every page, concatenated in page order.
+        """
 
-        return all_patches
+        return self._search_many([{**params, **{'page': page}}
+                                  for page in range(1, pages + 1)], progress)
 
-    def get_potential_updates(self, meta):
+    def _search_many(self, queries, progress=None, cached=True):
+        """ Makes several queries to the PS API at once. Up to
+        self.workers requests are in flight at any given time, all of
+        which share the connections held by the module level pool
+        manager.
+
+        queries: A list of query parameters, one per request.
+        progress: Optional. A function that is called with the number of
+                  queries completed so far and the total number of
+                  queries each time one finishes.
+        cached: Optional. False to bypass the response cache.
+
+        return: The metadata returned by every query, concatenated in
+                the order the queries were supplied.
+        """
+
+        if len(queries) == 0:
+            return []
+
+        results = [None] * len(queries)
+        with self.batch(), ThreadPoolExecutor(
+                max_workers=min(self.workers, len(queries))) as executor:
+            futures = {
+                executor.submit(self._search, query, cached): i
+                for i, query in enumerate(queries)
+            }
+            done = 0
+            for future in as_completed(futures):
+                # Queries finish in any order, so slot each one back into
+                # the position it was requested for.
+                results[futures[future]] = future.result()
+                done += 1
+                if progress is not None:
+                    progress(done, len(queries))
+
+        return [pch for page in results for pch in page]
+
+    def get_patch_meta_batch(self, ids):
+        """ Get the metadata associated with several patch IDs, using
+        a single request for every 100 IDs.
+
+        ids: A list of the ids that the metadata will be retrieved for.
+
+        return: A list containing the metadata for every patch that was
+                found on PS. Patches that no longer exist are omitted.
+        """
+
+        per_page = 100
+        ids = [str(idx) for idx in ids]
+
+        return self._search_many([{
+            'include': ",".join(ids[i:i + per_page]),
+            'per_page': per_page
+        } for i in range(0, len(ids), per_page)])
+
+    def get_potential_updates(self, meta, directory):
         """ Queries the PS API for all patches that have an updated_at
         attribute that is more recent than the one present for patches
-        that have been previously downloaded.
+        that have been previously downloaded, and streams them to disk.
 
         meta: An array containing the id and updated_at attributes for
               patches that may need to be updated.
+        directory: The directory the patches will be downloaded to, see
+                   download_to_file().
 
-        return: An array containing the metadata and binaries for all
-                 patches that had been updated.
+        return: An array containing the tuples returned by
+                download_to_file() for all patches that had been
+                updated. The caller is responsible for removing the
+                files.
         """
 
+        # Retrieve the current metadata for every patch in bulk.
+        curr = {str(pch["id"]): pch for pch in self.get_patch_meta_batch(
+            [entry["id"] for entry in meta])}
+
         new_bin = []
 
         for entry in meta:
             idx = str(entry["id"])
-            curr_meta = self.get_patch_meta(idx)
+            if idx not in curr:
+                # The patch is no longer hosted on PS.
+                continue
+            curr_meta = curr[idx]
             # Check to see if the patch has been updated by comparing
             # the dates.
             if curr_meta["updated_at"] > entry["updated_at"]:
-                new_bin.append((self.download(idx), curr_meta))
+                patch = self.download_to_file(idx, directory, curr_meta)
+                if patch is not None:
+                    new_bin.append(patch)
 
         return new_bin
 
@@ -194,51 +556,77 @@ class PatchStorage:
             'per_page': per_page
         }
 
-        new_patches = []
-        pages = 2
         # Find out how many pages of patches there are.
+        pages = 1
         if per_page == 100:
-            pages = math.ceil((self.patch_count - pch_num) / 100) + 1
+            pages = math.ceil((self.patch_count - pch_num) / 100)
 
         # Query for each page of patches we need to retrieve.
-        if pages == 2:
-            return self._search({**search, **{'page': 1}})
-        else:
-            for i in range(1, pages):
-                new_patches.extend(self._search({**search, **{'page': i}}))
-            return new_patches
+        return self._search_pages(search, pages)
 
-    @staticmethod
-    def _determine_patch_count():
-        """ Determines the number of ZOIA patches that
-        are currently being stored on PS.
-        Does not count questions as patches.
+    def get_patch_ids(self):
+        """ Lists the ids of every ZOIA patch on PS, without the rest of
+        their metadata. The listing is never served from the response
+        cache, as it is used to find the patches that were deleted.
 
-        return: An integer representing the total of ZOIA patches.
+        return: A list of patch ids, as ints.
         """
 
-        # Hi PS, yes we are a normal Firefox browser and not a program.
-        soup_patch = BeautifulSoup(urlopen(Request(
-            "https://patchstorage.com/", headers={"User-Agent": "Mozilla/5.0"})
-        ).read(), "html.parser")
-        found_pedals = soup_patch.find_all(class_="d-flex flex-column "
-                                                  "justify-content-center")
+        per_page = 100
+        pages = math.ceil(self.patch_count / per_page)
 
-        """ Convert the ResultSet to a string so we can split on what we are 
-        looking for. The PS website does not have unique div names, so this
-        is to workaround that.
+        return [pch["id"] for pch in self._search_many(
+            [{'per_page': per_page, 'page': page, '_fields': 'id'}
+             for page in range(1, pages + 1)], cached=False)]
+
+    def get_modified_patches(self, since):
+        """ Queries the PS API for every patch that was uploaded or
+        modified at or after a given date. Patches are requested in
+        order of their modification date, newest first, and the
+        querying stops at the first patch older than the date.
+
+        The API's after arg only filters on the date a patch was
+        published, so it would miss edits to older patches.
+
+        since: An ISO8601 date, as found in the updated_at attribute.
+
+        return: A list of patch metadata for the patches that changed.
+        """
+
+        per_page = 100
+        search = {
+            'per_page': per_page,
+            'orderby': 'modified'
+        }
+
+        changed = []
+        page = 1
+        while True:
+            # A cached page could be missing the latest changes.
+            patches = self._search({**search, **{'page': page}},
+                                   cached=False)
+            for pch in patches:
+                if pch["updated_at"] < since:
+                    # Everything past this point is already known.
+                    return changed
+                changed.append(pch)
+            if len(patches) < per_page:
+                return changed
+            page += 1
+
+    def _determine_patch_count(self):
+        """ Determines the number of ZOIA patches that
+        are currently being stored on PS.
+
+        The PS API reports the total number of results for a query in
+        the X-WP-Total header, so a query for a single patch is enough
+        to learn how many patches the full catalog query will return.
+
+        return: An integer representing the total of ZOIA patches.
         """
-        zoia = unicode.join(u'\n', map(unicode, found_pedals)
-                            ).split("ZOIA", 1)[1].split("<strong>", 1)[1]
 
-        # For some reason, questions posted on PS count as "patches",
-        # so we need to figure out the # of questions.
-        soup_ques = BeautifulSoup(
-            urlopen(Request(
-                "https://patchstorage.com/platform/zoia/?search_query=&ptype"
-                "%5B%5D=question&tax_platform=zoia&tax_post_tag=&orderby"
-                "=modified&wpas_id=search_form&wpas_submit=1",
-                headers={"User-Agent": "Mozilla/5.0"})).read(), "html.parser")
+        # A cached response would report the total at the time it was
+        # cached.
+        r = self._fetch(self._search_url({'per_page': 1}), {})
 
-        # Return the total minus the number of questions found.
-        return int(zoia[:3]) - len(soup_ques.find_all(class_="card"))
+        return int(r.headers['X-WP-Total'])
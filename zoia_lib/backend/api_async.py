@@ -0,0 +1,529 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import ssl
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+import aiohttp
+import certifi
+
+from zoia_lib.backend.api import API_URL, CHUNK_SIZE, COUNT_TTL, \
+    PatchStorage, rate_limiter, retry_policy
+from zoia_lib.backend.api_throttle import RETRY_STATUSES
+
+# Upper bound on the number of requests in flight at the same time.
+# This only bounds the open connections: new requests are started no
+# faster than the shared rate limiter allows (RATE per second, in bursts
+# of MAX_WORKERS), whatever the concurrency. Beyond that, a higher limit
+# only helps requests that are slow to complete, e.g. large downloads.
+MAX_CONCURRENCY = 100
+
+
+class AsyncPatchStorage:
+    """ The AsyncPatchStorage class is an asyncio based counterpart to
+    the PatchStorage class, offering the same queries as coroutines.
+    Every request is subject to the same rate limiter and retry policy
+    as PatchStorage, so the two can be used side by side.
+
+    It should be used as an async context manager, e.g.:
+        async with AsyncPatchStorage() as ps:
+            data = await ps.get_all_patch_data_init()
+
+    Code that isn't async yet can use BlockingPatchStorage instead.
+    """
+
+    # Queries are built exactly as they are for PatchStorage.
+    _search_url = PatchStorage._search_url
+
+    def __init__(self, concurrency=MAX_CONCURRENCY, url=API_URL):
+        """ Initializes the AsyncPatchStorage class.
+
+        concurrency: Optional. The maximum number of requests in flight
+                     at the same time. Requests are still started no
+                     faster than the shared rate limiter allows.
+        url: Optional. The base URL of the PS API.
+        """
+
+        self.url = url if url.endswith('/') else url + '/'
+        self.platform = 3003  # ZOIA
+        self.concurrency = max(1, concurrency)
+
+        self._patch_count = None
+        self._patch_count_time = 0
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """ Closes the connections held by the client.
+        """
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, url, handle):
+        """ Makes a GET request to PS, taking a token from the shared
+        rate limiter for every attempt and retrying transient failures
+        with exponential backoff.
+
+        url: The URL to request.
+        handle: A coroutine function taking the response, which reads
+                what it needs from the body and returns the result.
+
+        return: A tuple containing the status of the response and the
+                result returned by handle.
+        """
+
+        if self._session is None:
+            # The session must be created from within the event loop.
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.concurrency,
+                    ssl=ssl.create_default_context(cafile=certifi.where())),
+                timeout=aiohttp.ClientTimeout(sock_connect=5, sock_read=30))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        attempt = 0
+        while True:
+            wait = rate_limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            try:
+                async with self._semaphore, self._session.get(url) as r:
+                    if r.status not in RETRY_STATUSES:
+                        return r.status, await handle(r)
+                    if attempt >= retry_policy.max_retries:
+                        retry_policy.record(gave_up=1)
+                        return r.status, await handle(r)
+                    delay = retry_policy.delay(
+                        attempt, r.headers.get("Retry-After"))
+                    if r.status == 429:
+                        # Slow every other request down as well.
+                        rate_limiter.pause(delay)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= retry_policy.max_retries:
+                    retry_policy.record(gave_up=1)
+                    raise
+                delay = retry_policy.delay(attempt)
+
+            retry_policy.record(retried=1)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _get_json(self, url):
+        """ Makes a GET request to PS for JSON data.
+
+        url: The URL to request.
+
+        return: A tuple containing the decoded JSON and the headers of
+                the response.
+        """
+
+        async def handle(r):
+            return json.loads(await r.read()), r.headers
+
+        return (await self._request(url, handle))[1]
+
+    async def _search(self, more_params=None):
+        """ Make a query to the PS API. See PatchStorage._search() for
+        the supported args.
+
+        return: The retrieved metadata in JSON form.
+        """
+
+        return (await self._get_json(self._search_url(more_params)))[0]
+
+    async def get_patch_count(self):
+        """ Retrieves the number of ZOIA patches currently stored on PS,
+        reusing the previous count until it is older than COUNT_TTL
+        seconds.
+
+        return: An integer representing the total of ZOIA patches.
+        """
+
+        if self._patch_count is None or \
+                time.monotonic() - self._patch_count_time > COUNT_TTL:
+            headers = (await self._get_json(
+                self._search_url({'per_page': 1})))[1]
+            self._patch_count = int(headers['X-WP-Total'])
+            self._patch_count_time = time.monotonic()
+
+        return self._patch_count
+
+    async def get_patch_meta(self, idx: str):
+        """ Get the metadata associated with a specific patch ID.
+
+        idx: The id that the metadata will be retrieved for.
+
+        return: The metadata for the patch, in a MetadataSchema
+                 compliant form.
+        """
+
+        return (await self._get_json(
+            os.path.join(self.url, 'patches/{}/'.format(idx))))[0]
+
+    async def download(self, idx: str, meta=None):
+        """ Download a file using patch id.
+
+        idx: The id of the patch that will be downloaded.
+        meta: Optional. The metadata for the patch, if it has already
+              been retrieved. Otherwise, it is retrieved from PS.
+
+        Returns: A tuple containing the raw binary data and the metadata
+                 for the patch if it was found, None otherwise.
+        """
+
+        # Patches stored on PS use a 6-digit unique id number.
+        if idx is None or len(idx) != 6:
+            return None
+
+        try:
+            body = await self.get_patch_meta(idx) if meta is None else meta
+            url = str(body['files'][0]['url'])
+        except KeyError:
+            # No patch with the supplied id was found.
+            return None
+
+        async def handle(r):
+            return await r.read()
+
+        status, data = await self._request(url, handle)
+
+        return (data, body) if status == 200 else None
+
+    async def download_to_file(self, idx: str, directory, meta=None):
+        """ Download a file using patch id, streaming it straight to disk
+        and computing its SHA-256 digest along the way. See
+        PatchStorage.download_to_file().
+
+        idx: The id of the patch that will be downloaded.
+        directory: The directory the file will be downloaded to.
+        meta: Optional. The metadata for the patch, if it has already
+              been retrieved. Otherwise, it is retrieved from PS.
+
+        Returns: A tuple containing the path to the downloaded file, the
+                 patch metadata and the digest as a hex string if the
+                 patch was found, None otherwise.
+        """
+
+        if idx is None or len(idx) != 6:
+            return None
+
+        try:
+            body = await self.get_patch_meta(idx) if meta is None else meta
+            url = str(body['files'][0]['url'])
+        except KeyError:
+            return None
+
+        fd, path = tempfile.mkstemp(suffix=".part", dir=directory)
+        os.close(fd)
+
+        async def handle(r):
+            if r.status != 200:
+                return None
+            # Start over from scratch should the request be retried part
+            # way through.
+            open(path, "wb").close()
+            digest = hashlib.sha256()
+            chunks = []
+            async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                digest.update(chunk)
+                chunks.append(chunk)
+                if len(chunks) == 16:
+                    # Write in batches, off the event loop.
+                    await self._write(path, chunks)
+                    chunks = []
+            await self._write(path, chunks)
+            return digest.hexdigest()
+
+        try:
+            digest = (await self._request(url, handle))[1]
+        except BaseException:
+            os.remove(path)
+            raise
+        if digest is None:
+            os.remove(path)
+            return None
+
+        return path, body, digest
+
+    @staticmethod
+    async def _write(path, chunks):
+        """ Appends chunks of data to a file without blocking the event
+        loop.
+
+        path: The path to the file.
+        chunks: A list of bytes objects.
+        """
+
+        def write():
+            with open(path, "ab") as f:
+                f.writelines(chunks)
+
+        await asyncio.get_running_loop().run_in_executor(None, write)
+
+    async def get_all_patch_data_init(self, progress=None):
+        """ Retrieves the metadata for every ZOIA patch on PS, requesting
+        every page at once.
+
+        progress: Optional. A function that is called with the number of
+                  pages retrieved so far and the total number of pages
+                  each time a page finishes downloading.
+
+        return: A list of patch metadata.
+        """
+
+        per_page = 100
+        pages = math.ceil(await self.get_patch_count() / per_page)
+
+        return await self._search_many(
+            [{'per_page': per_page, 'page': page}
+             for page in range(1, pages + 1)], progress)
+
+    async def _search_many(self, queries, progress=None):
+        """ Makes several queries to the PS API at once.
+
+        queries: A list of query parameters, one per request.
+        progress: Optional. A function that is called with the number of
+                  queries completed so far and the total number of
+                  queries each time one finishes.
+
+        return: The metadata returned by every query, concatenated in
+                the order the queries were supplied.
+        """
+
+        async def search(i, query):
+            return i, await self._search(query)
+
+        tasks = [asyncio.ensure_future(search(i, query))
+                 for i, query in enumerate(queries)]
+        results = [None] * len(queries)
+        done = 0
+        try:
+            for future in asyncio.as_completed(tasks):
+                i, page = await future
+                results[i] = page
+                done += 1
+                if progress is not None:
+                    progress(done, len(queries))
+        except BaseException:
+            # Don't leave the other queries running in the background.
+            await _cancel(tasks)
+            raise
+
+        return [pch for page in results for pch in page]
+
+    async def get_patch_meta_batch(self, ids):
+        """ Get the metadata associated with several patch IDs, using
+        a single request for every 100 IDs.
+
+        ids: A list of the ids that the metadata will be retrieved for.
+
+        return: A list containing the metadata for every patch that was
+                found on PS.
+        """
+
+        per_page = 100
+        ids = [str(idx) for idx in ids]
+
+        return await self._search_many([{
+            'include': ",".join(ids[i:i + per_page]),
+            'per_page': per_page
+        } for i in range(0, len(ids), per_page)])
+
+    async def get_potential_updates(self, meta, directory):
+        """ Queries the PS API for all patches that have an updated_at
+        attribute that is more recent than the one present for patches
+        that have been previously downloaded, and streams them all to
+        disk at once. See PatchStorage.get_potential_updates().
+
+        meta: An array containing the id and updated_at attributes for
+              patches that may need to be updated.
+        directory: The directory the patches will be downloaded to.
+
+        return: An array containing the tuples returned by
+                download_to_file() for all patches that had been
+                updated. The caller is responsible for removing the
+                files.
+        """
+
+        curr = {str(pch["id"]): pch for pch in
+                await self.get_patch_meta_batch(
+                    [entry["id"] for entry in meta])}
+
+        updated = [curr[str(entry["id"])] for entry in meta
+                   if str(entry["id"]) in curr
+                   and curr[str(entry["id"])]["updated_at"]
+                   > entry["updated_at"]]
+        tasks = [asyncio.ensure_future(
+            self.download_to_file(str(pch["id"]), directory, pch))
+            for pch in updated]
+        try:
+            patches = await asyncio.gather(*tasks)
+        except BaseException:
+            # The other downloads would keep writing to the directory.
+            await _cancel(tasks)
+            raise
+
+        return [patch for patch in patches if patch is not None]
+
+    async def get_newest_patches(self, pch_num):
+        """ Queries the PS API for the latest patches that have not been
+        stored in data.json previously.
+
+        pch_num: The number of patches currently stored in data.json
+
+        return: A list of patch metadata that was not present in the
+                data.json file.
+        """
+
+        missing = await self.get_patch_count() - pch_num
+        per_page = min(max(missing, 1), 100)
+        pages = math.ceil(missing / 100) if per_page == 100 else 1
+
+        return await self._search_many(
+            [{'per_page': per_page, 'page': page}
+             for page in range(1, pages + 1)])
+
+    async def get_patch_ids(self):
+        """ Lists the ids of every ZOIA patch on PS, without the rest of
+        their metadata. See PatchStorage.get_patch_ids().
+
+        return: A list of patch ids, as ints.
+        """
+
+        per_page = 100
+        pages = math.ceil(await self.get_patch_count() / per_page)
+
+        return [pch["id"] for pch in await self._search_many(
+            [{'per_page': per_page, 'page': page, '_fields': 'id'}
+             for page in range(1, pages + 1)])]
+
+    async def get_modified_patches(self, since):
+        """ Queries the PS API for every patch that was uploaded or
+        modified at or after a given date. See
+        PatchStorage.get_modified_patches().
+
+        since: An ISO8601 date, as found in the updated_at attribute.
+
+        return: A list of patch metadata for the patches that changed.
+        """
+
+        per_page = 100
+        changed = []
+        page = 1
+        while True:
+            patches = await self._search({'per_page': per_page,
+                                          'orderby': 'modified',
+                                          'page': page})
+            for pch in patches:
+                if pch["updated_at"] < since:
+                    return changed
+                changed.append(pch)
+            if len(patches) < per_page:
+                return changed
+            page += 1
+
+
+async def _cancel(tasks):
+    """ Cancels tasks and waits for them to finish, so that none are
+    left running once the caller gives up on them.
+
+    tasks: A list of asyncio tasks.
+    """
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class BlockingPatchStorage:
+    """ Exposes an AsyncPatchStorage through the same blocking methods
+    as PatchStorage, so that existing code (e.g. PatchSync, PatchUpdate
+    and the UI workers) can switch over to it without being rewritten.
+    The client runs on an event loop in a background thread, and the
+    methods can be called from any thread.
+    """
+
+    def __init__(self, concurrency=MAX_CONCURRENCY, url=API_URL):
+        """ Starts the event loop the client runs on.
+
+        concurrency: Optional. The maximum number of requests in flight
+                     at the same time.
+        url: Optional. The base URL of the PS API.
+        """
+
+        self.client = AsyncPatchStorage(concurrency, url)
+        self.workers = concurrency
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        """ Runs a coroutine on the event loop and waits for its result.
+
+        coro: The coroutine to run.
+
+        return: The result of the coroutine.
+        """
+
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self):
+        """ Closes the client and stops the event loop.
+        """
+
+        self._run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    @property
+    def patch_count(self):
+        return self._run(self.client.get_patch_count())
+
+    def batch(self):
+        # There is no response cache to write.
+        return nullcontext()
+
+    def get_patch_meta(self, idx: str):
+        return self._run(self.client.get_patch_meta(idx))
+
+    def download(self, idx: str, meta=None):
+        return self._run(self.client.download(idx, meta))
+
+    def download_to_file(self, idx: str, directory, meta=None):
+        return self._run(self.client.download_to_file(idx, directory, meta))
+
+    def get_all_patch_data_init(self, progress=None):
+        return self._run(self.client.get_all_patch_data_init(progress))
+
+    def get_patch_meta_batch(self, ids):
+        return self._run(self.client.get_patch_meta_batch(ids))
+
+    def get_potential_updates(self, meta, directory):
+        return self._run(self.client.get_potential_updates(meta,
+                                                           directory))
+
+    def get_newest_patches(self, pch_num):
+        return self._run(self.client.get_newest_patches(pch_num))
+
+    def get_patch_ids(self):
+        return self._run(self.client.get_patch_ids())
+
+    def get_modified_patches(self, since):
+        return self._run(self.client.get_modified_patches(since))
+
@@ -0,0 +1,434 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.utilities import write_json
+
+# Default upper bound on the combined size of the cached response
+# bodies, in bytes.
+CACHE_SIZE = 64 * 1024 * 1024
+
+# Every cache, so that their indexes can be written on exit.
+_caches = weakref.WeakSet()
+
+
+class CachedResponse:
+    """ A response that was served by the ResponseCache. It mirrors the
+    attributes of a urllib3 response that are used by PatchStorage.
+    """
+
+    def __init__(self, data, headers):
+        """ Initializes the response.
+
+        data: The body of the response, as bytes.
+        headers: The headers that were stored along with the body.
+        """
+
+        self.status = 200
+        self.data = data
+        self.headers = _Headers(headers)
+
+
+class _Headers(dict):
+    """ A dictionary of response headers with case-insensitive lookups,
+    like the one urllib3 provides.
+    """
+
+    def __init__(self, headers):
+        super().__init__((k.lower(), v) for k, v in headers.items())
+
+    def __getitem__(self, key):
+        return super().__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super().__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+
+class ResponseCache(Patch):
+    """ The ResponseCache class is a child of the Patch class. It is
+    responsible for keeping responses retrieved from the PS API on disk,
+    so that requests for the same URL can be answered with a conditional
+    request (or no request at all) instead of a full download.
+
+    Responses are revalidated using the ETag and Last-Modified headers
+    PS supplies. The cache is bounded in size; once full, the least
+    recently used responses are evicted first.
+
+    The index of the cached responses is written to disk after every
+    change, except during a batch (see batch()), after which it is
+    written once. Anything not yet written is written on exit.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        """ Initialize the class such that it has a reference to the
+        backend path.
+
+        max_size: Optional. The maximum combined size of the cached
+                  response bodies, in bytes.
+        """
+
+        super().__init__()
+
+        self.max_size = max_size
+        self.cache_path = None if self.back_path is None else \
+            os.path.join(self.back_path, "cache")
+
+        # Counters, exposed via stats().
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+        # Entries are kept in least to most recently used order, and
+        # only loaded from disk once the cache is first used.
+        self._entries = None
+        self._size = 0
+        self._lock = threading.RLock()
+        # Whether the index has changes that weren't written yet, and
+        # the number of batches in progress.
+        self._dirty = False
+        self._batches = 0
+        _caches.add(self)
+
+    def request(self, url, fetch, immutable=False):
+        """ Retrieves the response for a URL, going to the network only
+        if the cached response (if any) is no longer fresh.
+
+        url: The URL that is being requested.
+        fetch: A function taking the URL and a dict of request headers
+               that performs the actual request and returns the
+               response.
+        immutable: Optional. True if the content behind the URL never
+                   changes, in which case a cached response is always
+                   used without being revalidated.
+
+        return: Either the response returned by fetch, or a
+                CachedResponse.
+        """
+
+        if self.cache_path is None:
+            return fetch(url, {})
+
+        with self._lock:
+            entry = self._load_entries().get(url)
+            if entry is not None and (immutable or self._is_fresh(entry)):
+                data = self._read(entry)
+                if data is not None:
+                    self._entries.move_to_end(url)
+                    self.hits += 1
+                    return CachedResponse(data, entry["headers"])
+
+        r = fetch(url, {} if entry is None else self._validators(entry))
+
+        if r.status == 304 and entry is not None:
+            with self._lock:
+                data = self._read(entry)
+                if data is not None:
+                    # Still valid, note any updated headers.
+                    entry["headers"].update(
+                        (k.lower(), v) for k, v in r.headers.items())
+                    entry["expires"] = self._expiry(entry["headers"])
+                    if url in self._entries:
+                        self._entries.move_to_end(url)
+                    self._changed()
+                    self.hits += 1
+                    self.revalidations += 1
+                    return CachedResponse(data, entry["headers"])
+            # The cached body went missing, so request it again in full.
+            r = fetch(url, {})
+
+        with self._lock:
+            self.misses += 1
+        if r.status == 200:
+            self.store(url, r.data, r.headers)
+
+        return r
+
+    def store(self, url, data, headers):
+        """ Adds a response to the cache, evicting the least recently
+        used responses should the cache grow beyond its maximum size.
+        Responses that can neither be revalidated nor reused without
+        revalidation are not stored.
+
+        url: The URL the response belongs to.
+        data: The body of the response, as bytes.
+        headers: The headers of the response.
+        """
+
+        def write(dest):
+            with open(dest, "wb") as f:
+                f.write(data)
+
+        self._add(url, len(data), headers, write)
+
+    def store_file(self, url, path, headers):
+        """ Adds a response whose body was streamed to a file to the
+        cache. The file is copied, so the caller keeps ownership of it.
+
+        url: The URL the response belongs to.
+        path: The path to the file containing the body.
+        headers: The headers of the response.
+        """
+
+        self._add(url, os.path.getsize(path), headers,
+                  lambda dest: shutil.copyfile(path, dest))
+
+    def lookup_file(self, url):
+        """ Finds the file holding the cached body for a URL whose
+        content never changes, so that it can be copied instead of
+        downloaded again.
+
+        url: The URL being requested.
+
+        return: The path to the cached body, or None if it isn't cached.
+        """
+
+        if self.cache_path is None:
+            return None
+
+        with self._lock:
+            entry = self._load_entries().get(url)
+            if entry is None:
+                return None
+            path = os.path.join(self.cache_path, entry["file"])
+            if not os.path.exists(path):
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+
+            return path
+
+    def _add(self, url, size, headers, write):
+        """ Adds a response body to the cache. See store().
+
+        url: The URL the response belongs to.
+        size: The size of the body, in bytes.
+        headers: The headers of the response.
+        write: A function taking the path the body should be written to.
+        """
+
+        headers = {k.lower(): v for k, v in headers.items()}
+        if self.cache_path is None \
+                or "no-store" in headers.get("cache-control", "") \
+                or size > self.max_size \
+                or ("etag" not in headers and "last-modified" not in headers
+                    and self._expiry(headers) is None):
+            return
+
+        with self._lock:
+            entries = self._load_entries()
+            os.makedirs(self.cache_path, exist_ok=True)
+            if url in entries:
+                self._size -= entries.pop(url)["size"]
+
+            entry = {
+                "file": hashlib.sha1(url.encode()).hexdigest(),
+                "size": size,
+                "headers": headers,
+                "expires": self._expiry(headers)
+            }
+            write(os.path.join(self.cache_path, entry["file"]))
+            entries[url] = entry
+            self._size += entry["size"]
+
+            self._evict()
+            self._changed()
+
+    @contextmanager
+    def batch(self):
+        """ Defers writing the index until the end of a batch of
+        requests, rather than writing it after each one. Batches may be
+        nested, and used from several threads at once.
+        """
+
+        with self._lock:
+            self._batches += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batches -= 1
+                if self._batches == 0:
+                    self.flush()
+
+    def flush(self):
+        """ Writes the index to disk, should it have changed since it
+        was last written.
+        """
+
+        with self._lock:
+            if self._dirty:
+                self._save_entries()
+                self._dirty = False
+
+    def stats(self):
+        """ Reports how well the cache has been performing.
+
+        return: A dict containing the number of hits (responses served
+                from the cache), misses (responses downloaded in full),
+                revalidations (hits that needed a conditional request),
+                entries and the total size of the cached bodies.
+        """
+
+        with self._lock:
+            entries = self._load_entries()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "entries": len(entries),
+                "size": self._size
+            }
+
+    def clear(self):
+        """ Removes every response from the cache.
+        """
+
+        with self._lock:
+            entries = self._load_entries()
+            while entries:
+                self._remove(entries.popitem(last=False)[1])
+            self._size = 0
+            self._changed()
+
+    def _evict(self):
+        """ Removes the least recently used responses until the cache is
+        within its maximum size.
+        """
+
+        while self._size > self.max_size and self._entries:
+            self._size -= self._remove(self._entries.popitem(last=False)[1])
+
+    def _remove(self, entry):
+        """ Deletes the body of a cached response.
+
+        entry: The cache entry whose body will be deleted.
+
+        return: The size of the removed body.
+        """
+
+        try:
+            os.remove(os.path.join(self.cache_path, entry["file"]))
+        except FileNotFoundError:
+            pass
+
+        return entry["size"]
+
+    def _read(self, entry):
+        """ Reads the body of a cached response.
+
+        entry: The cache entry whose body will be read.
+
+        return: The body as bytes, or None if it could not be found.
+        """
+
+        try:
+            with open(os.path.join(self.cache_path, entry["file"]),
+                      "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _load_entries(self):
+        """ Loads the cache index from disk the first time it is needed.
+
+        return: The cache entries, keyed by URL.
+        """
+
+        if self._entries is None:
+            self._entries = OrderedDict()
+            try:
+                with open(os.path.join(self.cache_path, "index.json"),
+                          "r") as f:
+                    for url, entry in json.loads(f.read()):
+                        self._entries[url] = entry
+            except (FileNotFoundError, ValueError):
+                pass
+            self._size = sum(e["size"] for e in self._entries.values())
+
+        return self._entries
+
+    def _changed(self):
+        """ Notes that the index changed, writing it unless a batch is in
+        progress.
+        """
+
+        self._dirty = True
+        if self._batches == 0:
+            self.flush()
+
+    def _save_entries(self):
+        """ Writes the cache index to disk, in least to most recently
+        used order.
+        """
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        write_json(os.path.join(self.cache_path, "index.json"),
+                   list(self._entries.items()))
+
+    @staticmethod
+    def _validators(entry):
+        """ Prepares the headers for a conditional request.
+
+        entry: The cache entry being revalidated.
+
+        return: A dict of request headers.
+        """
+
+        headers = {}
+        if "etag" in entry["headers"]:
+            headers["If-None-Match"] = entry["headers"]["etag"]
+        if "last-modified" in entry["headers"]:
+            headers["If-Modified-Since"] = entry["headers"]["last-modified"]
+
+        return headers
+
+    @staticmethod
+    def _is_fresh(entry):
+        """ Determines whether a cached response can be used without
+        revalidating it.
+
+        entry: The cache entry being checked.
+
+        return: True if the response is fresh, False otherwise.
+        """
+
+        return entry["expires"] is not None and entry["expires"] > time.time()
+
+    @staticmethod
+    def _expiry(headers):
+        """ Determines when a response stops being fresh, based on the
+        max-age directive of its Cache-Control header.
+
+        headers: The response headers, with lower case names.
+
+        return: The expiry as a timestamp, or None if the response must
+                always be revalidated.
+        """
+
+        cache_control = headers.get("cache-control", "")
+        max_age = re.search(r"max-age=(\d+)", cache_control)
+        if max_age is None or "no-cache" in cache_control:
+            return None
+
+        return time.time() + int(max_age.group(1))
+
+
+@atexit.register
+def _flush_all():
+    """ Writes the indexes of every cache that has unwritten changes.
+    """
+
+    for cache in list(_caches):
+        cache.flush()
@@ -0,0 +1,216 @@
+import random
+import threading
+import time
+
+# Response statuses that indicate PS is overloaded or briefly unable to
+# answer, and that are worth retrying.
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class RateLimiter:
+    """ A token bucket shared by every request made to PS. Tokens are
+    added at a constant rate up to a maximum burst, and every request
+    takes one, so that concurrent downloads and syncs together never
+    exceed the rate.
+
+    The limiter never sleeps on its own; reserve() only reports how
+    long the caller has to wait, so it can be used from threads and
+    coroutines alike.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        """ Initializes the limiter with a full bucket.
+
+        rate: The number of requests allowed per second, on average.
+        burst: The number of requests that can be made at once.
+        clock: Optional. A function returning the current time, in
+               seconds.
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+
+        # Counters, exposed via stats().
+        self.throttled = 0
+        self.throttled_time = 0.0
+
+        self._tokens = burst
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """ Takes a token from the bucket.
+
+        return: The number of seconds the caller has to wait before
+                making its request.
+        """
+
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens
+                               + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens may go negative, which queues callers up behind
+            # each other instead of letting them race for the next one.
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, self._paused_until - now, 0)
+            if wait > 0:
+                self.throttled += 1
+                self.throttled_time += wait
+
+            return wait
+
+    def acquire(self):
+        """ Takes a token from the bucket, sleeping until the request
+        can be made.
+        """
+
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """ Holds back every request for a while, e.g. once PS asks for
+        requests to slow down.
+
+        seconds: The number of seconds to hold requests back for.
+        """
+
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     self.clock() + seconds)
+
+    def stats(self):
+        """ Reports how often requests had to wait for a token.
+
+        return: A dict containing the number of throttled requests and
+                the total number of seconds they waited.
+        """
+
+        return {
+            "throttled": self.throttled,
+            "throttled_time": self.throttled_time
+        }
+
+
+class RetryPolicy:
+    """ Retries requests to PS that fail for transient reasons, waiting
+    exponentially longer (with jitter) between attempts. Should PS
+    supply a Retry-After header, it is honoured instead.
+    """
+
+    def __init__(self, limiter=None, max_retries=4, backoff=0.5,
+                 max_backoff=30.0, exceptions=(OSError,), sleep=time.sleep):
+        """ Initializes the policy.
+
+        limiter: Optional. The RateLimiter every attempt takes a token
+                 from.
+        max_retries: Optional. The number of times a request is retried
+                     before giving up.
+        backoff: Optional. The delay before the first retry, in seconds.
+                 It doubles for every subsequent retry.
+        max_backoff: Optional. The longest delay between two attempts,
+                     in seconds.
+        exceptions: Optional. The exceptions that indicate a transient
+                    failure, such as a lost connection or a timeout.
+        sleep: Optional. The function used to wait between attempts.
+        """
+
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.exceptions = exceptions
+        self.sleep = sleep
+
+        # Counters, exposed via stats().
+        self.retried = 0
+        self.gave_up = 0
+
+        self._lock = threading.Lock()
+
+    def call(self, request):
+        """ Makes a request, retrying it should it fail for a transient
+        reason.
+
+        request: A function taking no arguments that makes the request
+                 and returns the response.
+
+        return: The first response that doesn't need to be retried, or
+                the last response once the retries are exhausted.
+        raise: The exception raised by the last attempt, should every
+               attempt fail.
+        """
+
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+
+            try:
+                r = request()
+            except self.exceptions:
+                if attempt >= self.max_retries:
+                    self.record(gave_up=1)
+                    raise
+                delay = self.delay(attempt)
+            else:
+                if r.status not in RETRY_STATUSES:
+                    return r
+                if attempt >= self.max_retries:
+                    self.record(gave_up=1)
+                    return r
+                delay = self.delay(attempt, r.headers.get("Retry-After"))
+                if r.status == 429 and self.limiter is not None:
+                    # Slow every other request down as well.
+                    self.limiter.pause(delay)
+
+            self.record(retried=1)
+            self.sleep(delay)
+            attempt += 1
+
+    def delay(self, attempt, retry_after=None):
+        """ Determines how long to wait before retrying a request.
+
+        attempt: The number of retries made so far for the request.
+        retry_after: Optional. The value of the Retry-After header sent
+                     by PS, if any.
+
+        return: The number of seconds to wait.
+        """
+
+        try:
+            return min(float(retry_after), self.max_backoff)
+        except (TypeError, ValueError):
+            # No header, or one given as a date, which PS doesn't send.
+            pass
+
+        # Full jitter keeps concurrent retries from arriving together.
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+    def stats(self):
+        """ Reports how often requests had to be retried.
+
+        return: A dict containing the number of retries and the number
+                of requests that were given up on.
+        """
+
+        return {
+            "retries": self.retried,
+            "gave_up": self.gave_up
+        }
+
+    def record(self, retried=0, gave_up=0):
+        """ Updates the counters. Clients that can't use call(), such as
+        the asyncio one, report their retries through this method.
+
+        retried: The number of retries to add.
+        gave_up: The number of abandoned requests to add.
+        """
+
+        with self._lock:
+            self.retried += retried
+            self.gave_up += gave_up
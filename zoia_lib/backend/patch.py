@@ -2,6 +2,10 @@ import os
 import platform
 from pathlib import Path
 
+# The directory within the backend holding the patch directories when
+# the sharded layout is used, see Patch.patch_path().
+SHARDS = "patches"
+
 
 class Patch:
     """ The Patch class is the parent class all other patch-related
@@ -56,3 +60,50 @@ class Patch:
         """
 
         return self.back_path
+
+    def is_sharded(self):
+        """ Determines whether the backend uses the sharded layout. See
+        patch_path().
+
+        return: True if it does, False otherwise.
+        """
+
+        return os.path.isdir(os.path.join(self.back_path, SHARDS))
+
+    def patch_path(self, idx):
+        """ Determines the directory a patch is saved in. By default,
+        patch directories are saved directly in the backend directory.
+        Large libraries can be converted to the sharded layout instead
+        (see PatchLayout), in which they are grouped by the last two
+        digits of their id (e.g. patches/56/123456).
+
+        idx: The id of the patch.
+
+        return: A string representing the path to the patch directory,
+                which doesn't necessarily exist.
+        """
+
+        idx = str(idx)
+        if self.is_sharded():
+            return os.path.join(self.back_path, SHARDS, idx[-2:], idx)
+
+        return os.path.join(self.back_path, idx)
+
+    def patch_ids(self):
+        """ Lists the patches saved in the backend, ignoring everything
+        else in it (Banks, preferences, etc.).
+
+        return: A list of patch ids as strings.
+        """
+
+        if not self.is_sharded():
+            return [entry.name for entry in os.scandir(self.back_path)
+                    if entry.name.isdigit() and entry.is_dir()]
+
+        ids = []
+        for shard in os.scandir(os.path.join(self.back_path, SHARDS)):
+            if shard.name.isdigit() and shard.is_dir():
+                ids += [entry.name for entry in os.scandir(shard.path)
+                        if entry.name.isdigit() and entry.is_dir()]
+
+        return ids
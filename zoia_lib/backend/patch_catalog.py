@@ -0,0 +1,333 @@
+import json
+import marshal
+import os
+import struct
+import zlib
+from sys import intern
+
+from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.patch_meta import BulkLoader, PatchRecord, meta_cache
+from zoia_lib.backend.utilities import write_atomic
+
+# The format of catalog.bin. Should a catalog with a different version
+# be found, it is discarded and the catalog is synced from scratch.
+MAGIC = b"ZLCAT"
+VERSION = 2
+HEADER = struct.Struct(">5sBI")
+
+# The attributes kept in memory for every patch, which are all the
+# tables, searching and sorting need. Everything else PS sends (the
+# patch notes, files, license, etc.) is only read on demand.
+SCALARS = ("id", "title", "created_at", "updated_at", "like_count",
+           "download_count", "view_count")
+NAMED = ("tags", "categories")
+STORED = frozenset(SCALARS + NAMED + ("author",))
+
+# Marks an attribute that a patch doesn't have. marshal can store
+# Ellipsis, but not arbitrary objects.
+MISSING = ...
+
+
+class PatchCatalog(Patch):
+    """ The PatchCatalog class is a child of the Patch class. It is
+    responsible for storing the local copy of the PS catalog
+    (catalog.bin) in a compact form.
+
+    The file starts with the attributes listed in SCALARS and NAMED,
+    plus the author name and the names of every other attribute each
+    patch has, stored column by column and encoded with marshal. Only
+    these are loaded at startup. The complete metadata of every patch
+    follows as a separate, compressed segment, which is only read for a
+    single patch at a time via meta(), or in a single pass via
+    meta_many().
+    """
+
+    def __init__(self):
+        """ Initialize the class such that it has a reference to the
+        backend path.
+        """
+
+        super().__init__()
+        # Where each patch's complete metadata is, for meta(). Cached
+        # until catalog.bin changes.
+        self._spans = None
+        self._spans_stat = None
+
+    def load(self):
+        """ Loads the catalog that was previously saved to the backend.
+        Catalogs saved as data.json by older versions are converted.
+
+        return: The catalog as a list of patch metadata, containing
+                only the attributes in SCALARS and NAMED plus the author
+                name, or None if no catalog has been saved.
+        """
+
+        cols = self._read_columns()
+        if cols is None:
+            return self._migrate()
+
+        return self._records(cols)
+
+    def save(self, data):
+        """ Saves the catalog to the backend.
+
+        data: The catalog as a list of patch metadata. Patches may either
+              be complete metadata retrieved from PS, or records
+              returned by load(), which keep the complete metadata
+              saved for them previously.
+
+        return: The catalog as returned by load().
+        """
+
+        old = self._read_columns()
+        spans = {} if old is None else dict(
+            zip(old["id"], zip(old["offset"], old["length"])))
+        old_heavy = self._read_heavy() if spans else b""
+
+        # Build the new segment, reusing what is already compressed.
+        blobs = []
+        offsets = []
+        lengths = []
+        pos = 0
+        for pch in data:
+            if isinstance(pch, PatchRecord) and pch["id"] in spans:
+                offset, length = spans[pch["id"]]
+                blob = old_heavy[offset:offset + length]
+            else:
+                if isinstance(pch, PatchRecord):
+                    pch = pch.full()
+                blob = zlib.compress(json.dumps(pch).encode("utf-8"))
+            blobs.append(blob)
+            offsets.append(pos)
+            lengths.append(len(blob))
+            pos += len(blob)
+
+        cols = self._columns(data)
+        cols["offset"] = offsets
+        cols["length"] = lengths
+        light = marshal.dumps(cols)
+
+        write_atomic(os.path.join(self.back_path, "catalog.bin"),
+                     b"".join([HEADER.pack(MAGIC, VERSION, len(light)),
+                               light] + blobs))
+        for pch in data:
+            meta_cache.discard(pch["id"])
+
+        return self._records(cols)
+
+    def meta(self, idx):
+        """ Retrieves the complete metadata that was saved for a patch.
+
+        idx: The id of the patch.
+
+        return: The metadata as a dict, or None if the patch isn't in
+                the catalog.
+        """
+
+        path = os.path.join(self.back_path, "catalog.bin")
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if self._spans_stat != (stat.st_mtime_ns, stat.st_size):
+                    cols, start = self._read_light(f)
+                    self._spans = {idx: (start + offset, length) for
+                                   idx, offset, length in zip(
+                                       cols["id"], cols["offset"],
+                                       cols["length"])}
+                    self._spans_stat = (stat.st_mtime_ns, stat.st_size)
+                if int(idx) not in self._spans:
+                    return None
+                offset, length = self._spans[int(idx)]
+                f.seek(offset)
+                blob = f.read(length)
+        except (FileNotFoundError, ValueError, TypeError, EOFError,
+                struct.error):
+            return None
+
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def meta_many(self, ids):
+        """ Retrieves the complete metadata that was saved for many
+        patches, reading through the catalog once rather than seeking to
+        each patch in turn.
+
+        ids: The ids of the patches.
+
+        return: A generator of (id, metadata) tuples, with the ids as
+                given, in the order the patches are stored in, skipping
+                those that aren't in the catalog.
+        """
+
+        path = os.path.join(self.back_path, "catalog.bin")
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return
+
+        with f:
+            try:
+                cols, start = self._read_light(f)
+            except (ValueError, TypeError, EOFError, struct.error):
+                return
+            spans = dict(zip(cols["id"], zip(cols["offset"],
+                                             cols["length"])))
+            wanted = sorted((spans[int(idx)], idx) for idx in ids
+                            if int(idx) in spans)
+            pos = None
+            for (offset, length), idx in wanted:
+                # The segment is only read forwards, skipping the
+                # patches that weren't asked for.
+                if offset != pos:
+                    f.seek(start + offset)
+                pos = offset + length
+                yield idx, json.loads(
+                    zlib.decompress(f.read(length)).decode("utf-8"))
+
+    def _read_columns(self):
+        """ Reads the attributes stored column by column.
+
+        return: A dict mapping attribute names to columns, or None if
+                there is no readable catalog.
+        """
+
+        try:
+            with open(os.path.join(self.back_path, "catalog.bin"),
+                      "rb") as f:
+                return self._read_light(f)[0]
+        except (FileNotFoundError, ValueError, TypeError, EOFError,
+                struct.error):
+            return None
+
+    def _read_heavy(self):
+        """ Reads the entire segment of complete metadata.
+
+        return: The segment as bytes.
+        """
+
+        with open(os.path.join(self.back_path, "catalog.bin"), "rb") as f:
+            start = self._read_light(f)[1]
+            f.seek(start)
+            return f.read()
+
+    @staticmethod
+    def _read_light(f):
+        """ Reads the header and the columns from an open catalog.
+
+        f: The catalog, opened in binary mode.
+
+        return: A tuple containing the columns and the position at which
+                the segment of complete metadata starts.
+        raise: ValueError should the file not be a catalog this version
+               can read.
+        """
+
+        magic, version, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(version)
+
+        return marshal.loads(f.read(size)), HEADER.size + size
+
+    def _migrate(self):
+        """ Converts data.json, as saved by older versions, into a
+        catalog.
+
+        return: The catalog as returned by load(), or None if there was
+                no data.json to convert.
+        """
+
+        path = os.path.join(self.back_path, "data.json")
+        try:
+            with open(path, "r") as f:
+                data = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        data = self.save(data)
+        os.remove(path)
+
+        return data
+
+    @staticmethod
+    def _columns(data):
+        """ Splits the attributes kept in memory into columns. Author,
+        tag and category names are stored once in a table of strings
+        and referred to by position.
+
+        data: The catalog as a list of patch metadata.
+
+        return: A dict mapping attribute names to columns.
+        """
+
+        strings = []
+        refs = {}
+
+        def ref(name):
+            if name not in refs:
+                refs[name] = len(strings)
+                strings.append(name)
+            return refs[name]
+
+        # The names of the attributes of the complete metadata.
+        names = [set(pch.keys()) | pch.other_keys()
+                 if isinstance(pch, PatchRecord) else pch.keys()
+                 for pch in data]
+        data = [pch if isinstance(pch, PatchRecord)
+                else PatchRecord.from_meta(pch) for pch in data]
+        cols = {key: [MISSING if getattr(pch, key) is None
+                      else getattr(pch, key) for pch in data]
+                for key in SCALARS}
+        cols["author"] = [MISSING if pch.author is None else ref(pch.author)
+                          for pch in data]
+        for key in NAMED:
+            cols[key] = [MISSING if getattr(pch, key) is None
+                         else tuple(ref(name) for name in getattr(pch, key))
+                         for pch in data]
+        # Whatever isn't in the columns is loaded from the complete
+        # metadata, which records need to know about up front.
+        cols["other"] = [
+            tuple(ref(name) for name in sorted(keys)
+                  if name not in STORED or getattr(pch, name) is None)
+            for pch, keys in zip(data, names)]
+        cols["strings"] = strings
+
+        return cols
+
+    def _records(self, cols):
+        """ Turns columns back into a list of patch metadata.
+
+        cols: A dict mapping attribute names to columns.
+
+        return: The catalog as a list of PatchRecords, which load the
+                rest of the metadata via meta(), or meta_many() for many
+                patches at once.
+        """
+
+        strings = [intern(name) for name in cols["strings"]]
+        loader = BulkLoader(self.meta, self.meta_many)
+        # Patches tend to share the same tags and categories, and
+        # therefore the same tuples.
+        groups = {MISSING: None}
+
+        def value(x):
+            return None if x is MISSING else x
+
+        def group(x):
+            if x not in groups:
+                groups[x] = tuple(strings[i] for i in x)
+            return groups[x]
+
+        return [
+            PatchRecord(
+                idx, loader, group(other), id=idx, title=value(title),
+                author=None if author is MISSING else strings[author],
+                tags=group(tags), categories=group(categories),
+                created_at=value(created), updated_at=value(updated),
+                like_count=value(likes), download_count=value(downloads),
+                view_count=value(views))
+            for idx, title, author, tags, categories, created, updated,
+            likes, downloads, views, other in zip(
+                cols["id"], cols["title"], cols["author"], cols["tags"],
+                cols["categories"], cols["created_at"], cols["updated_at"],
+                cols["like_count"], cols["download_count"],
+                cols["view_count"], cols["other"])
+        ]
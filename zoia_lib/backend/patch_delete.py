@@ -2,6 +2,9 @@ import os
 import shutil
 
 from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.patch_manifest import MANIFEST, PatchManifest
+from zoia_lib.backend.patch_store import PatchStore
 from zoia_lib.common import errors
 
 
@@ -40,23 +43,42 @@ class PatchDelete(Patch):
         # Try to delete the file and metadata file.
         try:
             # Should the patch directory not exist, a BadPathError is raised.
-            new_path = os.path.join(self.back_path, patch.split("_")[0])
+            new_path = self.patch_path(patch.split("_")[0])
+            versions = self._manifest().versions(patch.split("_")[0])
+            self._delete_patch(patch, new_path, versions)
+            # The binary may have been shared with other patches.
+            self._store().release(next((ver["sha256"] for ver in versions
+                                        if ver["name"] == patch), None))
+        finally:
+            PatchIndex.for_path(self.back_path).refresh(patch.split("_")[0])
+
+    @staticmethod
+    def _delete_patch(patch, new_path, versions):
+        """ Deletes a patch from its patch directory without updating
+        the index. See delete_patch().
+
+        versions: The versions of the patch, as listed in its manifest.
+        """
+
+        left = [ver for ver in versions if ver["name"] != patch]
+        try:
             os.remove(os.path.join(new_path, patch + ".bin"))
             os.remove(os.path.join(new_path, patch + ".json"))
-            if new_path is not None and len(os.listdir(new_path)) == 2:
+            if len(left) == 1 and left[0]["version"] > 0:
                 # If there aren't multiple patches left, drop the version
                 # extension on the remaining patch.
-                for left_files in os.listdir(new_path):
+                for extension in ("bin", "json"):
+                    left_file = "{}.{}".format(left[0]["name"], extension)
                     try:
-                        os.rename(os.path.join(new_path, left_files),
+                        os.rename(os.path.join(new_path, left_file),
                                   os.path.join(new_path, "{}.{}".format(
-                                      left_files.split("_")[0],
-                                      left_files.split(".")[-1])))
+                                      left_file.split("_")[0], extension)))
                     except FileNotFoundError or FileExistsError:
-                        raise errors.RenamingError(left_files, 601)
-            elif new_path is not None and len(os.listdir(new_path)) == 0:
+                        raise errors.RenamingError(left_file, 601)
+            elif not left:
                 # Special case: There are no more patches left in the
                 # patch directory. As such, the directory should be removed.
+                os.remove(os.path.join(new_path, MANIFEST))
                 os.rmdir(new_path)
         except FileNotFoundError:
             raise errors.BadPathError(patch, 301)
@@ -78,11 +100,17 @@ class PatchDelete(Patch):
         if patch_dir is None:
             raise errors.DeletionError(None)
 
+        versions = self._manifest().versions(patch_dir)
         try:
-            shutil.rmtree(os.path.join(self.back_path, patch_dir))
+            shutil.rmtree(self.patch_path(patch_dir))
         except FileNotFoundError:
             # Couldn't find the patch directory that was passed.
             raise errors.BadPathError(patch_dir, 301)
+        finally:
+            PatchIndex.for_path(self.back_path).refresh(patch_dir)
+        store = self._store()
+        for ver in versions:
+            store.release(ver["sha256"])
 
     @staticmethod
     def delete_patch_sd(index, sd_path):
@@ -136,3 +164,25 @@ class PatchDelete(Patch):
         except FileNotFoundError:
             # Couldn't find the file at the supplied path.
             raise errors.BadPathError(path, 301)
+
+    def _manifest(self):
+        """ Retrieves the manifests of the patches in the backend.
+
+        return: A PatchManifest.
+        """
+
+        manifest = PatchManifest()
+        manifest.back_path = self.back_path
+
+        return manifest
+
+    def _store(self):
+        """ Retrieves the store of binaries for the backend.
+
+        return: A PatchStore.
+        """
+
+        store = PatchStore()
+        store.back_path = self.back_path
+
+        return store
@@ -0,0 +1,202 @@
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.utilities import write_json
+from zoia_lib.common import errors
+
+
+class PatchDownload(Patch):
+    """ The PatchDownload class is a child of the Patch class. It is
+    responsible for downloading many patches from PS at once.
+
+    Patches waiting to be downloaded are kept in a queue file in the
+    backend directory, and every patch that has been dealt with is
+    appended to a journal next to it. Should the application crash or
+    the connection drop, the next run picks up exactly where the
+    previous one stopped.
+
+    Patches are streamed to a staging directory inside the backend
+    rather than held in memory, so the memory used does not depend on
+    the size of the files being downloaded.
+    """
+
+    def __init__(self, api, save, workers=4):
+        """ Initialize the class such that it has a reference to the
+        backend path.
+
+        api: Backend class to aid with PS API requests.
+        save: Backend class to aid with the saving of patches.
+        workers: Optional. The maximum number of patches that are
+                 downloaded at the same time.
+        """
+
+        super().__init__()
+        self.api = api
+        self.save = save
+        self.workers = max(1, workers)
+
+    def enqueue(self, ids):
+        """ Replaces the download queue with a new list of patches.
+
+        ids: A list of the ids for the patches that will be downloaded.
+        """
+
+        write_json(self._queue_path(), [str(idx) for idx in ids])
+
+        # Start a fresh journal for the new queue.
+        try:
+            os.remove(self._journal_path())
+        except FileNotFoundError:
+            pass
+
+    def pending(self):
+        """ Determines which patches in the queue have yet to be
+        downloaded.
+
+        return: A list of patch ids, in queue order.
+        """
+
+        try:
+            with open(self._queue_path(), "r") as f:
+                queue = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return []
+
+        try:
+            with open(self._journal_path(), "r") as f:
+                done = set(f.read().split())
+        except FileNotFoundError:
+            done = set()
+
+        return [idx for idx in queue if idx not in done]
+
+    def run(self, progress=None):
+        """ Downloads every pending patch in the queue and saves it to
+        the backend.
+
+        Up to self.workers patches are downloaded at once, while the
+        saving is done by the calling thread, one patch at a time and
+        in queue order. Patches that fail to save are skipped. Should a
+        download fail, the remaining patches are left in the queue and
+        the error is raised.
+
+        progress: Optional. A function that is called with the number
+                  of patches dealt with so far and the number of patches
+                  that were pending, each time a patch is dealt with.
+
+        return: A tuple containing the number of patches that were
+                saved and the number of patches that failed to save.
+        """
+
+        pending = self.pending()
+        remaining = iter(pending)
+        cnt = 0
+        fails = 0
+
+        # Anything left in the staging directory is from a run that
+        # didn't finish, and will be downloaded again.
+        shutil.rmtree(self._staging_path(), ignore_errors=True)
+        os.makedirs(self._staging_path())
+
+        # Responses are cached as the downloads finish, the cache index
+        # is only written once they are all done.
+        with self.api.batch(), \
+                ThreadPoolExecutor(max_workers=self.workers) as executor, \
+                open(self._journal_path(), "a") as journal:
+            # Keep a bounded window of downloads in flight ahead of the
+            # patch that is currently being saved.
+            window = deque()
+            for idx in remaining:
+                window.append((idx, executor.submit(self._download, idx)))
+                if len(window) == self.workers * 2:
+                    break
+
+            while window:
+                idx, future = window.popleft()
+                try:
+                    patch = future.result()
+                except Exception:
+                    # Lost the connection, leave the rest for next time.
+                    for _, f in window:
+                        f.cancel()
+                    raise
+
+                try:
+                    self.save.save_to_backend(patch)
+                    cnt += 1
+                except errors.ZoiaLibError:
+                    # .py files, .rar files without WinRAR, duplicates.
+                    fails += 1
+                finally:
+                    # Binaries are moved into the backend, but archives
+                    # and failures are left behind.
+                    if patch is not None and os.path.exists(patch[0]):
+                        os.remove(patch[0])
+
+                # Record that the patch has been dealt with.
+                journal.write(idx + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+
+                if progress is not None:
+                    progress(cnt + fails, len(pending))
+
+                idx = next(remaining, None)
+                if idx is not None:
+                    window.append((idx, executor.submit(self._download, idx)))
+
+        # Everything has been dealt with, so the queue is no longer needed.
+        self.clear()
+
+        return cnt, fails
+
+    def clear(self):
+        """ Removes the download queue, its journal and any partially
+        downloaded files.
+        """
+
+        for path in (self._queue_path(), self._journal_path()):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(self._staging_path(), ignore_errors=True)
+
+    def _download(self, idx):
+        """ Streams a patch to the staging directory.
+
+        idx: The id of the patch that will be downloaded.
+
+        return: The tuple returned by the API's download_to_file().
+        """
+
+        return self.api.download_to_file(idx, self._staging_path())
+
+    def _queue_path(self):
+        """ Getter method for the path to the download queue.
+
+        return: The path as a string.
+        """
+
+        return os.path.join(self.back_path, "download_queue.json")
+
+    def _journal_path(self):
+        """ Getter method for the path to the download journal.
+
+        return: The path as a string.
+        """
+
+        return os.path.join(self.back_path, "download_done.txt")
+
+    def _staging_path(self):
+        """ Getter method for the directory patches are downloaded to
+        before being saved.
+
+        return: The path as a string.
+        """
+
+        return os.path.join(self.back_path, "downloads")
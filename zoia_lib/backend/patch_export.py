@@ -69,7 +69,7 @@ class PatchExport(Patch):
 
         # Get the metadata for this patch.
         try:
-            with open(os.path.join(self.back_path, idx,
+            with open(os.path.join(self.patch_path(idx),
                                    "{}.json".format(patch)), "r") as f:
                 metadata = json.loads(f.read())
         except FileNotFoundError:
@@ -111,7 +111,7 @@ class PatchExport(Patch):
 
         # Rename the patch and export.
         try:
-            shutil.copy(os.path.join(self.back_path, idx, patch),
+            shutil.copy(os.path.join(self.patch_path(idx), patch),
                         os.path.join(dest, name))
         except FileNotFoundError or FileExistsError:
             raise errors.ExportingError(patch)
@@ -0,0 +1,357 @@
+import json
+import os
+import sqlite3
+import threading
+
+from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.patch_manifest import PatchManifest
+from zoia_lib.backend.patch_meta import PatchRecord, light, meta_cache, \
+    read_meta
+
+# Bumped whenever the schema changes, which causes the index to be
+# rebuilt from the patch directories. Version 3 switched to versions
+# numbered in the order they were saved, which rebuilding renumbers
+# existing patch directories for (see PatchManifest). Version 4 keeps the
+# names of the heavy attributes in the light metadata.
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patches (
+    name TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    title TEXT,
+    author TEXT,
+    tags TEXT,
+    categories TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    bin_path TEXT,
+    json_path TEXT,
+    bin_size INTEGER,
+    bin_mtime REAL,
+    sha256 TEXT,
+    light TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS patches_id ON patches (id, version);
+CREATE INDEX IF NOT EXISTS patches_sha256 ON patches (sha256);
+"""
+
+# The index for each backend path, shared by everything using it.
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class PatchIndex(Patch):
+    """ The PatchIndex class is a child of the Patch class. It is
+    responsible for the index of the patches saved to the backend
+    (library.db), so that the library can be listed with a single query
+    instead of walking every patch directory.
+
+    Every version of every patch has a row in the index. Classes that
+    modify a patch directory call refresh() with the patch id once they
+    are done, which refreshes the manifest of the patch (see
+    PatchManifest) and replaces the rows for that patch in a single
+    transaction.
+    """
+
+    def __init__(self):
+        """ Initialize the class such that it has a reference to the
+        backend path. The database is only opened once it is first used.
+        """
+
+        super().__init__()
+        self._conn = None
+        self._lock = threading.RLock()
+        self._manifest = PatchManifest()
+
+    @classmethod
+    def for_path(cls, back_path):
+        """ Retrieves the index for a backend path, so that the classes
+        modifying the backend and the UI all share a single connection.
+
+        back_path: The backend path, usually the back_path attribute of
+                   the caller.
+
+        return: The PatchIndex for back_path.
+        """
+
+        with _indexes_lock:
+            if back_path not in _indexes:
+                index = cls()
+                index.back_path = back_path
+                _indexes[back_path] = index
+
+            return _indexes[back_path]
+
+    def patches(self):
+        """ Retrieves the metadata for every patch in the backend. Only
+        the newest version of a patch with multiple versions is
+        included.
+
+        return: A list of PatchRecords.
+        """
+
+        return self._fetch_meta(
+            "SELECT light, json_path FROM patches AS p WHERE version = "
+            "(SELECT MAX(version) FROM patches WHERE id = p.id)")
+
+    def patch(self, idx):
+        """ Retrieves the metadata for a single patch in the backend,
+        namely its newest version.
+
+        idx: The id of the patch.
+
+        return: A PatchRecord, or None if the patch isn't saved.
+        """
+
+        pch = self._fetch_meta(
+            "SELECT light, json_path FROM patches WHERE id = ? "
+            "ORDER BY version DESC LIMIT 1", (str(idx),))
+
+        return pch[0] if pch else None
+
+    def versions(self, idx):
+        """ Retrieves the metadata for every version of a patch.
+
+        idx: The id of the patch.
+
+        return: A list of PatchRecords, newest version first.
+        """
+
+        return self._fetch_meta(
+            "SELECT light, json_path FROM patches WHERE id = ? "
+            "ORDER BY version DESC",
+            (str(idx),))
+
+    def count(self):
+        """ Determines how many patches are saved, counting a patch
+        with multiple versions only once.
+
+        return: The number of patches, as an int.
+        """
+
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COUNT(DISTINCT id) FROM patches").fetchone()[0]
+
+    def version_count(self, idx):
+        """ Determines how many versions of a patch are saved.
+
+        idx: The id of the patch.
+
+        return: The number of versions, 0 if the patch isn't saved.
+        """
+
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COUNT(*) FROM patches WHERE id = ?",
+                (str(idx),)).fetchone()[0]
+
+    def version_counts(self):
+        """ Determines how many versions of each patch are saved.
+
+        return: A dict mapping patch ids (as strings) to the number of
+                versions saved for them.
+        """
+
+        with self._lock:
+            return dict(self._connect().execute(
+                "SELECT id, COUNT(*) FROM patches GROUP BY id"))
+
+    def update_dates(self):
+        """ Retrieves what is needed to check the patches downloaded
+        from PS for updates.
+
+        return: A list of dicts containing the id and updated_at
+                attributes of the newest version of every patch that was
+                downloaded from PS.
+        """
+
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT light FROM patches AS p WHERE length(id) = 6 "
+                "AND version = (SELECT MAX(version) FROM patches "
+                "WHERE id = p.id)").fetchall()
+
+        meta = []
+        for row in rows:
+            temp = json.loads(row[0])
+            meta.append({"id": temp["id"],
+                         "updated_at": temp.get("updated_at")})
+
+        return meta
+
+    def has(self, name):
+        """ Determines whether a patch, or a specific version of a
+        patch, is saved.
+
+        name: Either a patch id, or the name of a version of a patch
+              (e.g. 123456_v2).
+
+        return: True if it is saved, False otherwise.
+        """
+
+        column = "name" if "_" in name else "id"
+        with self._lock:
+            return self._connect().execute(
+                "SELECT 1 FROM patches WHERE {} = ? LIMIT 1".format(column),
+                (name,)).fetchone() is not None
+
+    def has_binary(self, digest):
+        """ Determines whether a binary is already saved, regardless of
+        the patch it belongs to.
+
+        digest: The SHA-256 digest of the binary, as a hex string.
+
+        return: True if it is saved, False otherwise.
+        """
+
+        with self._lock:
+            return self._connect().execute(
+                "SELECT 1 FROM patches WHERE sha256 = ? LIMIT 1",
+                (digest,)).fetchone() is not None
+
+    def refresh(self, idx):
+        """ Brings the manifest and the rows for a patch in line with its
+        directory. This should be called whenever a patch directory is
+        modified; should the directory no longer exist, the rows are
+        removed.
+
+        idx: The id of the patch.
+        """
+
+        idx = str(idx)
+        with self._lock:
+            conn = self._connect()
+            if not idx.isdigit():
+                # Not a patch directory (e.g. Banks).
+                return
+            known = [row[0] for row in conn.execute(
+                "SELECT name FROM patches WHERE id = ?", (idx,))]
+            rows = self._scan(idx)
+            # Versions may have been renamed, so whatever was cached for
+            # any of them could be out of date.
+            for name in known:
+                meta_cache.discard(os.path.join(self.patch_path(idx),
+                                                name + ".json"))
+            for row in rows:
+                meta_cache.discard(row[10])
+            with conn:
+                conn.execute("DELETE FROM patches WHERE id = ?", (idx,))
+                conn.executemany(
+                    "INSERT INTO patches VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def rebuild(self):
+        """ Recreates the entire index from the patch directories in the
+        backend.
+        """
+
+        with self._lock:
+            conn = self._connect()
+            rows = []
+            for idx in self.patch_ids():
+                rows += self._scan(idx)
+            with conn:
+                conn.execute("DELETE FROM patches")
+                conn.executemany(
+                    "INSERT INTO patches VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        """ Closes the database.
+        """
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _fetch_meta(self, query, params=()):
+        """ Runs a query that selects the light and json_path columns.
+
+        query: The SQL query.
+        params: Optional. The parameters for the query.
+
+        return: A list of PatchRecords, which load the rest of the
+                metadata from the patch's metadata file.
+        """
+
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+
+        return [PatchRecord.from_meta(json.loads(row[0]), row[1], read_meta)
+                for row in rows]
+
+    def _connect(self):
+        """ Opens the database the first time it is needed, creating or
+        rebuilding the index should it be missing or out of date.
+
+        return: The database connection.
+        """
+
+        if self._conn is None:
+            path = os.path.join(self.back_path, "library.db")
+            # Shared between the GUI thread and the worker threads, all
+            # of which go through self._lock.
+            self._conn = sqlite3.connect(path, check_same_thread=False,
+                                         timeout=30)
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                with self._conn:
+                    self._conn.execute("DROP TABLE IF EXISTS patches")
+                    self._conn.executescript(SCHEMA)
+                    self._conn.execute(
+                        "PRAGMA user_version = {}".format(SCHEMA_VERSION))
+                self.rebuild()
+
+        return self._conn
+
+    def _scan(self, idx):
+        """ Refreshes the manifest of a patch, and reads the metadata for
+        every version listed in it.
+
+        idx: The id of the patch, as a string.
+
+        return: A list of rows for the patches table.
+        """
+
+        self._manifest.back_path = self.back_path
+        versions = self._manifest.refresh(idx)
+
+        pch = self.patch_path(idx)
+        rows = []
+        for ver in versions:
+            json_path = os.path.join(pch, ver["json"])
+            try:
+                with open(json_path, "r") as f:
+                    meta = json.loads(f.read())
+            except (OSError, ValueError):
+                continue
+
+            rows.append((
+                ver["name"], idx, ver["version"], meta.get("title"),
+                _name(meta.get("author")),
+                ",".join(_name(t) for t in meta.get("tags") or []),
+                ",".join(_name(c) for c in meta.get("categories") or []),
+                meta.get("created_at"), meta.get("updated_at"),
+                None if ver["bin"] is None
+                else os.path.join(pch, ver["bin"]),
+                json_path, ver["size"], ver["mtime"], ver["sha256"],
+                json.dumps(light(meta))
+            ))
+
+        return rows
+
+
+def _name(item):
+    """ Gets the name out of an author, tag or category, which may be a
+    dict with a name attribute or a plain string.
+    """
+
+    if isinstance(item, dict):
+        return item.get("name") or ""
+
+    return item or ""
+
@@ -0,0 +1,112 @@
+"""
+    Converts the backend between the default layout, in which every
+    patch directory is saved directly in the backend directory, and the
+    sharded layout meant for very large libraries. The application must
+    not be running while doing so. From the root zoia_lib directory:
+        python -m zoia_lib.backend.patch_layout shard
+        python -m zoia_lib.backend.patch_layout unshard
+"""
+import os
+import sys
+
+from zoia_lib.backend.patch import SHARDS, Patch
+from zoia_lib.backend.patch_index import PatchIndex
+
+# Where patch directories are moved to while converting, such that an
+# interrupted conversion can simply be run again.
+SHARDING = SHARDS + ".new"
+UNSHARDING = SHARDS + ".old"
+
+
+class PatchLayout(Patch):
+    """ The PatchLayout class is a child of the Patch class. It is
+    responsible for converting the backend to and from the sharded
+    layout (see Patch.patch_path()).
+
+    Listing a directory holding hundreds of thousands of entries is
+    slow on most filesystems, so the sharded layout groups the patch
+    directories into at most 100 shards, by the last two digits of
+    their id. The rest of the backend (Banks, the store, the index,
+    etc.) stays where it is.
+
+    Patch directories are moved, never copied, so converting is quick
+    and needs no extra space. The index is rebuilt afterwards, as it
+    records where every file is.
+    """
+
+    def __init__(self):
+        """ Initialize the class such that it has a reference to the
+        backend path.
+        """
+
+        super().__init__()
+
+    def shard(self):
+        """ Converts the backend to the sharded layout. Patch directories
+        are moved to a temporary directory first, which only replaces
+        the patches directory once every patch directory is in it.
+
+        return: The number of patch directories that were moved.
+        """
+
+        if self.is_sharded():
+            return 0
+
+        tmp = os.path.join(self.back_path, SHARDING)
+        moved = 0
+        for idx in self.patch_ids():
+            shard = os.path.join(tmp, idx[-2:])
+            os.makedirs(shard, exist_ok=True)
+            os.rename(os.path.join(self.back_path, idx),
+                      os.path.join(shard, idx))
+            moved += 1
+        os.makedirs(tmp, exist_ok=True)
+        os.rename(tmp, os.path.join(self.back_path, SHARDS))
+
+        PatchIndex.for_path(self.back_path).rebuild()
+
+        return moved
+
+    def unshard(self):
+        """ Converts the backend back to the default layout. The patches
+        directory is renamed first, so that the backend is no longer
+        considered sharded while the patch directories are moved out of
+        it.
+
+        return: The number of patch directories that were moved.
+        """
+
+        tmp = os.path.join(self.back_path, UNSHARDING)
+        if self.is_sharded():
+            os.rename(os.path.join(self.back_path, SHARDS), tmp)
+        elif not os.path.isdir(tmp):
+            return 0
+
+        moved = 0
+        for shard in os.listdir(tmp):
+            path = os.path.join(tmp, shard)
+            for idx in os.listdir(path):
+                os.rename(os.path.join(path, idx),
+                          os.path.join(self.back_path, idx))
+                moved += 1
+            os.rmdir(path)
+        os.rmdir(tmp)
+
+        PatchIndex.for_path(self.back_path).rebuild()
+
+        return moved
+
+
+# Entry point for converting the backend.
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("shard", "unshard"):
+        print("usage: python -m zoia_lib.backend.patch_layout "
+              "shard|unshard")
+        sys.exit(2)
+
+    layout = PatchLayout()
+    if sys.argv[1] == "shard":
+        count = layout.shard()
+    else:
+        count = layout.unshard()
+    print("Moved {} patch directories.".format(count))
@@ -0,0 +1,409 @@
+import datetime
+import json
+import os
+import threading
+
+from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.utilities import file_digest, write_json
+
+# The name of the manifest within each patch directory.
+MANIFEST = "manifest.json"
+
+# Appended to the names of metadata files that are written ahead of
+# splitting a patch into two versions (see PatchManifest.finish_split()).
+# They aren't listed as versions until renamed.
+STAGED = ".staged"
+
+# Bumped whenever the format changes, which causes manifests to be
+# rebuilt from their patch directory. Patch directories with a manifest
+# of format 1 number their versions the way older versions did (v1
+# being the newest), and are renumbered.
+FORMAT = 2
+
+# Written to the backend once every patch directory saved by older
+# versions was renumbered (see PatchManifest._migrate()). Until then,
+# patch directories without a manifest are renumbered as well; after,
+# a missing manifest is simply rebuilt from the directory.
+NUMBERED = "numbered.json"
+
+# The plan for renumbering a patch directory, written to it ahead of
+# renaming anything, and the suffix of the files parked under their new
+# names in the meantime. See PatchManifest.finish_renumber().
+RENUMBER = "renumber.json" + STAGED
+PARKED = ".renumbered"
+
+# Held while renumbering, so that a patch directory is never renumbered
+# twice.
+_renumber_lock = threading.RLock()
+
+
+class PatchManifest(Patch):
+    """ The PatchManifest class is a child of the Patch class. It is
+    responsible for the manifest kept in every patch directory
+    (manifest.json), which lists the versions of the patch along with
+    the names, size, SHA-256 digest and timestamps of their files.
+
+    Version lookups and duplicate checks read the manifest rather than
+    listing the patch directory and opening every file in it. Classes
+    that modify a patch directory call PatchIndex.refresh() once they
+    are done, which refreshes the manifest before the index.
+
+    Each version is a dict containing:
+    - version: The version number, or 0 should the patch only have a
+               single version. Versions are numbered in the order they
+               were saved, starting at 1, and keep their number for as
+               long as there are multiple versions.
+    - name: The name of the version (e.g. 123456_v2).
+    - bin, json: The names of the binary and metadata files. bin is None
+                 should the binary be missing.
+    - size, sha256: The size and SHA-256 digest of the binary.
+    - mtime: The modification time of the binary, in nanoseconds.
+    - saved_at: When the binary was first saved to the patch directory.
+    """
+
+    def __init__(self):
+        """ Initialize the class such that it has a reference to the
+        backend path.
+        """
+
+        super().__init__()
+
+    def versions(self, idx):
+        """ Retrieves every version of a patch. Manifests missing from
+        patch directories saved by older versions are created.
+
+        idx: The id of the patch.
+
+        return: A list of versions as dicts, newest first. Empty if the
+                patch isn't saved.
+        """
+
+        versions = self._read(str(idx))
+        if versions is None:
+            versions = self.refresh(idx)
+
+        return versions
+
+    def latest(self, idx):
+        """ Retrieves the newest version of a patch.
+
+        idx: The id of the patch.
+
+        return: The version as a dict, or None if the patch isn't saved.
+        """
+
+        versions = self.versions(idx)
+
+        return versions[0] if versions else None
+
+    def has_binary(self, idx, digest):
+        """ Determines whether a binary is already saved for a patch.
+
+        idx: The id of the patch.
+        digest: The SHA-256 digest of the binary, as a hex string.
+
+        return: True if it is saved, False otherwise.
+        """
+
+        return any(ver["sha256"] == digest for ver in self.versions(idx))
+
+    def refresh(self, idx):
+        """ Brings the manifest for a patch in line with its directory.
+        Only binaries that were added or modified since the manifest was
+        last written are hashed, and the manifest is only rewritten
+        should anything have changed.
+
+        Splits and renumberings that were interrupted are completed
+        first. A missing or unreadable manifest is rebuilt from the
+        version numbers in the directory, which are only renumbered
+        for directories saved by older versions (see _migrate()).
+
+        idx: The id of the patch.
+
+        return: The versions, as returned by versions().
+        """
+
+        idx = str(idx)
+        pch = self.patch_path(idx)
+        self._migrate()
+        try:
+            entries = {entry.name: entry for entry in os.scandir(pch)}
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+        if "{}_v1.json{}".format(idx, STAGED) in entries:
+            # A split that was interrupted.
+            self.finish_split(idx)
+            entries = {entry.name: entry for entry in os.scandir(pch)}
+
+        old = self._read(idx)
+        if old is None or RENUMBER in entries:
+            with _renumber_lock:
+                # A renumbering that was interrupted is completed, and
+                # manifests of format 1 still use the old numbering.
+                if not self.finish_renumber(idx) \
+                        and self._format(idx) == 1:
+                    self._renumber(idx)
+                entries = {entry.name: entry for entry in os.scandir(pch)}
+
+                return self._build(idx, entries, old or [])
+
+        return self._build(idx, entries, old)
+
+    def _build(self, idx, entries, old):
+        """ Writes the manifest for a patch, should it differ from the
+        current one. See refresh().
+
+        idx: The id of the patch, as a string.
+        entries: A dict mapping the names of the files in the patch
+                 directory to their os.DirEntry.
+        old: The versions listed in the current manifest, or an empty
+             list if there is none.
+
+        return: The versions, as returned by versions().
+        """
+
+        pch = self.patch_path(idx)
+        # Renaming a version keeps the size and modification time of
+        # its binary, so the digest can be carried over.
+        digests = {(ver["size"], ver["mtime"]): ver["sha256"]
+                   for ver in old if ver["bin"] is not None}
+        saved = {ver["sha256"]: ver["saved_at"] for ver in old}
+
+        versions = []
+        for file, entry in entries.items():
+            name, ext = os.path.splitext(file)
+            if ext != ".json" or file == MANIFEST:
+                continue
+
+            ver = {
+                "version": int(name.split("_v")[1]) if "_v" in name else 0,
+                "name": name,
+                "bin": name + ".bin",
+                "json": file,
+                "size": None,
+                "sha256": None,
+                "mtime": None,
+                "saved_at": None
+            }
+            if ver["bin"] in entries:
+                stat = entries[ver["bin"]].stat()
+                ver["size"] = stat.st_size
+                ver["mtime"] = stat.st_mtime_ns
+                ver["sha256"] = digests.get((ver["size"], ver["mtime"])) \
+                    or file_digest(os.path.join(pch, ver["bin"]))
+                ver["saved_at"] = saved.get(ver["sha256"]) or \
+                    "{:%Y-%m-%dT%H:%M:%S+00:00}".format(
+                        datetime.datetime.fromtimestamp(stat.st_mtime))
+            else:
+                ver["bin"] = None
+            versions.append(ver)
+        versions.sort(key=lambda ver: ver["version"], reverse=True)
+
+        if versions != old or MANIFEST not in entries:
+            write_json(os.path.join(pch, MANIFEST),
+                       {"format": FORMAT, "id": idx, "versions": versions})
+
+        return versions
+
+    def finish_split(self, idx):
+        """ Splits the single version of a patch into two versions, v1
+        and v2, once the binary of v2 and the metadata of both versions
+        have been written ahead of time. The metadata is staged as
+        <id>_v2.json.staged and then <id>_v1.json.staged; the latter
+        being there means that everything else is.
+
+        The files are then moved into place one at a time, such that
+        the patch directory always lists at least one version. Each step
+        is skipped should it have been done already, so a split that was
+        interrupted (e.g. by a crash) is completed by calling this
+        again, which refresh() does.
+
+        idx: The id of the patch.
+
+        return: True if there was a split to complete, False otherwise.
+        """
+
+        idx = str(idx)
+        pch = self.patch_path(idx)
+        staged = os.path.join(pch, "{}_v1.json{}".format(idx, STAGED))
+        if not os.path.exists(staged):
+            return False
+
+        steps = [
+            ("{}_v2.json{}".format(idx, STAGED), "{}_v2.json".format(idx)),
+            ("{}.bin".format(idx), "{}_v1.bin".format(idx)),
+            ("{}.json".format(idx), None),
+            ("{}_v1.json{}".format(idx, STAGED), "{}_v1.json".format(idx))
+        ]
+        for src, dst in steps:
+            try:
+                if dst is None:
+                    os.remove(os.path.join(pch, src))
+                else:
+                    os.replace(os.path.join(pch, src), os.path.join(pch, dst))
+            except FileNotFoundError:
+                # Done already.
+                pass
+
+        return True
+
+    def finish_renumber(self, idx):
+        """ Renumbers the versions of a patch as planned by _renumber().
+        The files of every version that is renumbered are first parked
+        under their new names, with PARKED appended, and only moved into
+        place once all of them are, as the new numbers overlap with the
+        old ones. The plan records when that is the case.
+
+        Each step is skipped should it have been done already, so a
+        renumbering that was interrupted (e.g. by a crash) is completed
+        by calling this again, which refresh() does before anything
+        else is renamed.
+
+        idx: The id of the patch, as a string.
+
+        return: True if there was a renumbering to complete, False
+                otherwise.
+        """
+
+        pch = self.patch_path(idx)
+        plan_path = os.path.join(pch, RENUMBER)
+        try:
+            with open(plan_path, "r") as f:
+                plan = json.loads(f.read())
+        except FileNotFoundError:
+            return False
+
+        renames = [(ver, new) for ver, new in plan["versions"] if ver != new]
+        if not plan["parked"]:
+            # Files still under an old number haven't been parked, as
+            # nothing is moved into place before all of them are.
+            for ver, new in renames:
+                for ext in ("bin", "json"):
+                    try:
+                        os.rename(
+                            os.path.join(pch, "{}_v{}.{}".format(
+                                idx, ver, ext)),
+                            os.path.join(pch, "{}_v{}.{}{}".format(
+                                idx, new, ext, PARKED)))
+                    except FileNotFoundError:
+                        # Parked already, or never there.
+                        pass
+            write_json(plan_path, {**plan, "parked": True})
+
+        for _, new in renames:
+            for ext in ("bin", "json"):
+                name = os.path.join(pch, "{}_v{}.{}".format(idx, new, ext))
+                try:
+                    os.replace(name + PARKED, name)
+                except FileNotFoundError:
+                    # Moved into place already, or never there.
+                    pass
+
+        # The revision is used to name and sort versions.
+        for _, new in plan["versions"]:
+            name = os.path.join(pch, "{}_v{}.json".format(idx, new))
+            try:
+                with open(name, "r") as f:
+                    meta = json.loads(f.read())
+                if meta.get("revision") != new:
+                    meta["revision"] = new
+                    write_json(name, meta)
+            except (FileNotFoundError, ValueError):
+                pass
+
+        os.remove(plan_path)
+
+        return True
+
+    def _renumber(self, idx):
+        """ Renumbers the versions of a patch saved by older versions,
+        which renumbered every version whenever one was added so that
+        v1 was always the newest, such that the oldest is v1 instead.
+        The renames are planned ahead in RENUMBER, and carried out by
+        finish_renumber().
+
+        idx: The id of the patch, as a string.
+        """
+
+        pch = self.patch_path(idx)
+        old = sorted(int(name[len(idx) + 2:-5]) for name in os.listdir(pch)
+                     if name.startswith(idx + "_v") and name.endswith(".json")
+                     and name[len(idx) + 2:-5].isdigit())
+        if not old:
+            return
+
+        write_json(os.path.join(pch, RENUMBER), {
+            "versions": [(ver, len(old) - i) for i, ver in enumerate(old)],
+            "parked": False
+        })
+        self.finish_renumber(idx)
+
+    def _migrate(self):
+        """ Renumbers every patch directory saved by older versions,
+        once per backend, and then writes NUMBERED. Patch directories
+        that don't have a manifest by then were saved by older versions,
+        as this version writes one whenever it saves a patch. Those that
+        do are only renumbered should it be of format 1.
+        """
+
+        marker = os.path.join(self.back_path, NUMBERED)
+        if os.path.exists(marker):
+            return
+
+        with _renumber_lock:
+            if os.path.exists(marker):
+                return
+            try:
+                ids = self.patch_ids()
+            except FileNotFoundError:
+                return
+            for idx in ids:
+                pch = self.patch_path(idx)
+                if self._format(idx) not in (None, 1) \
+                        and not os.path.exists(os.path.join(pch, RENUMBER)):
+                    continue
+                if not self.finish_renumber(idx):
+                    self._renumber(idx)
+                self._build(idx, {entry.name: entry
+                                  for entry in os.scandir(pch)}, [])
+            write_json(marker, {"format": FORMAT})
+
+    def _format(self, idx):
+        """ Determines the format of the manifest for a patch.
+
+        idx: The id of the patch, as a string.
+
+        return: The format as an int, or None if there is no readable
+                manifest.
+        """
+
+        try:
+            with open(os.path.join(self.patch_path(idx), MANIFEST), "r") as f:
+                manifest = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        return manifest.get("format") if isinstance(manifest, dict) \
+            else None
+
+    def _read(self, idx):
+        """ Reads the manifest for a patch.
+
+        idx: The id of the patch, as a string.
+
+        return: The versions, or None if there is no manifest this
+                version can read.
+        """
+
+        try:
+            with open(os.path.join(self.patch_path(idx), MANIFEST), "r") as f:
+                manifest = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(manifest, dict) \
+                or manifest.get("format") != FORMAT:
+            return None
+
+        return manifest["versions"]
@@ -0,0 +1,361 @@
+import json
+import threading
+from collections import OrderedDict
+from sys import intern
+
+# The attributes that are only needed to display a single patch, which
+# are left out of the index of local patches.
+HEAVY = frozenset(("content", "preview_url", "license", "files"))
+
+# The attributes held by every PatchRecord.
+FIELDS = ("id", "title", "author", "tags", "categories", "created_at",
+          "updated_at", "like_count", "download_count", "view_count",
+          "revision")
+
+# The number of patches whose complete metadata is kept in memory.
+CACHE_SIZE = 64
+
+
+class MetaCache:
+    """ A least recently used cache of complete patch metadata, shared by
+    every PatchRecord so that the memory held for the heavy
+    attributes stays bounded no matter how many records exist.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        """ Initializes an empty cache.
+
+        maxsize: Optional. The number of patches to keep metadata for.
+        """
+
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """ Retrieves the complete metadata for a patch, loading it
+        should it not be cached.
+
+        key: The key the patch is cached under, which is also passed to
+             loader.
+        loader: A function taking key and returning the complete
+                metadata, or None if it isn't available.
+
+        return: The complete metadata, or None if it isn't available.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        # Load outside of the lock, as it may involve reading a file.
+        meta = loader(key)
+        if meta is None:
+            return None
+
+        with self._lock:
+            self._entries[key] = meta
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return meta
+
+    def discard(self, key):
+        """ Drops the metadata for a patch, e.g. once it was modified.
+
+        key: The key the patch is cached under.
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """ Drops the metadata for every patch.
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+meta_cache = MetaCache()
+
+
+class PatchRecord:
+    """ Patch metadata that only holds the attributes used by the
+    tables, searching and sorting, in slots rather than a dict. Author,
+    tag and category names are interned, so that every record shares
+    a single copy of each name.
+
+    Searching and sorting use the attributes directly, e.g. record.title
+    or record.tags (a tuple of names). For everything else, records can
+    be used like the dicts PS returns: record["tags"][0]["name"].
+    Attributes that aren't held are loaded on first access through
+    meta_cache, so that they don't stay in memory for every patch.
+    Only indexing loads them. The names of the attributes that can be
+    loaded are known up front, so "in" answers for every attribute of
+    the complete metadata without loading it. Iterating over a record
+    only lists the attributes it holds.
+    """
+
+    __slots__ = FIELDS + ("_key", "_loader", "_other")
+
+    def __init__(self, key=None, loader=None, other=(), **fields):
+        """ Initializes the record.
+
+        key: Optional. The key used to load the complete metadata, such
+             as a patch id or the path to a metadata file.
+        loader: Optional. A function taking key and returning the
+                complete metadata, or None if it isn't available.
+        other: Optional. The names of the attributes of the complete
+               metadata that aren't held, such as those in HEAVY. Only
+               used along with a loader.
+        fields: The attributes to hold, out of FIELDS. Attributes that
+                aren't given (or are None) are treated as missing.
+        """
+
+        for field in FIELDS:
+            setattr(self, field, fields.get(field))
+        self._key = key
+        self._loader = loader
+        self._other = keyset(other if loader is not None else ())
+
+    @classmethod
+    def from_meta(cls, meta, key=None, loader=None):
+        """ Creates a record out of patch metadata.
+
+        meta: The metadata as a dict, as returned by PS.
+        key: Optional. See __init__().
+        loader: Optional. See __init__().
+
+        return: A new PatchRecord.
+        """
+
+        author = meta.get("author")
+        record = cls(
+            key, loader,
+            id=meta.get("id"),
+            title=meta.get("title"),
+            author=intern(author["name"]) if author else None,
+            tags=names(meta["tags"]) if "tags" in meta else None,
+            categories=names(meta["categories"])
+            if "categories" in meta else None,
+            created_at=meta.get("created_at"),
+            updated_at=meta.get("updated_at"),
+            like_count=meta.get("like_count"),
+            download_count=meta.get("download_count"),
+            view_count=meta.get("view_count"),
+            revision=meta.get("revision")
+        )
+        if loader is not None:
+            record._other = keyset(name for name in meta
+                                   if name not in _HELD
+                                   or getattr(record, name) is None)
+
+        return record
+
+    def __getitem__(self, key):
+        if key in _HELD:
+            value = getattr(self, key)
+            if value is not None:
+                if key == "author":
+                    return {"name": value}
+                if key == "tags" or key == "categories":
+                    return [{"name": name} for name in value]
+                return value
+
+        meta = meta_cache.get(self._key, self._loader) \
+            if self._loader is not None else None
+        if meta is not None and key in meta:
+            return meta[key]
+
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in _HELD and getattr(self, key) is not None \
+            or key in self._other
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if not isinstance(other, PatchRecord):
+            return NotImplemented
+        return self._values() == other._values()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "PatchRecord({})".format(", ".join(
+            "{}={!r}".format(field, getattr(self, field))
+            for field in self.keys()))
+
+    def keys(self):
+        """ Lists the attributes held by the record.
+
+        return: A list of attribute names.
+        """
+
+        return [field for field in FIELDS if getattr(self, field) is not None]
+
+    def other_keys(self):
+        """ Lists the attributes of the complete metadata that aren't
+        held by the record, without loading it.
+
+        return: A frozenset of attribute names.
+        """
+
+        return self._other
+
+    def get(self, key, default=None):
+        """ Retrieves an attribute, loading it should it not be held.
+
+        key: The name of the attribute.
+        default: Optional. Returned should the patch not have the
+                 attribute.
+
+        return: The value of the attribute, in the form PS returns it.
+        """
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def full(self):
+        """ Retrieves the complete metadata for the patch.
+
+        return: A new dict containing every attribute, which the caller
+                is free to modify.
+        """
+
+        meta = meta_cache.get(self._key, self._loader) \
+            if self._loader is not None else None
+        meta = dict(meta or {})
+        meta.update((field, self[field]) for field in self.keys())
+
+        return meta
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in FIELDS)
+
+
+class BulkLoader:
+    """ A loader for PatchRecords that can also load the complete
+    metadata of many patches at once, e.g. in a single pass over the
+    file it is stored in. Called with a key, it loads a single patch
+    like any other loader. See load_many().
+    """
+
+    def __init__(self, one, many):
+        """ Initializes the loader.
+
+        one: A function taking a key and returning the complete
+             metadata, or None if it isn't available.
+        many: A function taking a list of keys and returning an iterable
+              of (key, complete metadata) tuples, skipping those that
+              aren't available.
+        """
+
+        self.one = one
+        self.many = many
+
+    def __call__(self, key):
+        return self.one(key)
+
+
+# Faster than checking against FIELDS.
+_HELD = frozenset(FIELDS)
+
+# Patches tend to have the same attributes, so records share the sets
+# of their names.
+_keysets = {}
+
+
+def keyset(keys):
+    """ Retrieves the shared set of a group of attribute names.
+
+    keys: The attribute names.
+
+    return: A frozenset, the same object for the same names.
+    """
+
+    keys = frozenset(keys)
+    return _keysets.setdefault(keys, keys)
+
+
+def names(items):
+    """ Interns the names of a list of tags or categories.
+
+    items: A list of dicts with a name attribute, as returned by PS.
+
+    return: A tuple of interned names.
+    """
+
+    return tuple(intern(item["name"]) for item in items)
+
+
+def light(meta):
+    """ Leaves the values of the attributes in HEAVY out of patch
+    metadata. Their names are kept, as None, so that records created
+    from it know that they can be loaded.
+
+    meta: The complete metadata, as a dict.
+
+    return: A new dict with None for the attributes in HEAVY.
+    """
+
+    return {key: None if key in HEAVY else value
+            for key, value in meta.items()}
+
+
+def load_many(records):
+    """ Loads the complete metadata of many records, bypassing
+    meta_cache so that it isn't flushed. Records sharing a BulkLoader
+    are loaded with a single call to it; the others one at a time.
+
+    records: A list of PatchRecords.
+
+    return: A generator of (record, complete metadata) tuples, with None
+            for metadata that isn't available, not necessarily in the
+            order of records.
+    """
+
+    bulk = {}
+    for pch in records:
+        loader = pch._loader
+        if isinstance(loader, BulkLoader):
+            bulk.setdefault(loader, {}).setdefault(pch._key, []).append(pch)
+        else:
+            yield pch, loader(pch._key) if loader is not None else None
+
+    for loader, keys in bulk.items():
+        for key, meta in loader.many(list(keys)):
+            for pch in keys.pop(key, ()):
+                yield pch, meta
+        for pchs in keys.values():
+            for pch in pchs:
+                yield pch, None
+
+
+def read_meta(path):
+    """ Reads the metadata saved for a patch in the backend. Used as the
+    loader for records of locally saved patches.
+
+    path: The path to the metadata file.
+
+    return: The metadata, or None if it can't be read.
+    """
+
+    try:
+        with open(path, "r") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import json
 import os
 import platform
@@ -11,7 +12,11 @@ from zoia_lib.backend.patch import Patch
 from zoia_lib.common import errors
 from zoia_lib.backend.api import PatchStorage
 from zoia_lib.backend.patch_binary import PatchBinary
-from zoia_lib.backend.utilities import hide_dotted_files, natural_key
+from zoia_lib.backend.patch_catalog import PatchCatalog
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.patch_manifest import STAGED, PatchManifest
+from zoia_lib.backend.patch_store import PatchStore
+from zoia_lib.backend.utilities import hide_dotted_files, write_json
 
 pb = PatchBinary()
 ps = PatchStorage()
@@ -41,15 +46,34 @@ class PatchSave(Patch):
         patch: A tuple containing the downloaded file
                data and the patch metadata, comes from ps.download(IDX).
                patch[0] is raw binary data, while patch[1] is json data.
+               Alternatively, a tuple containing the path to the
+               downloaded file, the patch metadata and the SHA-256 digest
+               of the file, which comes from ps.download_to_file(). The
+               file may be moved into the backend; the caller is
+               responsible for removing it otherwise.
 
         raise: SavingError should the patch fail to save.
         raise: RenamingError should the patch fail to be renamed.
         """
 
+        try:
+            self._save_to_backend(patch)
+        finally:
+            # Whatever made it into the patch directory, even if saving
+            # failed partway, needs to be reflected in the index.
+            if self.back_path is not None and isinstance(patch, tuple) \
+                    and isinstance(patch[1], dict) and "id" in patch[1]:
+                PatchIndex.for_path(self.back_path).refresh(patch[1]["id"])
+
+    def _save_to_backend(self, patch):
+        """ Saves a patch to the backend without updating the index.
+        See save_to_backend().
+        """
+
         # Don't try to save a file when we are missing necessary info.
         if patch is None or patch[0] is None \
                 or patch[1] is None or self.back_path is None \
-                or not isinstance(patch[0], bytes) \
+                or not isinstance(patch[0], (bytes, str)) \
                 or not isinstance(patch[1], dict):
             raise errors.SavingError(None)
 
@@ -62,34 +86,24 @@ class PatchSave(Patch):
         pch_id = str(patch[1]['id'])
         if len(pch_id) == 5:
             # This is an imported patch. Unfortunately, we need to make sure
-            # that its a unique binary by checking every patch currently
-            # stored.
-            for fld in os.listdir(self.back_path):
-                if os.path.isdir(os.path.join(self.back_path, fld)) \
-                        and fld != "Banks" and fld != "sample_files" \
-                        and fld != ".DS_Store":
-                    for files in os.listdir(os.path.join(self.back_path, fld)):
-                        # Check every .bin file only.
-                        if files.split(".")[-1] == "bin":
-                            with open(os.path.join(
-                                    self.back_path, fld, files), "rb") as f:
-                                data = f.read()
-                            if patch[0] == data:
-                                raise errors.SavingError(patch[1]["title"],
-                                                         503)
-
-        pch = os.path.join(self.back_path, "{}".format(pch_id))
+            # that its a unique binary, which the index knows the digest
+            # of for every patch currently stored.
+            index = PatchIndex.for_path(self.back_path)
+            if index.has_binary(self._digest(patch)):
+                raise errors.SavingError(patch[1]["title"], 503)
+
+        pch = self.patch_path(pch_id)
         # Check to see if a directory needs to be made
         # (new patch, no version control needed yet).
         if not os.path.isdir(pch):
-            os.mkdir(pch)
+            os.makedirs(pch)
             if "files" in patch[1] \
                     and patch[1]["files"][0]["filename"].split(".")[-1] \
                     != "bin":
                 # If it isn't a straight bin additional work must be done.
                 if patch[1]["files"][0]["filename"].split(".")[-1] == "py":
                     # We are not responsible for .py files.
-                    shutil.rmtree(os.path.join(self.back_path, pch))
+                    shutil.rmtree(pch)
                     raise errors.SavingError(patch[1], 501)
                 else:
                     # Try to decompress the patch.
@@ -97,8 +111,7 @@ class PatchSave(Patch):
             # Make sure the files attribute exists.
             elif "files" in patch[1]:
                 name_bin = os.path.join(pch, "{}.bin".format(pch_id))
-                with open(name_bin, "wb") as f:
-                    f.write(patch[0])
+                self._write_binary(patch, name_bin)
                 self.save_metadata_json(patch[1])
             else:
                 # No files attribute,
@@ -121,23 +134,22 @@ class PatchSave(Patch):
                     # the extracted files.
                     os.mkdir(os.path.join(self.back_path, "temp"))
                     # Write the zip
-                    zfile = os.path.join(self.back_path, "temp.zip")
-                    with open(zfile, "wb") as zf:
-                        zf.write(patch[0])
+                    name_zip = os.path.join(self.back_path, "temp.zip")
+                    zfile = self._archive_path(patch, name_zip)
                     with zipfile.ZipFile(zfile, 'r') as zipObj:
                         # Extract all the contents into the temporary
                         # directory.
                         zipObj.extractall(os.path.join(self.back_path, "temp"))
                     # Ditch the zip
-                    os.remove(zfile)
+                    if zfile == name_zip:
+                        os.remove(zfile)
                 elif patch[1]["files"][0]["filename"].split(".")[-1] == "rar":
                     # Create a temporary directory to store
                     # the extracted files.
                     os.mkdir(os.path.join(self.back_path, "temp"))
                     # Write the rar
-                    rfile = os.path.join(self.back_path, "temp.zip")
-                    with open(rfile, "wb") as rf:
-                        rf.write(patch[0])
+                    name_rar = os.path.join(self.back_path, "temp.zip")
+                    rfile = self._archive_path(patch, name_rar)
                     try:
                         with rarfile.RarFile(rfile, "r") as rar_obj:
                             # Extract all the contents into the temporary
@@ -146,10 +158,12 @@ class PatchSave(Patch):
                                 self.back_path, "temp"))
                     except rarfile.RarCannotExec:
                         # No WinRAR installed
-                        os.remove(rfile)
+                        if rfile == name_rar:
+                            os.remove(rfile)
                         raise errors.SavingError(patch[1]["title"])
                     # Ditch the rar
-                    os.remove(rfile)
+                    if rfile == name_rar:
+                        os.remove(rfile)
                 else:
                     # If we get here we encountered a new compression algo.
                     # Logic needs to be added above to deal with it.
@@ -164,7 +178,7 @@ class PatchSave(Patch):
                         if file.split(".")[-1] == "bin":
                             with open(file, "rb") as bin_file:
                                 raw_bin = bin_file.read()
-                            self.save_to_backend((raw_bin, patch[1]))
+                            self._save_to_backend((raw_bin, patch[1]))
                             diff = True
                     except FileNotFoundError or errors.SavingError:
                         pass
@@ -176,86 +190,69 @@ class PatchSave(Patch):
                 return
 
             # If we get here, we are working with a .bin, so we
-            # need to to see if the binary is already saved.
-            for file in os.listdir(os.path.join(pch)):
-                if file.split(".")[-1] == "bin":
-                    with open(os.path.join(pch, file), "rb") as f:
-                        if f.read() == patch[0]:
-                            # This exact binary is already saved onto the
-                            # system.
-                            raise errors.SavingError(patch[1]["title"], 503)
+            # need to to see if the binary is already saved, which the
+            # manifest knows the digest of.
+            manifest = PatchManifest()
+            manifest.back_path = self.back_path
+            versions = manifest.versions(pch_id)
+            digest = self._digest(patch)
+            if any(ver["sha256"] == digest for ver in versions):
+                # This exact binary is already saved onto the
+                # system.
+                raise errors.SavingError(patch[1]["title"], 503)
 
             # If we get here, we have a unique patch, so we need to find
             # out what version # to give it.
 
             # Case 2: Only one version of the patch existed previously.
-            if len(os.listdir(os.path.join(self.back_path, pch))) == 2:
-                name_bin = os.path.join(pch, "{}_v1.bin".format(pch_id))
-                with open(name_bin, "wb") as f:
-                    f.write(patch[0])
-                self.save_metadata_json(patch[1], 1)
-                # Add the version suffix to the patch that was previously
-                # in the directory.
-                try:
-                    os.rename(os.path.join(pch, "{}.bin".format(pch_id)),
-                              os.path.join(pch, "{}_v2.bin".format(pch_id)))
-                    os.rename(os.path.join(pch, "{}.json".format(pch_id)),
-                              os.path.join(pch, "{}_v2.json".format(pch_id)))
-                except FileNotFoundError or FileExistsError:
+            if len(versions) == 1 and versions[0]["version"] == 0:
+                # The patch that was previously in the directory becomes
+                # the first version. Both versions are written before
+                # any file is renamed, so that the renames can be
+                # completed should they be interrupted.
+                if versions[0]["bin"] is None:
                     raise errors.RenamingError(patch, 601)
+                self._write_binary(patch, os.path.join(
+                    pch, "{}_v2.bin".format(pch_id)))
+                patch[1]["revision"] = 2
+                write_json(os.path.join(pch, "{}_v2.json{}".format(
+                    pch_id, STAGED)), patch[1])
                 # Update the revision number in the metadata.
                 # (Used for sorting purposes).
-                with open(os.path.join(pch, "{}_v2.json".format(pch_id)),
+                with open(os.path.join(pch, "{}.json".format(pch_id)),
                           "r") as f:
                     jf = json.loads(f.read())
-                jf["revision"] = 2
-                with open(os.path.join(pch, "{}_v2.json".format(pch_id)),
-                          "w") as f:
-                    json.dump(jf, f)
+                jf["revision"] = 1
+                write_json(os.path.join(pch, "{}_v1.json{}".format(
+                    pch_id, STAGED)), jf)
+                manifest.finish_split(pch_id)
             # Case 3: There were already multiple versions in the patch
-            # directory.
-            elif len(os.listdir(os.path.join(self.back_path, pch))) > 2:
-                # Increment the version number for each file in the directory.
-                try:
-                    # for file in sorted(os.listdir(pch), key=len):
-                    for file in sorted(sorted(os.listdir(pch), key=len),
-                                       key=natural_key, reverse=True):
-                        ver = int(file.split("v")[1].split(".")[0]) + 1
-                        extension = file.split(".")[-1]
-                        os.rename(os.path.join(
-                            pch, "{}_v{}.{}".format(pch_id, str(ver - 1),
-                                                    extension)),
-                            os.path.join(
-                                pch, "{}_v{}.{}".format(pch_id, str(ver),
-                                                        extension)))
-                        # Update the revision number in each metadata file
-                        if extension == "json":
-                            with open(os.path.join(
-                                    pch, "{}_v{}.json".format(pch_id, str(ver))),
-                                    "r") as f:
-                                jf = json.loads(f.read())
-
-                            jf["revision"] = ver
-
-                            with open(os.path.join(
-                                    pch, "{}_v{}.json".format(pch_id, str(ver))),
-                                    "w") as f:
-                                json.dump(jf, f)
-
-                except FileNotFoundError or FileExistsError:
-                    raise errors.SavingError(patch)
-                # Save the newest version
-                name_bin = os.path.join(pch, "{}_v1.bin".format(pch_id))
-                with open(name_bin, "wb") as f:
-                    f.write(patch[0])
-                self.save_metadata_json(patch[1], 1)
+            # directory. Versions are never renumbered, the new version
+            # simply gets the next number.
+            elif versions and versions[0]["version"] > 0:
+                self._save_version(patch, versions[0]["version"] + 1)
             else:
-                """ Getting here indicates that the amount of files in the 
-                directory was less than 2 (which would imply some form of 
-                corruption occurred). 
+                """ Getting here indicates that the manifest lists no
+                versions (which would imply some form of corruption
+                occurred).
                 """
                 raise errors.SavingError(patch[1]["title"])
 
+    def _save_version(self, patch, version):
+        """ Saves a new version of a patch to its existing patch
+        directory. The binary is written first, as the version only
+        exists once its metadata file does.
+
+        patch: A tuple as passed to save_to_backend().
+        version: The version number, which must not be in use yet.
+        """
+
+        pch_id = str(patch[1]["id"])
+        name_bin = os.path.join(self.patch_path(pch_id),
+                                "{}_v{}.bin".format(pch_id, version))
+        self._write_binary(patch, name_bin)
+        self.save_metadata_json(patch[1], version)
+
     def save_metadata_json(self, metadata, version=0):
         """ Saves metadata for patches to the backend directory.
 
@@ -268,19 +265,18 @@ class PatchSave(Patch):
 
         # Save the metadata.
         if version <= 0:
-            name_json = os.path.join(self.back_path, str(metadata['id']),
+            name_json = os.path.join(self.patch_path(metadata["id"]),
                                      "{}.json".format(metadata["id"]))
         else:
             name_json = os.path.join(
-                self.back_path, str(metadata['id']), "{}_v{}.json".format(
+                self.patch_path(metadata["id"]), "{}_v{}.json".format(
                     metadata["id"], version))
 
         # Update the revision number if need be.
         if version > 0:
             metadata["revision"] = version
 
-        with open(name_json, "w") as jf:
-            json.dump(metadata, jf)
+        write_json(name_json, metadata)
 
     def import_to_backend(self, path, version=False):
         """Attempts to import a patch to the backend .ZoiaLibraryApp
@@ -404,9 +400,10 @@ class PatchSave(Patch):
                 }
             }
 
-            if os.path.exists(os.path.join(self.back_path, "data.json")):
-                with open(os.path.join(self.back_path, "data.json"), "r") as f:
-                    data = json.loads(f.read())
+            catalog = PatchCatalog()
+            catalog.back_path = self.back_path
+            data = catalog.load()
+            if data is not None:
                 for pch in data:
                     if js_data["title"].lower() in pch["title"].lower():
                         temp = ps.get_patch_meta(pch["id"])
@@ -438,6 +435,7 @@ class PatchSave(Patch):
         patch: A tuple containing the downloaded file
                data and the patch metadata, comes from ps.download().
                patch[0] is raw binary data, while patch[1] is json data.
+               See save_to_backend() for patches downloaded to a file.
 
         raise: SavingError should the contents fail to save.
         raise: RenamingError should the contents fail to be renamed.
@@ -445,34 +443,32 @@ class PatchSave(Patch):
 
         patch_id = str(patch[1]["id"])
 
-        pch = os.path.join(self.back_path, "{}".format(patch_id))
+        pch = self.patch_path(patch_id)
         if not os.path.isdir(pch):
-            os.mkdir(pch)
+            os.makedirs(pch)
 
         if patch[1]["files"][0]["filename"].split(".")[-1] == "zip":
             # .zip files
             name_zip = os.path.join(pch, "{}.zip".format(patch_id))
-            with open(name_zip, "wb") as f:
-                f.write(patch[0])
-            with zipfile.ZipFile(os.path.join(pch, "{}.zip".format(patch_id)),
-                                 "r") as zip_obj:
+            zfile = self._archive_path(patch, name_zip)
+            with zipfile.ZipFile(zfile, "r") as zip_obj:
                 # Extract all the contents into the patch directory
                 zip_obj.extractall(pch)
             # Ditch the zip
-            os.remove(name_zip)
+            if zfile == name_zip:
+                os.remove(name_zip)
             to_delete = None
         elif patch[1]["files"][0]["filename"].split(".")[-1] == "rar":
             # .rar files
             name_rar = os.path.join(pch, "{}.rar".format(patch_id))
-            with open(name_rar, "wb") as f:
-                f.write(patch[0])
+            rfile = self._archive_path(patch, name_rar)
             try:
-                with rarfile.RarFile(os.path.join(pch, "{}.rar".format(patch_id)),
-                                     "r") as rar_obj:
+                with rarfile.RarFile(rfile, "r") as rar_obj:
                     # Extract all the contents into the patch directory
                     rar_obj.extractall(pch)
                 # Ditch the rar
-                os.remove(name_rar)
+                if rfile == name_rar:
+                    os.remove(name_rar)
                 to_delete = None
             except rarfile.RarCannotExec:
                 print("As .rar compression is a commercial product, you must "
@@ -532,8 +528,7 @@ class PatchSave(Patch):
         if to_delete is not None:
             # We need to cleanup.
             for file in os.listdir(to_delete):
-                correct_pch = os.path.join(
-                    self.back_path, "{}".format(str(patch_id)))
+                correct_pch = self.patch_path(patch_id)
                 shutil.copy(os.path.join(to_delete, file),
                             os.path.join(correct_pch))
             try:
@@ -541,6 +536,75 @@ class PatchSave(Patch):
             except FileNotFoundError:
                 raise errors.RenamingError(patch)
 
+        # Share the extracted binaries with any identical ones.
+        store = self._store()
+        pch = self.patch_path(patch_id)
+        for file in os.listdir(pch):
+            if file.split(".")[-1] == "bin":
+                store.add(os.path.join(pch, file))
+
+    def _write_binary(self, patch, name_bin):
+        """ Saves the binary for a patch to the backend. Patches that
+        were downloaded to a file are moved into place rather than
+        read into memory. Should an identical binary already be saved
+        for any patch, the two share a single copy.
+
+        patch: A tuple as passed to save_to_backend().
+        name_bin: The path the binary will be saved to.
+        """
+
+        if isinstance(patch[0], bytes):
+            with open(name_bin, "wb") as f:
+                f.write(patch[0])
+        else:
+            shutil.move(patch[0], name_bin)
+        self._store().add(name_bin, self._digest(patch))
+
+    def _store(self):
+        """ Retrieves the store of binaries for the backend.
+
+        return: A PatchStore.
+        """
+
+        store = PatchStore()
+        store.back_path = self.back_path
+
+        return store
+
+    @staticmethod
+    def _digest(patch):
+        """ Determines the SHA-256 digest of the binary for a patch.
+
+        patch: A tuple as passed to save_to_backend().
+
+        return: The digest, as a hex string.
+        """
+
+        if isinstance(patch[0], bytes):
+            return hashlib.sha256(patch[0]).hexdigest()
+
+        return patch[2]
+
+    @staticmethod
+    def _archive_path(patch, name):
+        """ Determines where the archive for a compressed patch can be
+        opened from. Archives that were downloaded to a file are used in
+        place, while archives held in memory are written out first.
+
+        patch: A tuple as passed to save_to_backend().
+        name: The path the archive is written to, if need be.
+
+        return: The path to the archive. If it is the same as name, the
+                caller should remove it once done.
+        """
+
+        if isinstance(patch[0], bytes):
+            with open(name, "wb") as f:
+                f.write(patch[0])
+            return name
+
+        return patch[0]
+
     @staticmethod
     def _generate_patch_id(path):
         """ Generates a 5-digit patch ID for a supplied path.
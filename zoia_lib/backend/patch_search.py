@@ -0,0 +1,729 @@
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from zoia_lib.backend.patch_meta import PatchRecord, load_many
+
+# The categories PS knows of. Queries that are part of one of them list
+# the patches in matching categories first.
+CATEGORIES = ("composition", "effect", "game", "other", "sampler",
+              "sequencer", "sound", "synthesizer", "utility", "video")
+
+# The length of the longest n-grams that are indexed. Queries up to this
+# long are answered by a single lookup; longer ones intersect the
+# n-grams they contain, then check the few terms left.
+GRAM = 3
+
+# The number of lists of metadata an index is kept for.
+CACHE_SIZE = 8
+
+# The number of queries whose matches are remembered by each index.
+QUERY_CACHE_SIZE = 256
+
+# The attributes ranked searches score matches in, and how much a match
+# in each counts by default. See SearchIndex.rank().
+RANK_FIELDS = ("title", "tags", "categories", "author", "content")
+WEIGHTS = {"title": 3.0, "tags": 2.0, "categories": 1.5, "author": 1.5,
+           "content": 1.0}
+
+# The BM25 parameters: how quickly repeated words stop adding to the
+# score, and how much longer attributes are penalized.
+K1 = 1.2
+B = 0.75
+
+# Words in a query at least this long also match the words they are the
+# start of, which count for PREFIX_WEIGHT of a whole word.
+PREFIX = 3
+PREFIX_WEIGHT = 0.5
+
+# The number of best matches ranked searches put first.
+RANKED = 50
+
+WORD = re.compile(r"\w+")
+
+# Fuzzy searches match the words in the titles, tags, categories and
+# authors that are within an edit distance of the words in the query.
+# Words shorter than FUZZY_MIN must match exactly, and words shorter
+# than FUZZY_LONG may only have a single typo.
+FUZZY_MIN = 4
+FUZZY_LONG = 7
+MAX_DISTANCE = 2
+
+# The number of closest matches fuzzy searches return, as a common word
+# with a typo can otherwise match most of the catalog.
+FUZZY_RESULTS = 100
+
+
+class SearchIndex:
+    """ An inverted index over the metadata of patches (dicts as
+    returned by PS, or PatchRecords), answering the same queries as
+    scanning every patch would: a patch matches if the query appears
+    anywhere in its title, author, a tag, updated_at or created_at,
+    ignoring case.
+
+    The values of these attributes are indexed whole, as lower case
+    terms, rather than split into words, so that queries spanning
+    several words still match. Each term is indexed under every n-gram
+    (up to GRAM characters) it contains, which finds the terms
+    containing a query without going through every term. As tags,
+    authors and dates are shared by many patches, there are far fewer
+    terms than patches.
+
+    Patches are identified by the object holding their metadata, so the
+    index follows the list it searches: patches that aren't indexed yet
+    are added, and patches no longer in the list are dropped. Metadata
+    must therefore be replaced rather than modified in place, which is
+    what the application does. As checking the whole list for every
+    query would cost as much as scanning it, this is only done when the
+    length of the list changes, or after touch() was called for it.
+    """
+
+    def __init__(self):
+        """ Initializes an empty index.
+        """
+
+        self._lock = threading.RLock()
+        # Patches, and the terms and categories they were indexed under.
+        self._patches = {}
+        self._terms = {}
+        self._categories = {}
+        # Term -> patches, category -> patches, n-gram -> terms.
+        self._postings = {}
+        self._cat_postings = {}
+        self._grams = {}
+        # The position of every patch in the list, and the matches and
+        # results for recent queries.
+        self._pos = {}
+        self._dirty = True
+        self._cache = {}
+        self._results = {}
+        # Word -> {patch: occurrences per attribute in RANK_FIELDS},
+        # and the number of words in each attribute of each patch, for
+        # ranked searches. Only built once one is made, as it needs the
+        # patch notes.
+        self._words = None
+        self._doc_words = {}
+        self._lens = {}
+        self._total = [0] * len(RANK_FIELDS)
+        self._vocab = None
+        # Word -> patches and trigram -> words, for fuzzy searches. Only
+        # built once one is made.
+        self._fuzzy = None
+        self._fuzzy_grams = {}
+        self._doc_fuzzy = {}
+
+    def __len__(self):
+        return len(self._patches)
+
+    def add(self, pch):
+        """ Indexes a patch.
+
+        pch: The metadata of the patch, as a dict or PatchRecord.
+        """
+
+        key = id(pch)
+        with self._lock:
+            if key in self._patches:
+                return
+            self._cache.clear()
+            self._results.clear()
+            terms, categories = _fields(pch)
+            self._patches[key] = pch
+            self._terms[key] = terms
+            self._categories[key] = categories
+            postings = self._postings
+            grams = self._grams
+            for term in terms:
+                if term not in postings:
+                    postings[term] = {key}
+                    for gram in _grams(term):
+                        if gram in grams:
+                            grams[gram].add(term)
+                        else:
+                            grams[gram] = {term}
+                else:
+                    postings[term].add(key)
+            for category in categories:
+                self._cat_postings.setdefault(category, set()).add(key)
+            if self._words is not None:
+                self._add_words(key, pch)
+            if self._fuzzy is not None:
+                self._add_fuzzy(key, pch)
+
+    def remove(self, pch):
+        """ Drops a patch from the index.
+
+        pch: The metadata of the patch, as passed to add().
+        """
+
+        key = id(pch)
+        with self._lock:
+            if key not in self._patches:
+                return
+            self._cache.clear()
+            self._results.clear()
+            del self._patches[key]
+            for term in self._terms.pop(key):
+                keys = self._postings[term]
+                keys.discard(key)
+                if not keys:
+                    del self._postings[term]
+                    for gram in _grams(term):
+                        terms = self._grams[gram]
+                        terms.discard(term)
+                        if not terms:
+                            del self._grams[gram]
+            for category in self._categories.pop(key):
+                keys = self._cat_postings[category]
+                keys.discard(key)
+                if not keys:
+                    del self._cat_postings[category]
+            if self._words is not None:
+                self._remove_words(key)
+            if self._fuzzy is not None:
+                self._remove_fuzzy(key)
+
+    def sync(self, data):
+        """ Brings the index in line with a list of metadata.
+
+        data: A list of metadata, as dicts or PatchRecords.
+        """
+
+        with self._lock:
+            patches = self._patches
+            for pch in data:
+                if id(pch) not in patches:
+                    self.add(pch)
+            self._pos = {id(pch): i for i, pch in enumerate(data)}
+            self._results.clear()
+            if len(patches) > len(self._pos):
+                for key in [key for key in patches if key not in self._pos]:
+                    self.remove(patches[key])
+            self._dirty = False
+
+    def touch(self):
+        """ Marks the index as out of date, such that the next search
+        brings it in line with the list again. Called whenever the list
+        is modified in place (e.g. sorted).
+        """
+
+        with self._lock:
+            self._dirty = True
+
+    def search(self, data, query):
+        """ Searches a list of metadata, see search_patches().
+
+        data: A list of metadata, as dicts or PatchRecords.
+        query: The search term, in lower case.
+
+        return: A list of the metadata that matches the search query.
+                Patches in a matching category come first (the last one
+                in data first), followed by every other match in the
+                order of data.
+        """
+
+        with self._lock:
+            if self._dirty or len(data) != len(self._pos):
+                self.sync(data)
+            hits = self._match(query)
+            first = self._match_categories(query)
+
+            if query not in self._results:
+                top = self._ordered(data, first)
+                top.reverse()
+                self._results[query] = top + self._ordered(data, hits - first)
+
+            return list(self._results[query])
+
+    def rank(self, data, query, limit=RANKED, weights=None):
+        """ Searches a list of metadata, putting the best matches first.
+        Matches are scored with BM25, per word of the query, across the
+        attributes in RANK_FIELDS, including the patch notes. Only the
+        best are sorted (using a heap); the rest follow in the order of
+        data.
+
+        data: A list of metadata, as dicts or PatchRecords.
+        query: The search term, in lower case.
+        limit: Optional. The number of best matches to put first.
+        weights: Optional. A dict mapping attributes in RANK_FIELDS to
+                 how much a match in them counts, overriding those in
+                 WEIGHTS.
+
+        return: A list of the metadata that matches the search query,
+                which includes every patch search() would find.
+        """
+
+        factors = dict(WEIGHTS)
+        factors.update(weights or {})
+        factors = [factors[field] for field in RANK_FIELDS]
+
+        with self._lock:
+            if self._dirty or len(data) != len(self._pos):
+                self.sync(data)
+            if self._words is None:
+                self._words = {}
+                records = []
+                for key, pch in self._patches.items():
+                    if isinstance(pch, PatchRecord):
+                        records.append(pch)
+                    else:
+                        self._add_words(key, pch)
+                # Loading the notes of each record through meta_cache
+                # would read the catalog once per patch.
+                for pch, meta in load_many(records):
+                    self._add_words(id(pch), pch, meta or {})
+
+            scores = self._score(query, factors)
+            pos = self._pos
+            top = heapq.nlargest(limit, scores,
+                                 key=lambda key: (scores[key], -pos[key]))
+            rest = (self._match(query) | self._match_categories(query)
+                    | set(scores)).difference(top)
+
+            return [data[pos[key]] for key in top] + \
+                self._ordered(data, rest)
+
+    def fuzzy(self, data, query, limit=FUZZY_RESULTS):
+        """ Searches a list of metadata, tolerating typos. A patch
+        matches if every word of the query (of at least FUZZY_MIN
+        characters) is within a small edit distance of a word in its
+        title, tags, categories or author. Shorter words must match a
+        word exactly.
+
+        Candidate words are found through the trigrams they share with
+        the query, as each typo changes at most three of them, so only
+        a few words are compared with the query.
+
+        data: A list of metadata, as dicts or PatchRecords.
+        query: The search term, in lower case.
+        limit: Optional. The number of closest matches to return.
+
+        return: A list of the metadata that matches the search query,
+                the closest matches first, and in the order of data
+                otherwise.
+        """
+
+        tokens = set(WORD.findall(query))
+
+        with self._lock:
+            if self._dirty or len(data) != len(self._pos):
+                self.sync(data)
+            if self._fuzzy is None:
+                self._fuzzy = {}
+                for key, pch in self._patches.items():
+                    self._add_fuzzy(key, pch)
+            if ("fuzzy", query, limit) in self._results:
+                return list(self._results["fuzzy", query, limit])
+
+            found = None
+            for token in tokens:
+                # The closest word of each patch counts.
+                dists = {}
+                for word, dist in self._near(token):
+                    for key in self._fuzzy[word]:
+                        if dist < dists.get(key, MAX_DISTANCE + 1):
+                            dists[key] = dist
+                if found is None:
+                    found = dists
+                else:
+                    found = {key: dist + dists[key]
+                             for key, dist in found.items() if key in dists}
+            pos = self._pos
+            found = found or {}
+            self._results["fuzzy", query, limit] = [
+                data[pos[key]] for key in heapq.nsmallest(
+                    limit, found, key=lambda key: (found[key], pos[key]))]
+
+            return list(self._results["fuzzy", query, limit])
+
+    def _near(self, token):
+        """ Finds the indexed words close to a word of a query.
+
+        token: The word, in lower case.
+
+        return: A list of (word, distance) tuples.
+        """
+
+        if len(token) < FUZZY_MIN:
+            return [(token, 0)] if token in self._fuzzy else []
+
+        limit = 1 if len(token) < FUZZY_LONG else MAX_DISTANCE
+        grams = _trigrams(token)
+        shared = {}
+        for gram in grams:
+            for word in self._fuzzy_grams.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+
+        # Each edit changes at most three trigrams.
+        least = max(1, len(grams) - 3 * limit)
+        near = []
+        for word, count in shared.items():
+            if count >= least and abs(len(word) - len(token)) <= limit:
+                dist = _distance(token, word, limit)
+                if dist <= limit:
+                    near.append((word, dist))
+
+        return near
+
+    def _add_fuzzy(self, key, pch):
+        """ Indexes the words of a patch, for fuzzy searches.
+
+        key: The key of the patch.
+        pch: The metadata of the patch, as a dict or PatchRecord.
+        """
+
+        words = set()
+        for text in _texts(pch, False)[:4]:
+            if text:
+                words.update(WORD.findall(text.lower()))
+
+        self._doc_fuzzy[key] = words
+        for word in words:
+            if word not in self._fuzzy:
+                self._fuzzy[word] = set()
+                for gram in _trigrams(word):
+                    self._fuzzy_grams.setdefault(gram, set()).add(word)
+            self._fuzzy[word].add(key)
+
+    def _remove_fuzzy(self, key):
+        """ Drops the words of a patch, see _add_fuzzy().
+
+        key: The key of the patch.
+        """
+
+        for word in self._doc_fuzzy.pop(key):
+            keys = self._fuzzy[word]
+            keys.discard(key)
+            if not keys:
+                del self._fuzzy[word]
+                for gram in _trigrams(word):
+                    words = self._fuzzy_grams[gram]
+                    words.discard(word)
+                    if not words:
+                        del self._fuzzy_grams[gram]
+
+    def _score(self, query, factors):
+        """ Scores the patches matching the words in a query.
+
+        query: The search term, in lower case.
+        factors: How much a match counts, per attribute in RANK_FIELDS.
+
+        return: A dict mapping the keys of the matching patches to their
+                score.
+        """
+
+        count = len(self._lens)
+        avg = [total / count if total else 1.0 for total in self._total]
+
+        scores = {}
+        for token in set(WORD.findall(query)):
+            # Only the best of the words a token matches counts.
+            best = {}
+            for word, weight in self._expand(token):
+                postings = self._words[word]
+                idf = math.log(1 + (count - len(postings) + 0.5)
+                               / (len(postings) + 0.5))
+                for key, tfs in postings.items():
+                    tf = sum(factor * occ / (1 - B + B * length / mean)
+                             for factor, occ, length, mean in zip(
+                                 factors, tfs, self._lens[key], avg) if occ)
+                    score = weight * idf * tf / (K1 + tf)
+                    if score > best.get(key, 0.0):
+                        best[key] = score
+            for key, score in best.items():
+                scores[key] = scores.get(key, 0.0) + score
+
+        return scores
+
+    def _expand(self, token):
+        """ Lists the indexed words a word of a query matches.
+
+        token: The word, in lower case.
+
+        return: A list of (word, weight) tuples.
+        """
+
+        words = [(token, 1.0)] if token in self._words else []
+        if len(token) >= PREFIX:
+            if self._vocab is None:
+                self._vocab = sorted(self._words)
+            i = bisect_left(self._vocab, token)
+            while i < len(self._vocab) and self._vocab[i].startswith(token):
+                if self._vocab[i] != token:
+                    words.append((self._vocab[i], PREFIX_WEIGHT))
+                i += 1
+
+        return words
+
+    def _add_words(self, key, pch, meta=None):
+        """ Indexes the words of a patch, for ranked searches.
+
+        key: The key of the patch.
+        pch: The metadata of the patch, as a dict or PatchRecord.
+        meta: Optional. The complete metadata of the patch, to take the
+              patch notes of a PatchRecord from, see _texts().
+        """
+
+        tfs = {}
+        lens = []
+        for i, text in enumerate(_texts(pch, meta=meta)):
+            words = WORD.findall(text.lower()) if text else []
+            lens.append(len(words))
+            for word in words:
+                if word not in tfs:
+                    tfs[word] = [0] * len(RANK_FIELDS)
+                tfs[word][i] += 1
+
+        self._lens[key] = tuple(lens)
+        self._total = [total + n for total, n in zip(self._total, lens)]
+        self._doc_words[key] = tuple(tfs)
+        for word, occ in tfs.items():
+            if word not in self._words:
+                self._words[word] = {}
+                self._vocab = None
+            self._words[word][key] = tuple(occ)
+
+    def _remove_words(self, key):
+        """ Drops the words of a patch, see _add_words().
+
+        key: The key of the patch.
+        """
+
+        for word in self._doc_words.pop(key):
+            postings = self._words[word]
+            del postings[key]
+            if not postings:
+                del self._words[word]
+                self._vocab = None
+        self._total = [total - n for total, n in
+                       zip(self._total, self._lens.pop(key))]
+
+    def _ordered(self, data, keys):
+        """ Lists patches in the order of the list they are in.
+
+        data: The list of metadata the index is in line with.
+        keys: A set of the keys of the patches.
+
+        return: A list of the metadata of the patches.
+        """
+
+        if len(keys) > len(data) // 8:
+            # Cheaper than sorting this many.
+            return [pch for pch in data if id(pch) in keys]
+
+        return [data[i] for i in sorted(self._pos[key] for key in keys)]
+
+    def _match_categories(self, query):
+        """ Finds the patches in a category containing the query, should
+        it be part of one of the CATEGORIES.
+
+        query: The search term, in lower case.
+
+        return: A set of the keys of the matching patches.
+        """
+
+        first = set()
+        if any(query in category for category in CATEGORIES):
+            for category, keys in self._cat_postings.items():
+                if query in category:
+                    first |= keys
+
+        return first
+
+    def _match(self, query):
+        """ Finds the patches with a term containing the query.
+
+        query: The search term, in lower case.
+
+        return: A set of the keys of the matching patches.
+        """
+
+        if not query:
+            return set(self._patches)
+        if query in self._cache:
+            return self._cache[query]
+
+        if len(query) <= GRAM:
+            terms = self._grams.get(query, ())
+        else:
+            # Every term containing the query contains each of its
+            # n-grams; start from the rarest.
+            grams = sorted((self._grams.get(query[i:i + GRAM], set())
+                            for i in range(len(query) - GRAM + 1)), key=len)
+            terms = grams[0].intersection(*grams[1:])
+
+        # While typing, each query usually extends an earlier one, and
+        # only the patches that matched it can match.
+        narrow = min((hits for prev, hits in self._cache.items()
+                      if prev in query), key=len, default=None)
+        if narrow is not None and len(narrow) < len(terms):
+            hits = {key for key in narrow
+                    if any(query in term for term in self._terms[key])}
+        else:
+            hits = set()
+            for term in terms:
+                if query in term:
+                    hits |= self._postings[term]
+
+        if len(self._cache) >= QUERY_CACHE_SIZE:
+            self._cache.clear()
+            self._results.clear()
+        self._cache[query] = hits
+
+        return hits
+
+
+def _fields(pch):
+    """ Retrieves the values of a patch that are searched.
+
+    pch: The metadata of the patch, as a dict or PatchRecord.
+
+    return: A tuple of two sets, holding the lower case terms (title,
+            author, tags and dates) and categories.
+    """
+
+    if isinstance(pch, PatchRecord):
+        terms = [pch.title, pch.author, pch.updated_at, pch.created_at]
+        terms += pch.tags or ()
+        categories = pch.categories or ()
+    else:
+        terms = [pch.get("title"), pch.get("updated_at"),
+                 pch.get("created_at")]
+        if "author" in pch:
+            terms.append(pch["author"]["name"])
+        terms += [tag["name"] for tag in pch.get("tags", ())]
+        categories = [cat["name"] for cat in pch.get("categories", ())]
+
+    return ({term.lower() for term in terms if term},
+            {category.lower() for category in categories})
+
+
+def _texts(pch, notes=True, meta=None):
+    """ Retrieves the text a patch is ranked on.
+
+    pch: The metadata of the patch, as a dict or PatchRecord. The patch
+         notes of PatchRecords are loaded through meta_cache, unless
+         meta is given.
+    notes: Optional. False to leave the patch notes out.
+    meta: Optional. The complete metadata of the patch, to take the
+          patch notes from.
+
+    return: A tuple holding the text of each attribute in RANK_FIELDS,
+            or None for those the patch doesn't have.
+    """
+
+    if isinstance(pch, PatchRecord):
+        tags = pch.tags or ()
+        categories = pch.categories or ()
+        author = pch.author
+    else:
+        tags = [tag["name"] for tag in pch.get("tags", ())]
+        categories = [cat["name"] for cat in pch.get("categories", ())]
+        author = pch["author"]["name"] if "author" in pch else None
+    if not notes:
+        content = None
+    elif meta is not None:
+        content = meta.get("content")
+    else:
+        content = pch.get("content")
+
+    return (pch.get("title"), " ".join(tags), " ".join(categories), author,
+            content if isinstance(content, str) else None)
+
+
+def _trigrams(word):
+    """ Lists the trigrams of a word, for fuzzy searches. The word is
+    padded, so that its start and end have trigrams of their own.
+
+    word: The word, in lower case.
+
+    return: A set of trigrams.
+    """
+
+    word = " {} ".format(word)
+
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _distance(a, b, limit):
+    """ Computes the Levenshtein distance between two words, giving up
+    once it is known to exceed a limit.
+
+    a, b: The words.
+    limit: The largest distance of interest.
+
+    return: The distance, or limit + 1 should it exceed limit.
+    """
+
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        curr = [i]
+        for j, cb in enumerate(b, 1):
+            curr.append(min(prev[j] + 1, curr[j - 1] + 1,
+                            prev[j - 1] + (ca != cb)))
+        if min(curr) > limit:
+            return limit + 1
+        prev = curr
+
+    return min(prev[-1], limit + 1)
+
+
+def _grams(term):
+    """ Lists the n-grams a term is indexed under.
+
+    term: The term, in lower case.
+
+    return: A set of every substring of the term up to GRAM characters
+            long.
+    """
+
+    return {term[i:i + n] for n in range(1, GRAM + 1)
+            for i in range(len(term) - n + 1)}
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def index_for(data):
+    """ Retrieves the index for a list of metadata, creating it the
+    first time the list is searched. Indexes are kept for the
+    CACHE_SIZE most recently searched lists.
+
+    data: A list of metadata, as dicts or PatchRecords.
+
+    return: A SearchIndex. It is brought in line with data by each
+            search.
+    """
+
+    with _indexes_lock:
+        key = id(data)
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key][1]
+
+        # The list is kept alive along with its index, so that its id
+        # can't be reused by another list.
+        index = SearchIndex()
+        _indexes[key] = (data, index)
+        while len(_indexes) > CACHE_SIZE:
+            _indexes.popitem(last=False)
+
+        return index
+
+
+def touch(data):
+    """ Marks the index for a list of metadata as out of date, should
+    there be one. See SearchIndex.touch().
+
+    data: A list of metadata that was just modified in place.
+    """
+
+    with _indexes_lock:
+        entry = _indexes.get(id(data))
+
+    if entry is not None:
+        entry[1].touch()
@@ -0,0 +1,237 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from operator import is_
+
+from zoia_lib.backend.patch_meta import PatchRecord
+
+# The number of lists of metadata a sort index is kept for.
+CACHE_SIZE = 8
+
+# Past this share of the patches being added or removed at once, the
+# orders are sorted again rather than updated one patch at a time.
+REBUILD = 0.25
+
+# The keys patches are sorted by, per mode of sort_metadata(), for dicts
+# and for PatchRecords. The use of .upper() is to prevent sorting of
+# lower case names before their uppercase counterparts, especially when
+# they share the same initial letter. In a list, you would want all the
+# "d" titles grouped together.
+KEYS = {
+    1: (lambda x: x["title"].upper(), lambda x: x.title.upper()),
+    2: (lambda x: x["author"]["name"].upper() if "author" in x else "",
+        lambda x: x.author.upper() if x.author is not None else ""),
+    3: (lambda x: x.get("like_count", 0), lambda x: x.like_count or 0),
+    4: (lambda x: x.get("download_count", 0),
+        lambda x: x.download_count or 0),
+    5: (lambda x: x.get("view_count", 0), lambda x: x.view_count or 0),
+    6: (lambda x: x["updated_at"].upper(), lambda x: x.updated_at.upper()),
+    7: (lambda x: x.get("revision", 0), lambda x: x.revision or 0)
+}
+
+
+class SortIndex:
+    """ Keeps a list of metadata (dicts as returned by PS, or
+    PatchRecords) sorted in every mode of sort_metadata(), so that
+    sorting it again, in another mode or in reverse, needn't compute
+    and compare the key of every patch again.
+
+    For every mode that was sorted by, the index holds the key of each
+    patch, and the patches in ascending order. These are kept up to date
+    as patches are added to and removed from the list: new patches are
+    inserted where they belong, rather than sorting the list again.
+    Sorting then only compares the rank of each patch in that order.
+
+    Patches with the same key keep the order they are in in the list,
+    in reverse as well, so that the result is the same as list.sort()
+    (a stable sort) would give, e.g. when sorting by a second key.
+
+    Patches are identified by the object holding their metadata, as for
+    the SearchIndex. Metadata must therefore be replaced rather than
+    modified in place, which is what the application does.
+    """
+
+    def __init__(self):
+        """ Initializes an empty index.
+        """
+
+        # Patch -> its metadata, and the order it was added in.
+        self._patches = {}
+        self._seqs = {}
+        self._seq = 0
+        # Mode -> the keys, orders added in and metadata of every patch,
+        # as three lists in ascending order. Only built once sorted by.
+        self._orders = {}
+        # Mode -> the rank of every patch, see _ranks(). Built from the
+        # order of the mode, until patches are added or removed.
+        self._ranks_cache = {}
+        # The last list sorted, as (mode, rev, metadata).
+        self._last = None
+
+    def __len__(self):
+        return len(self._patches)
+
+    def sort(self, mode, data, rev):
+        """ Sorts a list of metadata in place, see sort_metadata().
+
+        mode: The method in which the data will be sorted, 1 to 7.
+        data: A list of metadata, as dicts or PatchRecords.
+        rev: True if the data should be sorted in reverse, False
+             otherwise.
+        """
+
+        last = self._last
+        if last is not None and len(last[2]) == len(data) \
+                and all(map(is_, data, last[2])):
+            # Still as sorted last, so the same patches are in the list.
+            if last[:2] == (mode, rev):
+                return
+        else:
+            self.sync(data)
+            if len(self._patches) != len(data):
+                # The same patch is in the list more than once.
+                data.sort(key=lambda x: _key(mode, x), reverse=rev)
+                self._last = None
+                return
+
+        # Ranks rather than keys, so that they needn't be computed
+        # again. A stable sort, as is list.sort() even in reverse, keeps
+        # patches with the same key in the order they are in.
+        ranks = self._ranks(mode)
+        data.sort(key=lambda pch: ranks[id(pch)], reverse=rev)
+        self._last = (mode, rev, list(data))
+
+    def sync(self, data):
+        """ Brings the index in line with a list of metadata.
+
+        data: A list of metadata, as dicts or PatchRecords.
+        """
+
+        patches = self._patches
+        current = dict(zip(map(id, data), data))
+        if current.keys() == patches.keys():
+            return
+
+        added = [pch for key, pch in current.items() if key not in patches]
+        removed = patches.keys() - current.keys()
+        self._ranks_cache.clear()
+        self._last = None
+        if len(added) + len(removed) > REBUILD * max(len(patches), 1):
+            # Sort again, the next time each mode is sorted by.
+            self._orders.clear()
+
+        for key in removed:
+            pch = patches.pop(key)
+            seq = self._seqs.pop(key)
+            for mode in list(self._orders):
+                keys, seqs, pchs = self._orders[mode]
+                value = _key(mode, pch)
+                # Patches with the same key are in the order they were
+                # added in.
+                i = bisect_left(seqs, seq, bisect_left(keys, value),
+                                bisect_right(keys, value))
+                if i < len(pchs) and pchs[i] is pch:
+                    del keys[i], seqs[i], pchs[i]
+                else:
+                    # It was modified in place.
+                    del self._orders[mode]
+
+        patches.update(zip(map(id, added), added))
+        for pch in added:
+            self._seqs[id(pch)] = self._seq
+            for mode, (keys, seqs, pchs) in self._orders.items():
+                # After every patch with the same key, as it was added
+                # last.
+                value = _key(mode, pch)
+                i = bisect_right(keys, value)
+                keys.insert(i, value)
+                seqs.insert(i, self._seq)
+                pchs.insert(i, pch)
+            self._seq += 1
+
+    def _ranks(self, mode):
+        """ Retrieves the rank of every patch for a mode, which patches
+        with the same key share.
+
+        mode: The method in which the data will be sorted, 1 to 7.
+
+        return: A dict mapping patches to their rank, as ints in the
+                same order as their keys.
+        """
+
+        if mode not in self._ranks_cache:
+            keys, _, pchs = self._order(mode)
+            ranks = {}
+            rank = 0
+            for i, pch in enumerate(pchs):
+                if keys[i] != keys[rank]:
+                    rank = i
+                ranks[id(pch)] = rank
+            self._ranks_cache[mode] = ranks
+
+        return self._ranks_cache[mode]
+
+    def _order(self, mode):
+        """ Retrieves the patches in ascending order for a mode, sorting
+        them the first time.
+
+        mode: The method in which the data will be sorted, 1 to 7.
+
+        return: The keys, orders added in and metadata of every patch,
+                as three lists in ascending order.
+        """
+
+        if mode not in self._orders:
+            # Patches are held in the order they were added in, so a
+            # stable sort breaks ties the same way.
+            pchs = list(self._patches.values())
+            seqs = list(self._seqs.values())
+            keys = [_key(mode, pch) for pch in pchs]
+            perm = sorted(range(len(pchs)), key=keys.__getitem__)
+            self._orders[mode] = ([keys[i] for i in perm],
+                                  [seqs[i] for i in perm],
+                                  [pchs[i] for i in perm])
+
+        return self._orders[mode]
+
+
+def _key(mode, pch):
+    """ Retrieves the key a patch is sorted by.
+
+    mode: The method in which the data will be sorted, 1 to 7.
+    pch: The metadata of the patch, as a dict or PatchRecord.
+
+    return: The key for the mode, a string or a number.
+    """
+
+    return KEYS[mode][isinstance(pch, PatchRecord)](pch)
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def index_for(data):
+    """ Retrieves the sort index for a list of metadata, creating it the
+    first time the list is sorted. Indexes are kept for the CACHE_SIZE
+    most recently sorted lists.
+
+    data: A list of metadata, as dicts or PatchRecords.
+
+    return: A SortIndex. It is brought in line with data by each sort.
+    """
+
+    with _indexes_lock:
+        key = id(data)
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key][1]
+
+        # The list is kept alive along with its index, so that its id
+        # can't be reused by another list.
+        index = SortIndex()
+        _indexes[key] = (data, index)
+        while len(_indexes) > CACHE_SIZE:
+            _indexes.popitem(last=False)
+
+        return index
@@ -0,0 +1,91 @@
+import os
+
+from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.utilities import file_digest
+
+# The directory within the backend holding the binaries.
+STORE = "store"
+
+
+class PatchStore(Patch):
+    """ The PatchStore class is a child of the Patch class. It is
+    responsible for storing each distinct patch binary only once, no
+    matter how many patches or versions share it.
+
+    Binaries are kept in the store directory under their SHA-256 digest
+    (store/ab/abcdef....bin), and the binary in a patch directory is a
+    hard link to it. Anything reading patches therefore still finds
+    {name}.bin where it always was. On filesystems without hard links
+    the binary simply stays a regular file.
+
+    Binaries in the store must never be written to in place, as every
+    patch linked to them would change along with them; saving a new
+    version always creates a new file.
+    """
+
+    def __init__(self):
+        """ Initialize the class such that it has a reference to the
+        backend path.
+        """
+
+        super().__init__()
+
+    def add(self, path, digest=None):
+        """ Stores a binary that was just saved to a patch directory.
+        Should the store already have the same binary, the file is
+        replaced by a link to it, so that only one copy remains.
+
+        path: The path to the binary within its patch directory.
+        digest: Optional. The SHA-256 digest of the binary, if it is
+                already known.
+
+        return: The digest of the binary, as a hex string.
+        """
+
+        if digest is None:
+            digest = file_digest(path)
+        obj = self.path(digest)
+
+        try:
+            if os.path.exists(obj):
+                if not os.path.samefile(obj, path):
+                    os.link(obj, path + ".tmp")
+                    os.replace(path + ".tmp", path)
+            else:
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                os.link(path, obj)
+        except OSError:
+            # No hard links here, the binary is kept as it is.
+            pass
+
+        return digest
+
+    def release(self, digest):
+        """ Removes a binary from the store once no patch links to it
+        anymore. Called after a binary is removed from a patch
+        directory.
+
+        digest: The SHA-256 digest of the binary, as a hex string. None
+                is ignored.
+        """
+
+        if digest is None:
+            return
+
+        obj = self.path(digest)
+        try:
+            if os.stat(obj).st_nlink <= 1:
+                os.remove(obj)
+        except FileNotFoundError:
+            pass
+
+    def path(self, digest):
+        """ Determines where a binary is kept in the store.
+
+        digest: The SHA-256 digest of the binary, as a hex string.
+
+        return: The path to the binary.
+        """
+
+        return os.path.join(self.back_path, STORE, digest[:2],
+                            "{}.bin".format(digest))
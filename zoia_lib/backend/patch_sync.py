@@ -0,0 +1,187 @@
+import json
+import os
+import time
+
+from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.patch_catalog import PatchCatalog
+from zoia_lib.backend.utilities import write_json
+
+# Number of seconds after which an incremental sync also checks the ids
+# in the catalog against the ones on PS.
+RECONCILE_AGE = 24 * 60 * 60
+
+
+class PatchSync(Patch):
+    """ The PatchSync class is a child of the Patch class. It is
+    responsible for keeping the local copy of the PS catalog
+    (catalog.bin, see PatchCatalog) up to date. Alongside the catalog,
+    a checkpoint (sync.json) records the most recent modification date
+    that has been synced, so that subsequent syncs only need to retrieve
+    the patches that changed.
+    """
+
+    def __init__(self, api):
+        """ Initialize the class such that it has a reference to the
+        backend path.
+
+        api: Backend class to aid with PS API requests.
+        """
+
+        super().__init__()
+        self.api = api
+        self.catalog = PatchCatalog()
+
+    def sync(self, full=False, progress=None):
+        """ Brings the local catalog up to date with PS.
+
+        If a catalog and checkpoint exist, only the patches that were
+        uploaded or modified since the checkpoint are retrieved and
+        merged into the catalog by id. The catalog is only saved again
+        should any of them have changed. Should the merged catalog not
+        contain the same number of patches as PS (i.e., patches were
+        deleted from PS), the entire catalog is retrieved instead.
+
+        The count alone can't be trusted once new patches were merged
+        in, nor forever, so in those cases the ids in the catalog are
+        also checked against a listing of the ids on PS, falling back
+        to retrieving the entire catalog should they differ.
+
+        full: Optional. True to skip the incremental sync and retrieve
+              the entire catalog.
+        progress: Optional. A function that is called with the number
+                  of pages retrieved so far and the total number of
+                  pages during a full sync.
+
+        return: The synced catalog as a list of patch metadata, as
+                returned by load_catalog().
+        """
+
+        data = None if full else self.load_catalog()
+        since, reconciled = (None, 0) if data is None \
+            else self._load_checkpoint(data)
+
+        if since is not None:
+            # Patches modified at the checkpoint itself are returned
+            # again, as others may share their date, but are only new
+            # if their date differs from the one in the catalog.
+            known = {pch["id"]: pch["updated_at"] for pch in data}
+            changed = [pch for pch in self.api.get_modified_patches(since)
+                       if known.get(pch["id"]) != pch["updated_at"]]
+            merged = self._merge(data, changed)
+            if len(merged) == self.api.patch_count:
+                # Uploads could make up for deletions in the count, so
+                # the ids are compared as well after any, and every
+                # RECONCILE_AGE seconds regardless.
+                if not any(pch["id"] not in known for pch in changed) \
+                        and time.time() - reconciled <= RECONCILE_AGE:
+                    if changed:
+                        merged = self.save_catalog(merged, reconciled)
+                    return merged
+                if {pch["id"] for pch in merged} == \
+                        set(self.api.get_patch_ids()):
+                    if changed:
+                        return self.save_catalog(merged, time.time())
+                    self._save_checkpoint(merged, time.time())
+                    return merged
+
+        # Either there is no usable catalog, or it can't be patched up.
+        return self.save_catalog(self.api.get_all_patch_data_init(progress),
+                                 time.time())
+
+    def load_catalog(self):
+        """ Loads the catalog that was previously saved to the backend.
+
+        return: The catalog as a list of patch metadata, limited to the
+                attributes kept by PatchCatalog, or None if no catalog
+                has been saved.
+        """
+
+        self.catalog.back_path = self.back_path
+        return self.catalog.load()
+
+    def save_catalog(self, data, reconciled=0):
+        """ Saves the catalog to the backend, along with a checkpoint
+        for the next incremental sync.
+
+        data: The catalog as a list of patch metadata.
+        reconciled: Optional. The time at which the ids in the catalog
+                    were last checked against PS, in seconds since the
+                    epoch.
+
+        return: The catalog as returned by load_catalog().
+        """
+
+        self.catalog.back_path = self.back_path
+        data = self.catalog.save(data)
+        self._save_checkpoint(data, reconciled)
+
+        return data
+
+    def _save_checkpoint(self, data, reconciled):
+        """ Saves the checkpoint for the next incremental sync.
+
+        data: The catalog as a list of patch metadata.
+        reconciled: The time at which the ids in the catalog were last
+                    checked against PS, in seconds since the epoch.
+        """
+
+        write_json(os.path.join(self.back_path, "sync.json"), {
+            "last_modified": self._newest_date(data),
+            "count": len(data),
+            "reconciled": reconciled
+        })
+
+    def _load_checkpoint(self, data):
+        """ Retrieves the date of the most recent modification that has
+        been synced.
+
+        Catalogs saved before checkpoints existed have no sync.json, but
+        the newest updated_at attribute they contain serves the same
+        purpose.
+
+        data: The catalog the checkpoint belongs to.
+
+        return: A tuple containing an ISO8601 date as a string (or None
+                if there is nothing to sync from) as the first element,
+                and the time at which the ids in the catalog were last
+                checked against PS (0 if unknown) as the second element.
+        """
+
+        try:
+            with open(os.path.join(self.back_path, "sync.json"), "r") as f:
+                checkpoint = json.loads(f.read())
+            if checkpoint["count"] == len(data):
+                return checkpoint["last_modified"], \
+                    checkpoint.get("reconciled", 0)
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        return self._newest_date(data), 0
+
+    @staticmethod
+    def _newest_date(data):
+        """ Finds the most recent updated_at attribute in a catalog.
+
+        data: The catalog as a list of patch metadata.
+
+        return: An ISO8601 date as a string, or None if the catalog is
+                empty.
+        """
+
+        return max((pch["updated_at"] for pch in data), default=None)
+
+    @staticmethod
+    def _merge(data, changed):
+        """ Merges changed patches into a catalog. Patches that already
+        exist in the catalog are replaced, while new patches are added
+        to the front of it.
+
+        data: The catalog as a list of patch metadata.
+        changed: A list of patch metadata that was uploaded or modified.
+
+        return: The merged catalog as a new list.
+        """
+
+        changed_ids = {pch["id"] for pch in changed}
+
+        return changed + [pch for pch in data if pch["id"] not in changed_ids]
@@ -1,15 +1,28 @@
 import json
 import os
+import shutil
+import threading
 
 from zoia_lib.backend import api
 from zoia_lib.backend.patch import Patch
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.patch_manifest import PatchManifest
 from zoia_lib.backend.patch_save import PatchSave
+from zoia_lib.backend.utilities import write_json
 from zoia_lib.common import errors
 
+# How long to wait for further edits before writing queued edits, in
+# seconds.
+COALESCE_DELAY = 0.5
+
 
 class PatchUpdate(Patch):
     """ The PatchUpdate class is a child of the Patch class. It is
     responsible for patch and patch note updating operations.
+
+    Edits can be queued via queue_data(), in which case bursts of edits
+    made to the same patch are written at once, COALESCE_DELAY seconds
+    after the last one.
     """
 
     def __init__(self):
@@ -18,9 +31,14 @@ class PatchUpdate(Patch):
         """
 
         super().__init__()
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._timer = None
 
     def update_data(self, idx, data, mode):
-        """ Attempts to modify data to a patches metadata.
+        """ Attempts to modify data to a patches metadata. The metadata
+        is written right away, along with any edits queued for the same
+        patch.
 
         idx: The id for the patch metadata that is to be modified.
         tag: A string representing the tag that is to be added. Does not
@@ -33,6 +51,48 @@ class PatchUpdate(Patch):
               - 5 -> Modify the patch title
         """
 
+        with self._lock:
+            self._queue(idx, data, mode)
+            self._write(idx, self._pending.pop(idx))
+
+    def queue_data(self, idx, data, mode):
+        """ Queues a modification to a patches metadata, to be written
+        once no further edits were made for COALESCE_DELAY seconds.
+
+        idx: The id for the patch metadata that is to be modified.
+        data: The new value, see update_data().
+        mode: The type of data that is being modified, see update_data().
+        """
+
+        with self._lock:
+            self._queue(idx, data, mode)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(COALESCE_DELAY, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """ Writes every queued edit right away. Edits for patches that
+        were deleted in the meantime are dropped.
+        """
+
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+            for pch, changes in pending.items():
+                try:
+                    self._write(pch, changes)
+                except FileNotFoundError:
+                    pass
+
+    def _queue(self, idx, data, mode):
+        """ Adds an edit to the ones pending for a patch, replacing any
+        previous edit of the same attribute.
+        """
+
         # Lookup the right term to use.
         index = {
             1: "tags",
@@ -42,20 +102,26 @@ class PatchUpdate(Patch):
             5: "title"
         }[mode]
 
-        # Get the patch name and id.
-        pch = idx
-        idx = idx.split("_")[0]
+        self._pending.setdefault(idx, {})[index] = data
+
+    def _write(self, pch, changes):
+        """ Applies edits to the metadata of a patch.
 
-        # Update the key with the new data.
-        with open(os.path.join(self.back_path, idx, "{}.json".format(pch)),
-                  "r") as f:
+        pch: The name of the patch (e.g. 123456 or 123456_v2).
+        changes: A dict mapping attributes to their new values.
+
+        raise: FileNotFoundError should the patch no longer exist.
+        """
+
+        idx = pch.split("_")[0]
+        name = os.path.join(self.patch_path(idx), "{}.json".format(pch))
+
+        # Update the keys with the new data.
+        with open(name, "r") as f:
             temp = json.loads(f.read())
-        # if mode == 4:
-        #    temp[index]["name"] = data
-        temp[index] = data
-        with open(os.path.join(self.back_path, idx, "{}.json".format(pch)),
-                  "w") as f:
-            f.write(json.dumps(temp))
+        temp.update(changes)
+        write_json(name, temp)
+        PatchIndex.for_path(self.back_path).refresh(idx)
 
     def check_for_updates(self):
         """ Upon startup, automatically retrieve the latest version of
@@ -76,60 +142,58 @@ class PatchUpdate(Patch):
                 second element.
         """
 
-        meta = []
-
-        for patch in os.listdir(self.back_path):
-            # Only check for updates for patches hosted on PS
-            # (denoted via the 6-digit ID numbers).
-            if os.path.isdir(os.path.join(self.back_path, patch)) \
-                    and len(patch) > 5 \
-                    and len(
-                os.listdir(os.path.join(self.back_path, patch))) > 2 \
-                    and patch != "Banks" and patch != ".DS_Store":
-                # Multiple versions, only need the latest.
-                with open(os.path.join(self.back_path, patch,
-                                       "{}_v1.json".format(patch)), "r") as f:
-                    temp = json.loads(f.read())
-            elif os.path.isdir(os.path.join(self.back_path, patch)) \
-                    and len(patch) > 5:
-                # Just a single patch in the directory, easy.
-                with open(os.path.join(self.back_path, patch,
-                                       "{}.json".format(patch)), "r") as f:
-                    temp = json.loads(f.read())
-            else:
-                continue
-            # Only need the id and updated_at for comparison purposes.
-            meta_small = {
-                "id": temp["id"],
-                "updated_at": temp["updated_at"]
-            }
-            meta.append(meta_small)
-
-        # Get a list of binary/metadata for all files that have been updated
-        # on PatchStorage.
+        # Only check for updates for patches hosted on PS, which the
+        # index already has the latest id and updated_at for.
+        meta = PatchIndex.for_path(self.back_path).update_dates()
+
+        # Stream every file that has been updated on PatchStorage to a
+        # staging directory, rather than holding them all in memory.
+        staging = os.path.join(self.back_path, "updates")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
         ps = api.PatchStorage()
-        pch_list = ps.get_potential_updates(meta)
 
         # Try to save the new binaries to the backend.
         save = PatchSave()
+        manifest = PatchManifest()
+        manifest.back_path = self.back_path
         pchs = []
-        for patch in pch_list:
-            try:
-                save.save_to_backend(patch[0])
-            except errors.SavingError:
-                # Same binary, but patch notes are different, update those.
-                idx = str(patch[1]["id"])
+        try:
+            pch_list = ps.get_potential_updates(meta, staging)
+            for patch in pch_list:
                 try:
-                    with open(os.path.join(self.back_path, idx,
-                                           "{}.bin".format(idx)), "w") as f:
-                        f.write(json.dumps(patch[1]))
+                    save.save_to_backend(patch)
+                except errors.SavingError:
+                    # Same binary, but patch notes are different, update
+                    # those.
+                    idx = str(patch[1]["id"])
+                    latest = manifest.latest(idx)
+                    if latest is not None:
+                        self._merge_meta(os.path.join(
+                            self.patch_path(idx), latest["json"]), patch[1])
                         pchs.append(patch[1]["title"])
-                except FileNotFoundError:
-                    with open(os.path.join(self.back_path, idx,
-                                           "{}_v1.bin".format(idx)), "r") as f:
-                        f.write(json.dumps(patch[1]))
-                        pchs.append(patch[1]["title"])
-            pchs.append(patch)
+                    PatchIndex.for_path(self.back_path).refresh(idx)
+                pchs.append(patch)
+        finally:
+            # Whatever wasn't moved into the backend.
+            shutil.rmtree(staging, ignore_errors=True)
 
         # Pass the number of updates and titles of patches updated.
         return len(pch_list), pchs
+
+    @staticmethod
+    def _merge_meta(path, meta):
+        """ Updates the metadata saved for a version of a patch with the
+        metadata PS has for it, keeping the revision the version was
+        saved with (which banks and sorting rely on).
+
+        path: The path to the metadata file of the version.
+        meta: The metadata retrieved from PS.
+        """
+
+        with open(path, "r") as f:
+            saved = json.loads(f.read())
+        merged = {**saved, **meta}
+        if "revision" in saved:
+            merged["revision"] = saved["revision"]
+        write_json(path, merged)
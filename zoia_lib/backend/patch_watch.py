@@ -0,0 +1,427 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+import struct
+import time
+
+from zoia_lib.backend.patch import SHARDS, Patch
+
+# The kinds of events reported by PatchWatcher.poll().
+ADDED = "add"
+MODIFIED = "modify"
+DELETED = "delete"
+
+# How often the backend is rescanned when inotify isn't available, in
+# seconds.
+POLL_INTERVAL = 2.0
+
+# Directories modified less than this long before a rescan, in
+# nanoseconds, may be modified again without their modification time
+# changing (FAT only keeps it to 2 seconds), so their files are compared
+# as well.
+RACY_WINDOW = 2 * 10 ** 9
+
+# See inotify(7).
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT = struct.Struct("iIII")
+
+# Changes to the directories holding patch directories (the backend
+# itself, or the shards of the sharded layout) and to the files within a
+# patch directory.
+BACKEND_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO \
+    | IN_ONLYDIR
+PATCH_MASK = IN_CLOSE_WRITE | IN_MODIFY | IN_ATTRIB | IN_CREATE \
+    | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF \
+    | IN_MOVE_SELF | IN_ONLYDIR
+
+
+class PatchWatcher(Patch):
+    """ The PatchWatcher class is a child of the Patch class. It is
+    responsible for noticing changes made to the patch directories in
+    the backend, whether by the application itself or by anything else,
+    so that only the affected patches need to be reloaded.
+
+    On Linux, inotify is used. Elsewhere, or should inotify be
+    unavailable (e.g. once the limit on watches is reached), the backend
+    is rescanned every POLL_INTERVAL seconds instead, comparing the
+    modification time of every patch directory. A directory's
+    modification time changes whenever a file in it is created, removed
+    or renamed, which covers the atomic writes the application makes
+    (see write_atomic()), but not files rewritten in place by other
+    programs.
+
+    Polling takes a system call per patch, so poll() should be called
+    from a worker thread rather than the GUI thread.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL, use_inotify=True,
+                 clock=time.monotonic):
+        """ Initialize the class such that it has a reference to the
+        backend path.
+
+        interval: Optional. How often to rescan the backend when polling,
+                  in seconds.
+        use_inotify: Optional. False to always poll.
+        clock: Optional. A function returning the current time, in
+               seconds.
+        """
+
+        super().__init__()
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.clock = clock
+
+        self._inotify = None
+        self._watches = {}
+        self._sigs = None
+        self._ids = set()
+        self._last = 0.0
+
+    def start(self):
+        """ Starts watching the backend. Changes made before this is
+        called are not reported.
+        """
+
+        self._ids = set(self.patch_ids())
+        if self.use_inotify and platform.system() == "Linux":
+            try:
+                self._inotify = _Inotify()
+                if self.is_sharded():
+                    # Shards come and go along with their patches.
+                    root = os.path.join(self.back_path, SHARDS)
+                    self._watches = {
+                        self._inotify.add(root, BACKEND_MASK): SHARDS}
+                    for shard in os.listdir(root):
+                        if shard.isdigit():
+                            self._watch_shard(shard)
+                else:
+                    self._watches = {
+                        self._inotify.add(self.back_path, BACKEND_MASK): None}
+                for idx in self._ids:
+                    self._watch(idx)
+                return
+            except OSError:
+                # No inotify, or too many patches to watch them all.
+                self.close()
+
+        self._sigs = self._scan()
+        self._last = self.clock()
+
+    @property
+    def polling(self):
+        """ Whether the backend is being polled rather than watched via
+        inotify.
+        """
+
+        return self._inotify is None
+
+    def poll(self, force=False):
+        """ Retrieves the changes made since the previous call. This
+        never waits for changes to be made.
+
+        force: Optional. True to rescan the backend right away when
+               polling, rather than waiting for POLL_INTERVAL to pass.
+
+        return: A list of (kind, idx) tuples, one per patch that changed,
+                where kind is ADDED, MODIFIED or DELETED and idx is the
+                patch id as a string.
+        """
+
+        if self._inotify is not None:
+            try:
+                touched = self._read()
+            except OSError:
+                # Too many patches to watch them all after all.
+                self.close()
+                self._sigs = {}
+                touched = set()
+            else:
+                return self._events(touched)
+
+        if self._sigs is None:
+            return []
+        if not force and self.clock() - self._last < self.interval:
+            return []
+        self._last = self.clock()
+
+        sigs = self._scan(self._sigs)
+        touched = {idx for idx in set(sigs) | set(self._sigs)
+                   if _changed(self._sigs.get(idx), sigs.get(idx))}
+        self._sigs = sigs
+
+        return self._events(touched)
+
+    def close(self):
+        """ Stops watching the backend.
+        """
+
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._watches = {}
+        self._sigs = None
+
+    def _read(self):
+        """ Reads the pending inotify events.
+
+        return: A set of the ids of the patches that were touched.
+        """
+
+        touched = set()
+        for wd, mask, name in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so every patch could have changed.
+                touched |= self._ids | set(self.patch_ids())
+                continue
+            if wd not in self._watches:
+                continue
+            idx = self._watches[wd]
+            if idx == SHARDS:
+                # A shard; every patch in it is affected.
+                if not name.isdigit():
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_shard(name)
+                    try:
+                        ids = os.listdir(os.path.join(
+                            self.back_path, SHARDS, name))
+                    except FileNotFoundError:
+                        ids = []
+                    for idx in ids:
+                        self._watch(idx)
+                    touched |= set(ids)
+                touched |= {i for i in self._ids if i[-2:] == name}
+                continue
+            if idx is None:
+                # Holds patch directories; only those matter.
+                if mask & IN_IGNORED:
+                    del self._watches[wd]
+                if not name.isdigit():
+                    continue
+                idx = name
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch(idx)
+            elif mask & IN_IGNORED:
+                # The watch is gone, along with the patch directory.
+                del self._watches[wd]
+            touched.add(idx)
+
+        return touched
+
+    def _events(self, touched):
+        """ Works out what happened to the patches that were touched.
+
+        touched: A set of the ids of the patches that were touched.
+
+        return: A list of (kind, idx) tuples, see poll().
+        """
+
+        events = []
+        for idx in sorted(touched):
+            exists = idx.isdigit() and os.path.isdir(self.patch_path(idx))
+            if exists and idx not in self._ids:
+                self._ids.add(idx)
+                events.append((ADDED, idx))
+            elif exists:
+                events.append((MODIFIED, idx))
+            elif idx in self._ids:
+                self._ids.discard(idx)
+                events.append((DELETED, idx))
+
+        return events
+
+    def _watch(self, idx):
+        """ Adds an inotify watch for a patch directory.
+
+        idx: The id of the patch.
+
+        raise: OSError should the watch fail to be added for any reason
+               other than the directory having disappeared already.
+        """
+
+        try:
+            wd = self._inotify.add(self.patch_path(idx), PATCH_MASK)
+        except FileNotFoundError:
+            return
+        self._watches[wd] = idx
+
+    def _watch_shard(self, shard):
+        """ Adds an inotify watch for a shard of the sharded layout.
+
+        shard: The name of the shard.
+
+        raise: OSError, see _watch().
+        """
+
+        path = os.path.join(self.back_path, SHARDS, shard)
+        try:
+            wd = self._inotify.add(path, BACKEND_MASK)
+        except FileNotFoundError:
+            return
+        self._watches[wd] = None
+
+    def _scan(self, previous=None):
+        """ Records the state of every patch directory in the backend.
+
+        previous: Optional. The state returned by the previous scan.
+
+        return: A dict mapping patch ids to the modification time of
+                their directory, which changes whenever a file in it is
+                added, removed or renamed. For directories that were
+                modified recently, or were at the previous scan, the
+                names, modification times and sizes of their files are
+                recorded as well, see _changed().
+        """
+
+        previous = previous or {}
+        now = time.time_ns()
+
+        if self.is_sharded():
+            root = os.path.join(self.back_path, SHARDS)
+            parents = [entry.path for entry in os.scandir(root)
+                       if entry.name.isdigit() and entry.is_dir()]
+        else:
+            parents = [self.back_path]
+
+        sigs = {}
+        for parent in parents:
+            try:
+                entries = [entry for entry in os.scandir(parent)
+                           if entry.name.isdigit() and entry.is_dir()]
+            except FileNotFoundError:
+                # A shard that was deleted while scanning.
+                continue
+            for entry in entries:
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                    racy = now - mtime < RACY_WINDOW
+                    prev = previous.get(entry.name)
+                    if racy or isinstance(prev, tuple) and prev[2]:
+                        sigs[entry.name] = (mtime, _files(entry.path), racy)
+                    else:
+                        sigs[entry.name] = mtime
+                except FileNotFoundError:
+                    pass
+
+        return sigs
+
+
+def _files(path):
+    """ Records the state of the files in a directory.
+
+    path: The path to the directory.
+
+    return: A frozenset of the name, modification time and size of
+            every file.
+
+    raise: FileNotFoundError should the directory have been deleted.
+    """
+
+    sig = set()
+    for entry in os.scandir(path):
+        stat = entry.stat()
+        sig.add((entry.name, stat.st_mtime_ns, stat.st_size))
+
+    return frozenset(sig)
+
+
+def _changed(old, new):
+    """ Determines whether a patch directory changed between two scans.
+    Only its modification time is compared, unless the files in it were
+    recorded by both.
+
+    old: The state of the directory in the earlier scan, or None.
+    new: The state of the directory in the later scan, or None.
+
+    return: True if it changed, False otherwise.
+    """
+
+    if old is None or new is None:
+        return old is not new
+    if isinstance(old, tuple) and isinstance(new, tuple):
+        return old[:2] != new[:2]
+
+    return (old[0] if isinstance(old, tuple) else old) \
+        != (new[0] if isinstance(new, tuple) else new)
+
+
+class _Inotify:
+    """ A minimal wrapper around the inotify API, via ctypes.
+    """
+
+    def __init__(self):
+        """ Creates a non-blocking inotify instance.
+
+        raise: OSError should inotify not be available.
+        """
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add(self, path, mask):
+        """ Watches a path.
+
+        path: The path to watch.
+        mask: The events to watch for.
+
+        return: The watch descriptor.
+        raise: OSError should the watch fail to be added.
+        """
+
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path),
+                                          ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+
+        return wd
+
+    def read(self):
+        """ Reads every pending event.
+
+        return: A list of (wd, mask, name) tuples.
+        """
+
+        events = []
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, size = EVENT.unpack_from(buf, pos)
+                pos += EVENT.size
+                name = buf[pos:pos + size].rstrip(b"\0")
+                pos += size
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        """ Closes the inotify instance, removing every watch.
+        """
+
+        os.close(self._fd)
@@ -1,7 +1,11 @@
+import hashlib
 import json
 import os
 import re
+import threading
 
+from zoia_lib.backend import patch_sort
+from zoia_lib.backend.patch_search import index_for, touch
 from zoia_lib.common import errors
 
 
@@ -17,15 +21,10 @@ def sort_metadata(mode, data, rev):
           - 6 -> Sort by date modified (updated_at attribute)
           - 7 -> Sort by revision
     data: An array of metadata that is to be sorted.
-    inc: True if the data should be sorted in reverse,
+    rev: True if the data should be sorted in reverse,
          false otherwise.
     """
 
-    """ The use of .upper() is to prevent sorting of lower case names 
-    before their uppercase counterparts, especially when they share the 
-    same initial letter. In a list, you would want all the "d" titles 
-    grouped together.
-    """
     # Input checking.
     if mode is None or data is None or rev is None:
         raise errors.SortingError(mode, 903)
@@ -34,40 +33,37 @@ def sort_metadata(mode, data, rev):
     if not isinstance(data, list):
         raise errors.SortingError(data, 902)
 
-    if mode == 1:
-        # Sort by title
-        data.sort(key=lambda x: x["title"].upper(), reverse=rev)
-    elif mode == 2:
-        # Sort by author
-        data.sort(key=lambda x: x["author"]["name"].upper()
-                  if "author" in x else "", reverse=rev)
-    elif mode == 3:
-        # Sort by like count.
-        data.sort(key=lambda x: x["like_count"] if "like_count" in x else 0,
-                  reverse=rev)
-    elif mode == 4:
-        # Sort by download count.
-        data.sort(key=lambda x: x["download_count"]
-                  if "download_count" in x else 0, reverse=rev)
-    elif mode == 5:
-        # Sort by view count.
-        data.sort(key=lambda x: x["view_count"] if "view_count" in x else 0,
-                  reverse=rev)
-    elif mode == 6:
-        # Sort by date modified
-        data.sort(key=lambda x: x["updated_at"].upper(), reverse=rev)
-    elif mode == 7:
-        # Sort by revision #
-        data.sort(key=lambda x: x["revision"] if "revision" in x else 0,
-                  reverse=rev)
-
-
-def search_patches(data, query):
-    """ Search an array of metadata based on the passed parameters. The
-    search will attempt to match results using a wildcard regex system.
+    # The order of the list changes, so its search index has to know.
+    touch(data)
+
+    # The keys and orders are kept for the list, so that sorting it again
+    # only reorders it.
+    patch_sort.index_for(data).sort(mode, data, rev)
+
+
+def search_patches(data, query, ranked=False, weights=None, fuzzy=False,
+                   view=None):
+    """ Search an array of metadata based on the passed parameters. A
+    patch matches if the search term appears anywhere in its title,
+    author, tags or dates, ignoring case. Patches in a matching
+    category are listed first, unless the search is ranked.
 
     data: An array of metadata that is to be searched through.
     query: The search term for the current search.
+    ranked: Optional. True to list the most relevant patches first,
+            which also finds patches whose notes match the search term.
+            See SearchIndex.rank().
+    weights: Optional. For ranked searches, a dict mapping attributes
+             (title, tags, categories, author, content) to how much a
+             match in them counts.
+    fuzzy: Optional. True to return the patches that would match if
+           not for a typo or two, closest first, should nothing match
+           the search term exactly (see SearchIndex.fuzzy()). Meant for
+           what users type in, as the fallback may match many patches.
+    view: Optional. A copy of data to search instead, using the index
+          for data. Lists the application may modify in the meantime
+          (e.g. by sorting them) must be copied before searching them
+          from another thread.
 
     raise: SearchingError if the parameters are None or data is
            not of type list.
@@ -84,42 +80,17 @@ def search_patches(data, query):
     if not isinstance(data, list):
         raise errors.SearchingError(query, 1001)
 
-    hits = []
-
-    # Special case, searching for a category. Since there are a known # of
-    # categories, we prioritize these first.
-    if query in "composition" or query in "effect" or query in "game" or \
-            query in "other" or query in "sampler" or query in "sequencer" or \
-            query in "sound" or query in "synthesizer" or query in "utility" \
-            or query in "video":
-        for curr in data:
-            if "categories" in curr:
-                # Check category tag.
-                for category in curr["categories"]:
-                    if query in category["name"].lower():
-                        hits.insert(0, curr)
-                        break
-
-    for curr in data:
-        # Check the patch title.
-        if query in curr["title"].lower() and curr not in hits:
-            hits.append(curr)
-            continue
-        if "author" in curr and query in curr["author"]["name"].lower() \
-                and curr not in hits:
-            hits.append(curr)
-            continue
-        if "tags" in curr:
-            # Check every tag.
-            for tag in curr["tags"]:
-                if query in tag["name"].lower() and curr not in hits:
-                    hits.append(curr)
-                    continue
-        if query in curr["updated_at"].lower() and curr not in hits:
-            hits.append(curr)
-            continue
-        if query in curr["created_at"].lower() and curr not in hits:
-            hits.append(curr)
+    # Scanning every patch for every query is too slow for large
+    # libraries, so the list is indexed the first time it is searched.
+    index = index_for(data)
+    if view is not None:
+        data = view
+    if ranked:
+        hits = index.rank(data, query, weights=weights)
+    else:
+        hits = index.search(data, query)
+    if not hits and fuzzy:
+        hits = index.fuzzy(data, query)
 
     return hits
 
@@ -145,6 +116,61 @@ def hide_dotted_files(path):
     return files[::-1]
 
 
+def file_digest(path, chunk_size=64 * 1024):
+    """ Computes the SHA-256 digest of a file without reading all of it
+    into memory at once.
+
+    path: The path to the file.
+    chunk_size: Optional. The number of bytes read at a time.
+
+    return: The digest as a hex string.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    """ Writes a file such that it either keeps its previous contents or
+    has the new contents in full, even should the application crash or
+    the machine lose power partway through. The data is written to a
+    temporary file next to it, flushed to disk, and then renamed over
+    the file.
+
+    path: The path to the file.
+    data: The new contents, as a str or bytes.
+    """
+
+    # Unique per thread, so that concurrent writes don't collide.
+    tmp = "{}.{}.tmp".format(path, threading.get_ident())
+    try:
+        with open(tmp, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def write_json(path, data):
+    """ Writes JSON data to a file atomically, see write_atomic().
+
+    path: The path to the file.
+    data: The data to be encoded as JSON.
+    """
+
+    write_atomic(path, json.dumps(data))
+
+
 def add_test_patch(name, idx, path):
     """ Note: This method is for testing purposes only.
     Adds a test patch that can be used for unit testing purposes.
@@ -0,0 +1,520 @@
+""" A local stand-in for the PatchStorage API, serving a synthetic
+catalog of ZOIA patches. It lets the sync, download and update code be
+tested and benchmarked without a connection to PS.
+
+Run it on its own with:
+    python -m zoia_lib.tests.ps_standin --patches 2000 --latency 0.05
+
+then point the application at it by setting ZOIA_PS_URL to the URL it
+prints. Pass --bench to time a full catalog refresh, a download of every
+patch and an update check against it instead.
+"""
+
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import random
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PATH = "/api/alpha/"
+
+# Size of a ZOIA patch binary.
+BIN_SIZE = 32768
+
+# Marker block that every RAR 4 archive starts with.
+RAR_MARKER = b"Rar!\x1a\x07\x00"
+
+
+class PSStandIn:
+    """ Serves a synthetic catalog of patches over HTTP, mimicking the
+    parts of the PS API the application relies on: paged searches with
+    the X-WP-Total headers, include and orderby, per-patch metadata,
+    patch files, ETag based conditional requests, and redirects.
+
+    Every tenth patch is uploaded as a .zip containing several
+    binaries, and every twenty-fifth as a .rar.
+    """
+
+    def __init__(self, patches=100, latency=0.0, error_rate=0.0, seed=0,
+                 bin_size=BIN_SIZE):
+        """ Generates the catalog.
+
+        patches: Optional. The number of patches in the catalog.
+        latency: Optional. Seconds every request is delayed by.
+        error_rate: Optional. The fraction of requests that are answered
+                    with a 503 instead.
+        seed: Optional. Seed for the generated catalog and errors, so
+              that runs can be reproduced.
+        bin_size: Optional. The size of each generated binary.
+        """
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bin_size = bin_size
+        self.requests = 0
+        self.errors = 0
+        # Path prefix -> the prefix requests for it are redirected to,
+        # with a 301, as happens when PS moves its API.
+        self.redirects = {}
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        self.patches = {}
+        self.files = {}
+        start = datetime.datetime(2020, 1, 1)
+        for i in range(patches):
+            self.add_patch(start + datetime.timedelta(hours=i))
+
+    @property
+    def url(self):
+        """ The base URL of the API, once the server is running.
+        """
+
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}{}".format(host, port, API_PATH)
+
+    def start(self):
+        """ Starts serving on a free port, in a background thread.
+
+        return: The base URL of the API.
+        """
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+        return self.url
+
+    def stop(self):
+        """ Stops the server.
+        """
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add_patch(self, created_at=None):
+        """ Uploads a new patch to the catalog.
+
+        created_at: Optional. The upload date, defaults to now.
+
+        return: The id of the new patch.
+        """
+
+        idx = max(self.patches, default=100000) + 1
+        if created_at is None:
+            created_at = datetime.datetime.utcnow()
+        date = "{:%Y-%m-%dT%H:%M:%S+00:00}".format(created_at)
+
+        self.patches[idx] = {
+            "id": idx,
+            "link": "",
+            "self": "",
+            "created_at": date,
+            "updated_at": date,
+            "slug": "patch-{}".format(idx),
+            "title": "Patch {}".format(idx),
+            "excerpt": "",
+            "content": "Synthetic patch number {}.".format(idx),
+            "files": [],
+            "preview_url": "",
+            "revision": "1.0",
+            "view_count": self._random.randint(0, 5000),
+            "like_count": self._random.randint(0, 50),
+            "download_count": self._random.randint(0, 1000),
+            "author": {"id": idx % 97, "slug": "author-{}".format(idx % 97),
+                       "name": "Author {}".format(idx % 97)},
+            "categories": [{"id": 77, "slug": "effect", "name": "Effect"}],
+            "tags": [{"id": idx % 13, "slug": "tag-{}".format(idx % 13),
+                      "name": "tag {}".format(idx % 13)}],
+            "platform": {"id": 3003, "slug": "zoia", "name": "ZOIA"},
+            "state": {"id": 151, "slug": "ready-to-go",
+                      "name": "Ready-to-Go"},
+            "license": {"id": 1, "slug": "", "name": ""},
+            "custom_license_text": ""
+        }
+        self._upload(idx)
+
+        return idx
+
+    def update_patch(self, idx, updated_at=None):
+        """ Uploads a new file for a patch, as its author editing it on
+        PS would.
+
+        idx: The id of the patch.
+        updated_at: Optional. The modification date, defaults to now.
+        """
+
+        if updated_at is None:
+            updated_at = datetime.datetime.utcnow()
+        self.patches[idx]["updated_at"] = "{:%Y-%m-%dT%H:%M:%S+00:00}" \
+                                          "".format(updated_at)
+        self._upload(idx)
+
+    def delete_patch(self, idx):
+        """ Removes a patch from the catalog.
+
+        idx: The id of the patch.
+        """
+
+        del self.patches[idx]
+
+    def upload_file(self, idx, filename, data):
+        """ Replaces the file of a patch with the given one, for tests
+        that need the contents of a patch to be known. Every upload gets
+        a new file id, and therefore a new URL.
+
+        idx: The id of the patch.
+        filename: The name of the file, whose extension PS is trusted
+                  to report the format by (.bin, .zip or .rar).
+        data: The contents of the file as bytes.
+        """
+
+        file_id = 200000 + len(self.files) + 1
+        self.files[file_id] = data
+        self.patches[idx]["files"] = [{
+            "id": file_id,
+            "url": "patches/{}/files/{}".format(idx, file_id),
+            "filesize": len(data),
+            "filename": filename
+        }]
+
+    def _upload(self, idx):
+        """ Generates a new file for a patch.
+
+        idx: The id of the patch.
+        """
+
+        name = "zoia_patch_{}".format(idx)
+        if idx % 25 == 0:
+            filename = name + ".rar"
+            data = make_rar({"{}_{}.bin".format(name, i): self._binary()
+                             for i in range(2)})
+        elif idx % 10 == 0:
+            filename = name + ".zip"
+            data = make_zip({"{}_{}.bin".format(name, i): self._binary()
+                             for i in range(3)})
+        else:
+            filename = name + ".bin"
+            data = self._binary()
+
+        self.upload_file(idx, filename, data)
+
+    def _binary(self):
+        """ Generates the contents of a patch binary.
+
+        return: The binary as bytes.
+        """
+
+        return self._random.getrandbits(8 * self.bin_size).to_bytes(
+            self.bin_size, "little")
+
+    def _handler(self):
+        """ Builds the request handler class bound to this stand-in.
+
+        return: A BaseHTTPRequestHandler subclass.
+        """
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                standin._serve(self)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _serve(self, handler):
+        """ Answers a single request.
+
+        handler: The request handler for the request.
+        """
+
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return self._send(handler, 503, b"")
+
+        url = urlparse(handler.path)
+        for old, new in self.redirects.items():
+            if url.path.startswith(old):
+                return self._send(handler, 301, b"", headers={
+                    "Location": handler.path.replace(old, new, 1)})
+        parts = [p for p in url.path[len(API_PATH):].split("/") if p]
+        base = "http://{}{}".format(handler.headers["Host"], API_PATH)
+
+        if not url.path.startswith(API_PATH) or not parts \
+                or parts[0] != "patches":
+            return self._not_found(handler)
+
+        if len(parts) == 1:
+            return self._search(handler, parse_qs(url.query), base)
+
+        try:
+            idx = int(parts[1])
+        except ValueError:
+            return self._not_found(handler)
+        if idx not in self.patches:
+            return self._not_found(handler)
+
+        if len(parts) == 2:
+            return self._send_json(handler, self._meta(idx, base))
+        if len(parts) == 4 and parts[2] == "files" \
+                and parts[3].isdigit() and int(parts[3]) in self.files:
+            # Files never change, as every upload gets a new URL.
+            return self._send(handler, 200, self.files[int(parts[3])],
+                              "application/octet-stream",
+                              {"Cache-Control": "max-age=31536000"})
+
+        return self._not_found(handler)
+
+    def _search(self, handler, query, base):
+        """ Answers a paged search for patches.
+
+        handler: The request handler for the request.
+        query: The parsed query string.
+        base: The base URL to use for file URLs.
+        """
+
+        def arg(name, default):
+            return query.get(name, [default])[0]
+
+        patches = list(self.patches.values())
+        if "include" in query:
+            include = {int(i) for i in arg("include", "").split(",") if i}
+            patches = [pch for pch in patches if pch["id"] in include]
+
+        key = {
+            "date": lambda pch: pch["created_at"],
+            "modified": lambda pch: pch["updated_at"],
+            "id": lambda pch: pch["id"],
+            "title": lambda pch: pch["title"]
+        }.get(arg("orderby", "date"), lambda pch: pch["created_at"])
+        patches.sort(key=key, reverse=arg("order", "desc") == "desc")
+
+        per_page = min(int(arg("per_page", 10)), 100)
+        page = int(arg("page", 1))
+        pages = max(1, -(-len(patches) // per_page))
+        if page > pages:
+            return self._send_json(handler, {
+                "code": "rest_post_invalid_page_number",
+                "message": "The page number requested is larger than the "
+                           "number of pages available.",
+                "data": {"status": 400}
+            }, 400)
+
+        results = [self._meta(pch["id"], base) for pch in
+                   patches[(page - 1) * per_page:page * per_page]]
+        fields = [field for field in arg("_fields", "").split(",") if field]
+        if fields:
+            results = [{k: v for k, v in pch.items() if k in fields}
+                       for pch in results]
+        self._send_json(handler, results, 200, {
+            "X-WP-Total": str(len(patches)),
+            "X-WP-TotalPages": str(pages)
+        })
+
+    def _meta(self, idx, base):
+        """ Retrieves the metadata for a patch, as served to clients.
+
+        idx: The id of the patch.
+        base: The base URL to use for file URLs.
+
+        return: The metadata as a dict.
+        """
+
+        meta = dict(self.patches[idx])
+        meta["files"] = [dict(f, url=base + f["url"]) for f in meta["files"]]
+
+        return meta
+
+    def _not_found(self, handler):
+        """ Answers a request for something that doesn't exist.
+
+        handler: The request handler for the request.
+        """
+
+        self._send_json(handler, {
+            "code": "rest_post_invalid_id",
+            "message": "Invalid post ID.",
+            "data": {"status": 404}
+        }, 404)
+
+    def _send_json(self, handler, body, status=200, headers=None):
+        """ Sends a JSON response.
+
+        handler: The request handler for the request.
+        body: The body of the response, to be JSON encoded.
+        status: Optional. The status of the response.
+        headers: Optional. A dict of additional headers.
+        """
+
+        self._send(handler, status, json.dumps(body).encode(),
+                   "application/json; charset=UTF-8", headers)
+
+    @staticmethod
+    def _send(handler, status, body, content_type="text/plain",
+              headers=None):
+        """ Sends a response, answering conditional requests with a 304
+        when the client's copy is still current.
+
+        handler: The request handler for the request.
+        status: The status of the response.
+        body: The body of the response, as bytes.
+        content_type: Optional. The Content-Type of the response.
+        headers: Optional. A dict of additional headers.
+        """
+
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if status == 200 and handler.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        if status in (200, 304):
+            handler.send_header("ETag", etag)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def make_zip(files):
+    """ Builds a .zip archive in memory.
+
+    files: A dict mapping file names to their contents.
+
+    return: The archive as bytes.
+    """
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+
+    return buffer.getvalue()
+
+
+def make_rar(files):
+    """ Builds a RAR 4 archive in memory. The files are stored without
+    compression, which can be extracted without any external tools.
+
+    files: A dict mapping file names to their contents.
+
+    return: The archive as bytes.
+    """
+
+    def block(head_type, flags, fields):
+        size = 7 + len(fields)
+        header = struct.pack("<BHH", head_type, flags, size) + fields
+        return struct.pack("<H", zlib.crc32(header) & 0xFFFF) + header
+
+    # 2020-06-01 00:00:00 as a DOS timestamp.
+    ftime = ((40 << 9) | (6 << 5) | 1) << 16
+
+    archive = RAR_MARKER + block(0x73, 0, struct.pack("<HI", 0, 0))
+    for name, data in files.items():
+        name = name.encode()
+        archive += block(0x74, 0x8000, struct.pack(
+            "<IIBIIBBHI", len(data), len(data), 2, zlib.crc32(data), ftime,
+            20, 0x30, len(name), 0x20) + name) + data
+
+    return archive + block(0x7B, 0x4000, b"")
+
+
+def _bench(standin):
+    """ Times a full catalog refresh, a download of every patch and an
+    update check against the stand-in.
+
+    standin: The running stand-in server.
+    """
+
+    import shutil
+    import tempfile
+
+    from zoia_lib.backend.api import PatchStorage
+    from zoia_lib.backend.patch_download import PatchDownload
+    from zoia_lib.backend.patch_save import PatchSave
+
+    api = PatchStorage(url=standin.url, use_cache=False)
+    back_path = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        data = api.get_all_patch_data_init()
+        print("Catalog refresh: {} patches in {:.2f}s".format(
+            len(data), time.perf_counter() - start))
+
+        save = PatchSave()
+        save.back_path = back_path
+        engine = PatchDownload(api, save, api.workers)
+        engine.back_path = back_path
+        engine.enqueue([str(pch["id"]) for pch in data])
+        start = time.perf_counter()
+        cnt, fails = engine.run()
+        print("Download all: {} saved, {} failed in {:.2f}s".format(
+            cnt, fails, time.perf_counter() - start))
+
+        for idx in list(standin.patches)[::10]:
+            standin.update_patch(idx)
+        start = time.perf_counter()
+        updates = api.get_potential_updates(
+            [{"id": pch["id"], "updated_at": pch["updated_at"]}
+             for pch in data], back_path)
+        print("Update check: {} updates in {:.2f}s".format(
+            len(updates), time.perf_counter() - start))
+    finally:
+        shutil.rmtree(back_path)
+
+    print("Requests served: {} ({} errors)".format(standin.requests,
+                                                  standin.errors))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--patches", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bench", action="store_true")
+    args = parser.parse_args()
+
+    with PSStandIn(args.patches, args.latency, args.error_rate,
+                   args.seed) as ps:
+        if args.bench:
+            _bench(ps)
+        else:
+            print("Serving {} patches at {}".format(args.patches, ps.url))
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
@@ -1,15 +1,14 @@
+import hashlib
 import json
 import os
+import shutil
+import tempfile
 import unittest
-from urllib.request import Request, urlopen
 
-from bs4 import BeautifulSoup
 from jsonschema import validate
-from numpy import unicode
 
 import zoia_lib.backend.api as api
-
-ps = api.PatchStorage()
+from zoia_lib.tests.ps_standin import PSStandIn
 
 
 class TestAPI(unittest.TestCase):
@@ -17,43 +16,32 @@ class TestAPI(unittest.TestCase):
     queries that need to be made by the application in order to
     function correctly. Currently, it covers the retrieval of patches
     once the application starts and the downloading of patches.
+
+    The queries are made against a local stand-in for PS, so that the
+    results don't depend on the live site.
     """
 
+    @classmethod
+    def setUpClass(cls):
+        cls.standin = PSStandIn(patches=250, bin_size=1024)
+        cls.ps = api.PatchStorage(url=cls.standin.start(), use_cache=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.standin.stop()
+
     def test_api_all_zoia_patches(self):
         """ Query the PS API to ensure that all ZOIA patches are
         returned.
         """
 
-        # Need a known user agent to avoid getting 403'd.
-        # Used to grab the current number of ZOIA patches on PS.
-        req_patch = Request("https://patchstorage.com/",
-                            headers={"User-Agent": "Mozilla/5.0"})
-        soup_patch = BeautifulSoup(urlopen(req_patch).read(), "html.parser")
-        found_pedals = soup_patch.find_all(class_="d-flex flex-column "
-                                                  "justify-content-center")
-        """ Convert the ResultSet to a string so we can split on what we 
-        are looking for. The PS website does not have unique div names, 
-        so this is to workaround that. 
-        """
-        zoia = unicode.join(u'\n', map(unicode, found_pedals)
-                            ).split("ZOIA", 1)[1].split("<strong>", 1)[1]
-
-        # For some reason, questions posted on PS count as "patches",
-        # so we need to figure out the # of questions.
-        req_ques = Request(
-            "https://patchstorage.com/platform/zoia/?search_query=&ptype%5B"
-            "%5D=question&tax_platform"
-            "=zoia&tax_post_tag=&orderby=modified&wpas_id=search_form"
-            "&wpas_submit=1",
-            headers={"User-Agent": "Mozilla/5.0"})
-        soup_ques = BeautifulSoup(urlopen(req_ques).read(), "html.parser")
-
-        pch_list = ps.get_all_patch_data_init()
+        pch_list = self.ps.get_all_patch_data_init()
 
         # Make sure that the correct number of patches are retrieved.
-        self.assertTrue(int(zoia[:3]) - len(soup_ques.find_all(class_="card"))
-                        == len(pch_list),
+        self.assertTrue(len(self.standin.patches) == len(pch_list),
                         "Returned list does not contain all ZOIA patches.")
+        self.assertEqual(len(pch_list), len({pch["id"] for pch in pch_list}),
+                         "Returned list contains duplicate patches.")
 
     def test_api_download_bin(self):
         """ Query the PS API for a patch with the .bin extension,
@@ -62,6 +50,7 @@ class TestAPI(unittest.TestCase):
         """
 
         # Try to download something that doesn't exist.
+        ps = self.ps
         f = ps.download("1111111111")
         self.assertIsNone(f, "Retrieved patch data for a patch that does not "
                              "exist (patch id > 6 digits in length).")
@@ -73,7 +62,7 @@ class TestAPI(unittest.TestCase):
         self.assertIsNone(f, "Retrieved patch data without passing a patch "
                              "id.")
         # Try to actually download a .bin file.
-        f = ps.download("105634")
+        f = ps.download("100001")
         self.assertIsNotNone(f, "Did not retrieve patch data despite the"
                                 " patch id existing in PatchStorage.")
         self.assertTrue(isinstance(f[0], bytes),
@@ -157,7 +146,7 @@ class TestAPI(unittest.TestCase):
         """
 
         # Try to download a zip file.
-        f = ps.download("124436")
+        f = self.ps.download("100010")
         self.assertIsNotNone(f,
                              "Did not retrieve patch data despite the patch "
                              "id existing in PatchStorage.")
@@ -237,5 +226,36 @@ class TestAPI(unittest.TestCase):
                         "Returned min item did not contain the "
                         "custom_license_text attribute.")
 
+    def test_redirect(self):
+        """ Requests that PS redirects, e.g. once its API moved, should
+        be followed, for metadata and files alike.
+        """
+
+        self.standin.redirects["/api/old/"] = "/api/alpha/"
+        moved = api.PatchStorage(
+            url=self.standin.url.replace("/alpha/", "/old/"),
+            use_cache=False)
+        try:
+            meta = moved.get_patch_meta("100001")
+            self.assertEqual(100001, meta["id"])
+            self.assertEqual(1, len(moved.get_modified_patches(
+                self.standin.patches[100250]["updated_at"])))
+
+            meta["files"][0]["url"] = meta["files"][0]["url"].replace(
+                "/alpha/", "/old/")
+            directory = tempfile.mkdtemp()
+            try:
+                path, _, digest = moved.download_to_file("100001",
+                                                         directory, meta)
+                with open(path, "rb") as f:
+                    data = f.read()
+                self.assertEqual(self.standin.files[
+                    int(meta["files"][0]["url"].rsplit("/", 1)[1])], data)
+                self.assertEqual(hashlib.sha256(data).hexdigest(), digest)
+            finally:
+                shutil.rmtree(directory)
+        finally:
+            del self.standin.redirects["/api/old/"]
+
     def test_check_for_updates(self):
         pass
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from zoia_lib.backend.api_async import AsyncPatchStorage, \
+    BlockingPatchStorage
+from zoia_lib.backend.utilities import file_digest
+from zoia_lib.tests.ps_standin import PSStandIn
+
+
+class TestAsync(unittest.TestCase):
+    """ This class is responsible for testing the asyncio based PS API
+    client, through its blocking facade, against a local stand-in for
+    PS.
+
+    Currently, the tests cover retrieving the catalog, downloading
+    patches, checking for updates and failing queries.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.standin = PSStandIn(patches=250, bin_size=1024)
+        cls.ps = BlockingPatchStorage(url=cls.standin.start())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ps.close()
+        cls.standin.stop()
+
+    def test_catalog(self):
+        """ Every patch should be retrieved, in page order.
+        """
+
+        progress = []
+        data = self.ps.get_all_patch_data_init(
+            lambda done, total: progress.append(total))
+
+        self.assertEqual(len(self.standin.patches), len(data))
+        self.assertEqual(sorted(data, key=lambda x: x["created_at"],
+                                reverse=True), data,
+                         "Pages were not reassembled in order.")
+        self.assertEqual([3, 3, 3], progress)
+
+    def test_download(self):
+        """ Patches should be downloaded both into memory and to disk.
+        """
+
+        self.assertIsNone(self.ps.download("900000"))
+        data, meta = self.ps.download("100001")
+        self.assertEqual(1024, len(data))
+
+        directory = tempfile.mkdtemp()
+        try:
+            path, meta, digest = self.ps.download_to_file("100001",
+                                                          directory)
+            self.assertEqual(digest, file_digest(path))
+            with open(path, "rb") as f:
+                self.assertEqual(data, f.read())
+            self.assertIsNone(self.ps.download_to_file("900000", directory))
+            self.assertEqual([os.path.basename(path)], os.listdir(directory),
+                             "Failed download left a file behind.")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_updates(self):
+        """ Only the patches that were updated on PS should be
+        downloaded.
+        """
+
+        meta = [{"id": idx, "updated_at": pch["updated_at"]}
+                for idx, pch in self.standin.patches.items()]
+        self.standin.update_patch(100002)
+        self.standin.update_patch(100007)
+
+        directory = tempfile.mkdtemp()
+        try:
+            updates = self.ps.get_potential_updates(meta, directory)
+
+            self.assertEqual({100002, 100007},
+                             {pch["id"] for _, pch, _ in updates})
+            for path, _, digest in updates:
+                self.assertEqual(digest, file_digest(path))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_failed_search(self):
+        """ Should one query fail, the others should be cancelled rather
+        than left running.
+        """
+
+        cancelled = []
+
+        async def search(query):
+            if query["page"] == 0:
+                raise ConnectionError()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(query["page"])
+                raise
+
+        async def run():
+            client = AsyncPatchStorage()
+            client._search = search
+            with self.assertRaises(ConnectionError):
+                await client._search_many([{"page": i} for i in range(5)])
+            self.assertEqual([1, 2, 3, 4], sorted(cancelled))
+
+        asyncio.run(run())
@@ -1,29 +1,90 @@
 import io
+import struct
 import unittest
 import zipfile
 
-from zoia_lib.backend import api, patch_binary
+from zoia_lib.backend import api
+from zoia_lib.backend.patch_binary import PatchBinary
+from zoia_lib.tests.ps_standin import BIN_SIZE, PSStandIn, make_zip
 
-ps = api.PatchStorage()
+
+def make_binary(name, modules, pages):
+    """ Builds a ZOIA patch binary, with no connections or starred
+    parameters.
+
+    name: The name of the patch.
+    modules: A list of modules, as tuples containing the module id,
+             the page it is on, its color and its grid position.
+    pages: A list of page names.
+
+    return: The binary as bytes.
+    """
+
+    def text(string):
+        return struct.unpack("<4i", string.encode().ljust(16, b"\0"))
+
+    words = [0, *text(name), len(modules)]
+    for mod_idx, page, color, position in modules:
+        words += [14, mod_idx, 0, page, color, position, 0, 0, 0, 0,
+                  *text("")]
+    words.append(0)
+    words.append(len(pages))
+    for page in pages:
+        words += text(page)
+    words.append(0)
+    words += [color for _, _, color, _ in modules]
+    words[0] = len(words)
+
+    return struct.pack("<{}i".format(len(words)), *words).ljust(BIN_SIZE,
+                                                                b"\0")
 
 
 class FormatTest(unittest.TestCase):
+    """ This class is responsible for testing the analysis of patch
+    binaries downloaded from PS.
+
+    Currently, the tests cover plain .bin patches and binaries inside
+    .zip archives, served by a local stand-in for PS so that the results
+    don't depend on the live site.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.standin = PSStandIn(patches=2, bin_size=64)
+        cls.standin.upload_file(100001, "am_i_conscious.bin", make_binary(
+            "Am I Conscious", [(38, 0, 3, 0), (8, 1, 5, 8)],
+            ["Main", "Out"]))
+        cls.standin.upload_file(100002, "juniper.zip", make_zip({
+            "juniper.txt": b"Patch notes",
+            "juniper.bin": make_binary("Juniper", [(10, 0, 1, 2)], [])
+        }))
+        cls.ps = api.PatchStorage(url=cls.standin.start(), use_cache=False)
+        cls.binary = PatchBinary()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.standin.stop()
+
     def test_bin_formatter(self):
         """Extract patch information from binary file"""
 
-        f = ps.download("105634")
+        f = self.ps.download("100001")
         self.assertTrue(isinstance(f[0], bytes), "Returned tuple did not contain binary data in the first element.")
         self.assertTrue(isinstance(f[1], dict), "Returned tuple did not contain json data in the second element.")
 
-        size, name, n_mod = patch_binary.formatter(f[0])
-        self.assertTrue(size == 908, "Binary size not returning as expected")
-        self.assertTrue(name == 'Am I Conscious', "Binary name not returning as expected")
-        self.assertTrue(n_mod == 31, "Binary n_mod not returning as expected")
+        info = self.binary.parse_data(f[0])
+        self.assertTrue(info["name"] == 'Am I Conscious', "Binary name not returning as expected")
+        self.assertTrue(info["meta"]["n_modules"] == 2, "Binary n_mod not returning as expected")
+        self.assertEqual(["Noise", "Audio Multiply"],
+                         [mod["type"] for mod in info["modules"]])
+        self.assertEqual([0, 1], [mod["page"] for mod in info["modules"]])
+        self.assertEqual(["Main", "Out"],
+                         info["pages"][:info["meta"]["n_pages"]])
 
     def test_zip_formatter(self):
         """Extract patch information from compressed drive"""
 
-        f = ps.download("124436")
+        f = self.ps.download("100002")
 
         # Given "z", a bytes object containing a ZIP file,
         # extract the data therein
@@ -32,9 +93,9 @@ class FormatTest(unittest.TestCase):
             if '.txt' in name:
                 continue
             byt = zf.read(info)
-            # print(zf.read(fileinfo).decode('latin-1'))
-            size, name, n_mod = patch_binary.formatter(byt)
+            info = self.binary.parse_data(byt)
 
-            self.assertTrue(size == 2123, "Binary size not returning as expected")
-            self.assertTrue(name == 'Juniper', "Binary name not returning as expected")
-            self.assertTrue(n_mod == 75, "Binary n_mod not returning as expected")
+            self.assertTrue(info["name"] == 'Juniper', "Binary name not returning as expected")
+            self.assertTrue(info["meta"]["n_modules"] == 1, "Binary n_mod not returning as expected")
+            self.assertEqual(["Sample & Hold"],
+                             [mod["type"] for mod in info["modules"]])
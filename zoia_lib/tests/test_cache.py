@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from zoia_lib.backend.api_cache import ResponseCache
+
+
+class FakeResponse:
+    """ Stands in for a urllib3 response. """
+
+    def __init__(self, status, data=b"", headers=None):
+        self.status = status
+        self.data = data
+        self.headers = {} if headers is None else headers
+
+
+class FakeServer:
+    """ Serves a single versioned document, answering conditional
+    requests with a 304 when the document has not changed.
+    """
+
+    def __init__(self):
+        self.version = 1
+        self.requests = []
+
+    def fetch(self, url, headers):
+        self.requests.append(headers)
+        etag = '"v{}"'.format(self.version)
+        if headers.get("If-None-Match") == etag:
+            return FakeResponse(304, headers={"ETag": etag})
+        return FakeResponse(200, "{}-{}".format(url, self.version).encode(),
+                            {"ETag": etag, "X-WP-Total": "42"})
+
+
+class TestCache(unittest.TestCase):
+    """ This class is responsible for testing the on-disk cache that
+    responses from the PS API are kept in.
+
+    Currently, the tests cover conditional revalidation, immutable
+    responses, persistence between sessions (including writing the
+    index once per batch) and LRU eviction.
+    """
+
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.cache.cache_path = tempfile.mkdtemp()
+        self.server = FakeServer()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache.cache_path)
+
+    def test_revalidation(self):
+        """ A cached response should be revalidated with a conditional
+        request, and only downloaded again once it has changed.
+        """
+
+        r = self.cache.request("a", self.server.fetch)
+        self.assertEqual(b"a-1", r.data)
+        self.assertEqual({}, self.server.requests[-1],
+                         "First request should not be conditional.")
+
+        r = self.cache.request("a", self.server.fetch)
+        self.assertEqual(b"a-1", r.data)
+        self.assertEqual({"If-None-Match": '"v1"'}, self.server.requests[-1],
+                         "Second request should be conditional.")
+        self.assertEqual("42", r.headers["x-wp-total"],
+                         "Cached headers were not preserved.")
+
+        self.server.version = 2
+        r = self.cache.request("a", self.server.fetch)
+        self.assertEqual(b"a-2", r.data, "Changed response was not used.")
+
+        stats = self.cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["revalidations"])
+        self.assertEqual(2, stats["misses"])
+
+    def test_immutable(self):
+        """ Immutable responses should be served without any request.
+        """
+
+        self.cache.request("a", self.server.fetch, True)
+        self.cache.request("a", self.server.fetch, True)
+
+        self.assertEqual(1, len(self.server.requests),
+                         "Expected a single request.")
+        self.assertEqual(1, self.cache.stats()["hits"])
+
+    def test_persistence(self):
+        """ Cached responses should be available to later sessions.
+        """
+
+        self.cache.request("a", self.server.fetch, True)
+
+        cache = ResponseCache()
+        cache.cache_path = self.cache.cache_path
+        r = cache.request("a", self.server.fetch, True)
+
+        self.assertEqual(b"a-1", r.data)
+        self.assertEqual(1, len(self.server.requests),
+                         "Expected the response to be served from disk.")
+
+    def test_batch(self):
+        """ The index should only be written once a batch of requests is
+        done.
+        """
+
+        index = os.path.join(self.cache.cache_path, "index.json")
+        with self.cache.batch():
+            with self.cache.batch():
+                self.cache.request("a", self.server.fetch)
+            self.cache.request("b", self.server.fetch)
+            self.cache.request("a", self.server.fetch)
+            self.assertFalse(os.path.exists(index),
+                             "The index was written during the batch.")
+        self.assertTrue(os.path.exists(index))
+
+        cache = ResponseCache()
+        cache.cache_path = self.cache.cache_path
+        self.assertEqual(2, cache.stats()["entries"])
+
+    def test_eviction(self):
+        """ The least recently used responses should be evicted once
+        the cache is full.
+        """
+
+        self.cache.max_size = 7
+        self.cache.request("a", self.server.fetch, True)
+        self.cache.request("b", self.server.fetch, True)
+        # Use "a" so that "b" becomes the least recently used.
+        self.cache.request("a", self.server.fetch, True)
+        self.cache.request("c", self.server.fetch, True)
+
+        self.cache.request("a", self.server.fetch, True)
+        self.assertEqual(3, len(self.server.requests),
+                         "Expected the recently used response to be kept.")
+        self.cache.request("b", self.server.fetch, True)
+        self.assertEqual(4, len(self.server.requests),
+                         "Expected the least recently used response to be "
+                         "evicted.")
+        self.assertTrue(self.cache.stats()["size"] <= 7,
+                        "Cache grew beyond its maximum size.")
+
+    def test_files(self):
+        """ Bodies streamed to a file should be cached by copying them,
+        and served back as a path.
+        """
+
+        self.assertIsNone(self.cache.lookup_file("a"))
+
+        src = tempfile.NamedTemporaryFile(delete=False)
+        src.write(b"streamed")
+        src.close()
+        self.cache.store_file("a", src.name, {"ETag": '"v1"'})
+        os.remove(src.name)
+
+        path = self.cache.lookup_file("a")
+        with open(path, "rb") as f:
+            self.assertEqual(b"streamed", f.read())
+        self.assertEqual(1, self.cache.stats()["hits"])
@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import zoia_lib.backend.utilities as util
+from zoia_lib.backend.patch_catalog import PatchCatalog
+from zoia_lib.backend.patch_meta import meta_cache
+
+
+def make_patch(idx, title="Test", author="Someone"):
+    return {
+        "id": idx,
+        "title": title,
+        "author": {"id": 1, "name": author, "slug": author.lower()},
+        "tags": [{"id": 2, "name": "delay", "slug": "delay"}],
+        "categories": [{"id": 3, "name": "Effect", "slug": "effect"}],
+        "created_at": "2020-06-01T00:00:00+00:00",
+        "updated_at": "2020-06-02T00:00:00+00:00",
+        "like_count": 4,
+        "download_count": 40,
+        "view_count": None,
+        "content": "<p>Patch notes</p>" * 50,
+        "files": [{"id": idx, "filename": "{}.bin".format(idx)}],
+        "license": {"name": "MIT"}
+    }
+
+
+class TestCatalog(unittest.TestCase):
+    """ This class is responsible for testing the compact storage of the
+    PS catalog in the backend application directory.
+
+    Currently, the tests cover saving and loading the catalog, reading
+    the complete metadata of a single patch or of many at once, keeping
+    it across saves, ranking patches by their notes, and converting
+    data.json catalogs.
+    """
+
+    def setUp(self):
+        self.catalog = PatchCatalog()
+        self.catalog.back_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.catalog.back_path)
+
+    def test_round_trip(self):
+        """ Only the attributes the tables, searching and sorting need
+        should be loaded, while the rest is available per patch.
+        """
+
+        data = [make_patch(100001), make_patch(100002, "Other", "Else")]
+        del data[1]["tags"]
+
+        saved = self.catalog.save(data)
+
+        self.assertEqual(saved, self.catalog.load())
+        self.assertEqual({"id", "title", "author", "tags", "categories",
+                          "created_at", "updated_at", "like_count",
+                          "download_count"}, set(saved[0]))
+        self.assertEqual({"name": "Someone"}, saved[0]["author"])
+        self.assertIsNone(saved[0]["view_count"])
+        self.assertNotIn("tags", saved[1],
+                         "Missing attributes should stay missing.")
+        meta_cache.clear()
+        self.assertIn("content", saved[0])
+        self.assertIn("view_count", saved[0])
+        self.assertNotIn("preview_url", saved[0])
+        self.assertEqual(0, len(meta_cache),
+                         "Checking for attributes shouldn't load them.")
+        self.assertEqual("MIT", saved[0]["license"]["name"],
+                         "Heavy attributes should be loaded on access.")
+        self.assertEqual(data[1], self.catalog.meta(100002))
+        self.assertEqual(data[0], self.catalog.meta("100001"))
+        self.assertIsNone(self.catalog.meta(900000))
+
+    def test_meta_many(self):
+        """ The complete metadata of many patches should be read in a
+        single pass, skipping patches that aren't in the catalog.
+        """
+
+        data = [make_patch(100000 + i) for i in range(5)]
+        self.catalog.save(data)
+
+        self.assertEqual([("100001", data[1]), (100003, data[3])], list(
+            self.catalog.meta_many([100003, 900000, "100001"])))
+        self.assertEqual(data, [meta for _, meta in
+                                self.catalog.meta_many(range(100000,
+                                                             100005))])
+
+    def test_rank(self):
+        """ Ranked searches should score the patch notes without loading
+        each patch through meta_cache.
+        """
+
+        data = [make_patch(100000 + i) for i in range(4)]
+        data[2]["content"] = "<p>A slow tape echo</p>"
+        saved = self.catalog.save(data)
+        meta_cache.clear()
+        ranked = util.search_patches(saved, "echo", True)
+        self.assertEqual([100002], [pch.id for pch in ranked])
+        self.assertEqual(0, len(meta_cache))
+
+    def test_merge(self):
+        """ Saving loaded records alongside new metadata should keep the
+        complete metadata of the loaded records.
+        """
+
+        self.catalog.save([make_patch(100001), make_patch(100002)])
+        data = self.catalog.load()
+        self.assertEqual(100002, data[1]["id"])
+
+        self.catalog.save([make_patch(100003), data[0]])
+
+        self.assertEqual([100003, 100001],
+                         [pch["id"] for pch in self.catalog.load()])
+        self.assertEqual(make_patch(100001), self.catalog.meta(100001))
+        self.assertIsNone(self.catalog.meta(100002))
+
+    def test_migrate(self):
+        """ A data.json catalog should be converted and removed, while a
+        catalog that can't be read should be treated as missing.
+        """
+
+        path = os.path.join(self.catalog.back_path, "data.json")
+        with open(path, "w") as f:
+            f.write(json.dumps([make_patch(100001)]))
+
+        self.assertEqual("Test", self.catalog.load()[0]["title"])
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(make_patch(100001), self.catalog.meta(100001))
+
+        with open(os.path.join(self.catalog.back_path, "catalog.bin"),
+                  "wb") as f:
+            f.write(b"ZLC")
+        self.assertIsNone(self.catalog.load())
+        self.assertIsNone(self.catalog.meta(100001))
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import nullcontext
+
+from zoia_lib.backend.patch_download import PatchDownload
+from zoia_lib.common import errors
+
+
+class FakePatchStorage:
+    """ Stands in for the PatchStorage class, optionally losing the
+    connection once a given patch is requested.
+    """
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def batch(self):
+        return nullcontext()
+
+    def download_to_file(self, idx, directory):
+        with self.lock:
+            self.requested.append(idx)
+        if idx == self.fail_on:
+            raise ConnectionError("Lost the connection.")
+        path = os.path.join(directory, idx + ".part")
+        with open(path, "wb") as f:
+            f.write(idx.encode())
+        return path, {"id": int(idx)}, hashlib.sha256(idx.encode()).hexdigest()
+
+
+class FakePatchSave:
+    """ Stands in for the PatchSave class, refusing to save the patches
+    it is told to.
+    """
+
+    def __init__(self, refuse=()):
+        self.refuse = refuse
+        self.saved = []
+
+    def save_to_backend(self, patch):
+        idx = str(patch[1]["id"])
+        if idx in self.refuse:
+            raise errors.SavingError(None)
+        with open(patch[0], "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == patch[2]
+        # Binaries are moved into the backend.
+        os.remove(patch[0])
+        self.saved.append(idx)
+
+
+class TestDownload(unittest.TestCase):
+    """ This class is responsible for testing the downloading of many
+    patches from PS at once.
+
+    Currently, the tests cover the order patches are saved in, patches
+    that fail to save, and resuming after the connection is lost.
+    """
+
+    def setUp(self):
+        self.ids = [str(100000 + i) for i in range(20)]
+        self.save = FakePatchSave()
+
+    def tearDown(self):
+        shutil.rmtree(self.engine.back_path)
+
+    def _engine(self, api):
+        self.engine = PatchDownload(api, self.save, workers=4)
+        self.engine.back_path = tempfile.mkdtemp()
+        return self.engine
+
+    def test_download_in_order(self):
+        """ Patches should be saved in queue order, with progress
+        reported for every patch.
+        """
+
+        engine = self._engine(FakePatchStorage())
+        engine.enqueue(self.ids)
+        progress = []
+
+        cnt, fails = engine.run(lambda done, total: progress.append(done))
+
+        self.assertEqual((20, 0), (cnt, fails))
+        self.assertEqual(self.ids, self.save.saved,
+                         "Patches were not saved in queue order.")
+        self.assertEqual(list(range(1, 21)), progress)
+        self.assertEqual([], engine.pending(), "Queue was not emptied.")
+
+    def test_download_failures(self):
+        """ Patches that fail to save should be skipped.
+        """
+
+        self.save.refuse = (self.ids[3], self.ids[7])
+        engine = self._engine(FakePatchStorage())
+        engine.enqueue(self.ids)
+
+        self.assertEqual((18, 2), engine.run())
+        self.assertFalse(os.path.exists(engine._staging_path()),
+                         "Downloaded files were left behind.")
+
+    def test_download_resume(self):
+        """ Should the connection be lost, the next run should resume
+        with the first patch that was not saved.
+        """
+
+        engine = self._engine(FakePatchStorage(fail_on=self.ids[10]))
+        engine.enqueue(self.ids)
+
+        with self.assertRaises(ConnectionError):
+            engine.run()
+        self.assertEqual(self.ids[:10], self.save.saved)
+        self.assertEqual(self.ids[10:], engine.pending(),
+                         "Queue did not survive the lost connection.")
+
+        # A new session picks up where the previous one stopped.
+        api = FakePatchStorage()
+        resumed = PatchDownload(api, self.save, workers=4)
+        resumed.back_path = engine.back_path
+
+        self.assertEqual((10, 0), resumed.run())
+        self.assertEqual(self.ids, self.save.saved)
+        self.assertEqual(self.ids[10:], sorted(api.requested),
+                         "Saved patches were downloaded again.")
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from zoia_lib.backend.patch_delete import PatchDelete
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.utilities import add_test_patch, file_digest
+
+
+class TestIndex(unittest.TestCase):
+    """ This class is responsible for testing the index of the patches
+    saved to the backend.
+
+    Currently, the tests cover building the index from the patch
+    directories, looking patches and versions up, and keeping the index
+    up to date as patches are deleted.
+    """
+
+    def setUp(self):
+        self.back_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.back_path, "Banks"))
+        add_test_patch("22222", 22222, self.back_path)
+        # Saved the way older versions did, v1 being the newest.
+        for i in range(1, 4):
+            add_test_patch(os.path.join("123456", "123456_v{}".format(i)),
+                           123456, self.back_path)
+            with open(os.path.join(self.back_path, "123456",
+                                   "123456_v{}.json".format(i)), "w") as f:
+                json.dump({"id": 123456, "title": "Test", "revision": i,
+                           "updated_at": "2020-0{}".format(4 - i),
+                           "files": [{"filename": "v{}.bin".format(i)}]},
+                          f)
+        with open(os.path.join(self.back_path, "data.json"), "w") as f:
+            f.write("[]")
+
+        self.index = PatchIndex.for_path(self.back_path)
+        self.delete = PatchDelete()
+        self.delete.back_path = self.back_path
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.back_path)
+
+    def test_build(self):
+        """ The index should be built from the patch directories the
+        first time it is used, skipping everything else in the backend.
+        """
+
+        self.assertIs(self.index, PatchIndex.for_path(self.back_path))
+        self.assertEqual(2, self.index.count())
+        self.assertEqual({"22222": 1, "123456": 3},
+                         self.index.version_counts())
+        versions = self.index.versions(123456)
+        self.assertEqual([3, 2, 1], [pch["revision"] for pch in versions])
+        self.assertIn("files", versions[1])
+        self.assertNotIn("preview_url", versions[1])
+        self.assertEqual("v2.bin", versions[1]["files"][0]["filename"],
+                         "Heavy attributes should be loaded on access.")
+        self.assertEqual({22222: None, 123456: 3},
+                         {pch["id"]: pch.get("revision")
+                          for pch in self.index.patches()})
+        self.assertEqual([{"id": 123456, "updated_at": "2020-03"}],
+                         self.index.update_dates())
+        self.assertEqual(3, self.index.patch(123456)["revision"])
+        self.assertIsNone(self.index.patch(654321))
+
+        self.assertTrue(self.index.has("123456_v2"))
+        self.assertFalse(self.index.has("123456_v4"))
+        self.assertTrue(self.index.has("22222"))
+        self.assertTrue(self.index.has_binary(file_digest(
+            os.path.join(self.back_path, "22222", "22222.bin"))))
+
+    def test_delete(self):
+        """ Deleting patches should update the index.
+        """
+
+        self.delete.delete_patch("123456_v2")
+        self.assertEqual(2, self.index.version_count(123456))
+        self.assertFalse(self.index.has("123456_v2"))
+        self.assertTrue(self.index.has("123456_v3"))
+
+        self.delete.delete_patch("123456_v1")
+        self.assertEqual(1, self.index.version_count(123456))
+        self.assertTrue(self.index.has("123456"))
+
+        self.delete.delete_full_patch_directory("22222")
+        self.assertFalse(self.index.has("22222"))
+        self.assertIsNone(self.index.patch("22222"))
+        self.assertEqual(1, self.index.count())
+
+    def test_rebuild(self):
+        """ The index should be rebuilt when its schema changes.
+        """
+
+        self.index.count()
+        self.index.close()
+        self.index._connect().execute("PRAGMA user_version = 0")
+        self.index.close()
+        shutil.rmtree(os.path.join(self.back_path, "22222"))
+
+        self.assertEqual(1, self.index.count())
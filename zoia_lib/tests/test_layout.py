@@ -0,0 +1,132 @@
+import os
+import platform
+import shutil
+import tempfile
+import unittest
+
+from zoia_lib.backend.patch import SHARDS
+from zoia_lib.backend.patch_delete import PatchDelete
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.patch_layout import SHARDING, PatchLayout
+from zoia_lib.backend.patch_manifest import NUMBERED, PatchManifest
+from zoia_lib.backend.patch_watch import PatchWatcher, ADDED, DELETED
+from zoia_lib.backend.utilities import add_test_patch
+
+
+class TestLayout(unittest.TestCase):
+    """ This class is responsible for testing the sharded layout of the
+    backend application directory.
+
+    Currently, the tests cover converting the backend to and from the
+    sharded layout (including resuming an interrupted conversion), and
+    finding, deleting and watching patches once it is sharded.
+    """
+
+    def setUp(self):
+        self.back_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.back_path, "Banks"))
+        add_test_patch("22222", 22222, self.back_path)
+        add_test_patch("33322", 33322, self.back_path)
+        for i in range(1, 3):
+            add_test_patch(os.path.join("123456", "123456_v{}".format(i)),
+                           123456, self.back_path)
+
+        self.layout = PatchLayout()
+        self.layout.back_path = self.back_path
+        self.index = PatchIndex.for_path(self.back_path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.back_path)
+
+    def shard(self, idx):
+        return os.path.join(self.back_path, SHARDS, idx[-2:], idx)
+
+    def test_shard(self):
+        self.assertFalse(self.layout.is_sharded())
+        self.assertEqual(os.path.join(self.back_path, "22222"),
+                         self.layout.patch_path(22222))
+        self.assertEqual(3, self.index.count())
+
+        self.assertEqual(3, self.layout.shard())
+        self.assertTrue(self.layout.is_sharded())
+        self.assertEqual(0, self.layout.shard())
+        self.assertEqual(["Banks", "library.db", NUMBERED, SHARDS],
+                         sorted(os.listdir(self.back_path)))
+        self.assertEqual(["22", "56"], sorted(os.listdir(
+            os.path.join(self.back_path, SHARDS))))
+        self.assertEqual(self.shard("33322"), self.layout.patch_path(33322))
+        self.assertEqual(["123456", "22222", "33322"],
+                         sorted(self.layout.patch_ids()))
+
+        # The index should point to the new location of every file.
+        self.assertEqual(3, self.index.count())
+        self.assertEqual({"22222": 1, "33322": 1, "123456": 2},
+                         self.index.version_counts())
+        self.assertEqual("Test", self.index.patch(22222)["title"])
+
+        manifest = PatchManifest()
+        manifest.back_path = self.back_path
+        self.assertEqual(2, manifest.latest(123456)["version"])
+
+        delete = PatchDelete()
+        delete.back_path = self.back_path
+        delete.delete_patch("123456_v1")
+        self.assertEqual(["123456.bin", "123456.json", "manifest.json"],
+                         sorted(os.listdir(self.shard("123456"))))
+        self.assertTrue(self.index.has("123456"))
+        delete.delete_full_patch_directory("22222")
+        self.assertFalse(os.path.exists(self.shard("22222")))
+        self.assertEqual(2, self.index.count())
+
+    def test_unshard(self):
+        self.assertEqual(0, self.layout.unshard())
+        self.layout.shard()
+        self.assertEqual(3, self.layout.unshard())
+        self.assertFalse(self.layout.is_sharded())
+        self.assertEqual(["123456", "22222", "33322", "Banks", "library.db",
+                          NUMBERED], sorted(os.listdir(self.back_path)))
+        self.assertEqual({"22222": 1, "33322": 1, "123456": 2},
+                         self.index.version_counts())
+        for bin_path, json_path in self.index._connect().execute(
+                "SELECT bin_path, json_path FROM patches"):
+            self.assertTrue(os.path.exists(bin_path))
+            self.assertTrue(os.path.exists(json_path))
+
+    def test_interrupted(self):
+        """ Converting again should pick up where an interrupted
+        conversion left off.
+        """
+
+        os.makedirs(os.path.join(self.back_path, SHARDING, "22"))
+        os.rename(os.path.join(self.back_path, "22222"),
+                  os.path.join(self.back_path, SHARDING, "22", "22222"))
+
+        self.assertEqual(2, self.layout.shard())
+        self.assertEqual(["123456", "22222", "33322"],
+                         sorted(self.layout.patch_ids()))
+        self.assertEqual(3, self.index.count())
+
+    def changes(self, use_inotify):
+        self.layout.shard()
+        watcher = PatchWatcher(use_inotify=use_inotify)
+        watcher.back_path = self.back_path
+        watcher.start()
+        self.addCleanup(watcher.close)
+
+        # Both in an existing shard and in a new one.
+        add_test_patch("22322", 22322, os.path.dirname(self.shard("22322")))
+        os.makedirs(os.path.dirname(self.shard("22299")))
+        add_test_patch("22299", 22299, os.path.dirname(self.shard("22299")))
+        shutil.rmtree(self.shard("123456"))
+
+        return sorted(watcher.poll(force=True))
+
+    def test_watch_polling(self):
+        self.assertEqual([(ADDED, "22299"), (ADDED, "22322"),
+                          (DELETED, "123456")], self.changes(False))
+
+    @unittest.skipUnless(platform.system() == "Linux", "Requires inotify.")
+    def test_watch_inotify(self):
+        self.assertEqual([(ADDED, "22299"), (ADDED, "22322"),
+                          (DELETED, "123456")], self.changes(True))
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from zoia_lib.backend.patch_delete import PatchDelete
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.patch_manifest import MANIFEST, NUMBERED, PARKED, \
+    RENUMBER, STAGED, PatchManifest
+from zoia_lib.backend.utilities import add_test_patch, write_json
+
+
+class TestManifest(unittest.TestCase):
+    """ This class is responsible for testing the manifests kept in each
+    patch directory.
+
+    Currently, the tests cover creating manifests for patch directories
+    that don't have one yet (renumbering their versions only should they
+    have been saved by older versions), looking versions up, keeping
+    manifests up to date as versions are renamed and deleted, and
+    completing interrupted splits into versions and renumberings.
+    """
+
+    def setUp(self):
+        self.back_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.back_path, "Banks"))
+        add_test_patch("22222", 22222, self.back_path)
+        # Saved the way older versions did, v1 being the newest.
+        for i in range(1, 4):
+            add_test_patch(os.path.join("123456", "123456_v{}".format(i)),
+                           123456, self.back_path)
+            with open(os.path.join(self.back_path, "123456",
+                                   "123456_v{}.bin".format(i)), "wb") as f:
+                f.write(b"v" * i)
+
+        self.manifest = PatchManifest()
+        self.manifest.back_path = self.back_path
+        self.delete = PatchDelete()
+        self.delete.back_path = self.back_path
+
+    def tearDown(self):
+        PatchIndex.for_path(self.back_path).close()
+        shutil.rmtree(self.back_path)
+
+    def test_versions(self):
+        path = os.path.join(self.back_path, "123456", MANIFEST)
+        self.assertFalse(os.path.exists(path))
+
+        versions = self.manifest.versions(123456)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual([3, 2, 1], [ver["version"] for ver in versions])
+        self.assertEqual(["123456_v3.bin", "123456_v3.json"],
+                         [versions[0]["bin"], versions[0]["json"]])
+        self.assertEqual(2, versions[1]["size"])
+        self.assertEqual(hashlib.sha256(b"vvv").hexdigest(),
+                         versions[2]["sha256"])
+
+        self.assertEqual(0, self.manifest.latest("22222")["version"])
+        self.assertIsNone(self.manifest.latest("654321"))
+        self.assertEqual([], self.manifest.versions("654321"))
+        self.assertTrue(self.manifest.has_binary(
+            123456, hashlib.sha256(b"vv").hexdigest()))
+        self.assertFalse(self.manifest.has_binary(
+            22222, hashlib.sha256(b"vv").hexdigest()))
+
+    def test_renumber(self):
+        """ Versions saved by older versions should be renumbered such
+        that the oldest is v1, along with their revision.
+        """
+
+        self.manifest.versions(123456)
+        pch = os.path.join(self.back_path, "123456")
+        for ver, data in ((1, b"vvv"), (2, b"vv"), (3, b"v")):
+            with open(os.path.join(pch, "123456_v{}.bin".format(ver)),
+                      "rb") as f:
+                self.assertEqual(data, f.read())
+            with open(os.path.join(pch, "123456_v{}.json".format(ver)),
+                      "r") as f:
+                self.assertEqual(ver, json.loads(f.read())["revision"])
+        self.assertEqual(["123456_v1.bin", "123456_v1.json",
+                          "123456_v2.bin", "123456_v2.json",
+                          "123456_v3.bin", "123456_v3.json", MANIFEST],
+                         sorted(os.listdir(pch)))
+
+        # Only once.
+        self.manifest.refresh(123456)
+        with open(os.path.join(pch, "123456_v3.bin"), "rb") as f:
+            self.assertEqual(b"v", f.read())
+
+    def contents(self, idx):
+        """ Reads the binary and revision of every version of a patch,
+        by version number. """
+
+        pch = os.path.join(self.back_path, str(idx))
+        found = {}
+        for ver in self.manifest.versions(idx):
+            with open(os.path.join(pch, ver["bin"]), "rb") as f:
+                data = f.read()
+            with open(os.path.join(pch, ver["json"]), "r") as f:
+                found[ver["version"]] = (data,
+                                         json.loads(f.read())["revision"])
+
+        return found
+
+    def test_lost_manifest(self):
+        """ Once the backend was renumbered, patch directories without a
+        readable manifest should keep their numbering, while those with
+        a manifest of format 1 are still renumbered.
+        """
+
+        expected = {1: (b"vvv", 1), 2: (b"vv", 2), 3: (b"v", 3)}
+        self.assertEqual(expected, self.contents(123456))
+        self.assertTrue(os.path.exists(os.path.join(self.back_path,
+                                                    NUMBERED)))
+
+        path = os.path.join(self.back_path, "123456", MANIFEST)
+        os.remove(path)
+        self.assertEqual(expected, self.contents(123456))
+        with open(path, "w") as f:
+            f.write("{")
+        self.assertEqual(expected, self.contents(123456))
+
+        for i in range(1, 3):
+            add_test_patch(os.path.join("654321", "654321_v{}".format(i)),
+                           654321, self.back_path)
+            with open(os.path.join(self.back_path, "654321",
+                                   "654321_v{}.bin".format(i)), "wb") as f:
+                f.write(b"w" * i)
+        write_json(os.path.join(self.back_path, "654321", MANIFEST),
+                   {"format": 1, "id": "654321", "versions": []})
+        self.assertEqual({1: (b"ww", 1), 2: (b"w", 2)},
+                         self.contents(654321))
+
+    def test_interrupted_renumber(self):
+        """ A renumbering should be completed should it have been
+        interrupted, whether or not every file was parked.
+        """
+
+        self.manifest.versions(22222)
+        pch = os.path.join(self.back_path, "123456")
+        plan = {"versions": [[1, 3], [2, 2], [3, 1]], "parked": False}
+
+        # Interrupted while parking, before the manifest was rewritten.
+        write_json(os.path.join(pch, MANIFEST),
+                   {"format": 1, "id": "123456", "versions": []})
+        write_json(os.path.join(pch, RENUMBER), plan)
+        os.rename(os.path.join(pch, "123456_v1.bin"),
+                  os.path.join(pch, "123456_v3.bin" + PARKED))
+        self.assertEqual({1: (b"v", 1), 2: (b"vv", 2), 3: (b"vvv", 3)},
+                         self.contents(123456))
+        self.assertEqual(["123456_v1.bin", "123456_v1.json",
+                          "123456_v2.bin", "123456_v2.json",
+                          "123456_v3.bin", "123456_v3.json", MANIFEST],
+                         sorted(os.listdir(pch)))
+
+        # Interrupted while moving the parked files into place.
+        os.remove(os.path.join(pch, MANIFEST))
+        write_json(os.path.join(pch, RENUMBER), dict(plan, parked=True))
+        for old, new in [(1, 3), (3, 1)]:
+            for ext in ("bin", "json"):
+                os.rename(os.path.join(pch, "123456_v{}.{}".format(old, ext)),
+                          os.path.join(pch, "123456_v{}.{}{}".format(
+                              new, ext, PARKED)))
+        os.rename(os.path.join(pch, "123456_v3.bin" + PARKED),
+                  os.path.join(pch, "123456_v3.bin"))
+        self.assertEqual({1: (b"vvv", 1), 2: (b"vv", 2), 3: (b"v", 3)},
+                         self.contents(123456))
+        self.assertNotIn(RENUMBER, os.listdir(pch))
+
+    def test_refresh(self):
+        """ Unchanged manifests shouldn't be rewritten, and binaries
+        shouldn't be hashed again after being renamed.
+        """
+
+        path = os.path.join(self.back_path, "123456", MANIFEST)
+        versions = self.manifest.versions(123456)
+        mtime = os.stat(path).st_mtime_ns
+        self.assertEqual(versions, self.manifest.refresh(123456))
+        self.assertEqual(mtime, os.stat(path).st_mtime_ns)
+
+        pch = os.path.join(self.back_path, "123456")
+        for ext in ("bin", "json"):
+            os.rename(os.path.join(pch, "123456_v3.{}".format(ext)),
+                      os.path.join(pch, "123456_v4.{}".format(ext)))
+        with open(path, "r") as f:
+            manifest = json.loads(f.read())
+        # A digest that can only have been carried over.
+        manifest["versions"][0]["sha256"] = "carried"
+        with open(path, "w") as f:
+            json.dump(manifest, f)
+
+        versions = self.manifest.refresh(123456)
+        self.assertEqual([4, 2, 1], [ver["version"] for ver in versions])
+        self.assertEqual("carried", versions[0]["sha256"])
+
+    def test_delete(self):
+        self.manifest.versions(123456)
+        self.delete.delete_patch("123456_v2")
+        self.assertEqual(["123456_v3", "123456_v1"],
+                         [ver["name"] for ver in
+                          self.manifest.versions(123456)])
+
+        self.delete.delete_patch("123456_v1")
+        versions = self.manifest.versions(123456)
+        self.assertEqual(["123456"], [ver["name"] for ver in versions])
+        self.assertEqual(1, versions[0]["size"])
+
+        self.delete.delete_patch("123456")
+        self.assertFalse(os.path.exists(
+            os.path.join(self.back_path, "123456")))
+        self.assertEqual([], self.manifest.versions(123456))
+
+    def test_split(self):
+        """ A split into two versions should be completed should it have
+        been interrupted at any point once both versions were staged.
+        """
+
+        pch = os.path.join(self.back_path, "22222")
+        self.assertFalse(self.manifest.finish_split(22222))
+        self.assertEqual(0, self.manifest.latest(22222)["version"])
+
+        with open(os.path.join(pch, "22222_v2.bin"), "wb") as f:
+            f.write(b"New")
+        write_json(os.path.join(pch, "22222_v2.json" + STAGED),
+                   {"id": 22222, "title": "New", "revision": 2})
+        write_json(os.path.join(pch, "22222_v1.json" + STAGED),
+                   {"id": 22222, "title": "Test", "revision": 1})
+        # Interrupted after the first rename.
+        os.rename(os.path.join(pch, "22222_v2.json" + STAGED),
+                  os.path.join(pch, "22222_v2.json"))
+
+        versions = self.manifest.refresh(22222)
+        self.assertEqual([2, 1], [ver["version"] for ver in versions])
+        self.assertEqual(["22222_v1.bin", "22222_v1.json", "22222_v2.bin",
+                          "22222_v2.json", MANIFEST],
+                         sorted(os.listdir(pch)))
+        with open(os.path.join(pch, "22222_v1.bin"), "rb") as f:
+            self.assertEqual(b"Test", f.read())
+        self.assertFalse(self.manifest.finish_split(22222))
@@ -0,0 +1,127 @@
+import unittest
+
+import zoia_lib.backend.utilities as util
+from zoia_lib.backend.patch_meta import MetaCache, PatchRecord, light, \
+    meta_cache
+
+
+class TestMeta(unittest.TestCase):
+    """ This class is responsible for testing the patch metadata records
+    that are kept in memory for the tables, searching and sorting.
+
+    Currently, the tests cover accessing records like PS metadata,
+    sharing names between records, loading the heavy attributes, and
+    bounding the memory held for them.
+    """
+
+    def setUp(self):
+        meta_cache.clear()
+        self.loads = []
+
+    def load(self, key):
+        self.loads.append(key)
+        return {"id": key, "title": "Old", "content": "Notes {}".format(key)}
+
+    def test_lazy(self):
+        """ Heavy attributes should only be loaded when accessed, and
+        only once.
+        """
+
+        full = self.load(1)
+        self.loads = []
+        pch = PatchRecord.from_meta(light(full), 1, self.load)
+
+        self.assertEqual({"id": 1, "title": "Old"}, dict(pch))
+        self.assertIn("content", pch)
+        self.assertNotIn("files", pch)
+        self.assertEqual([], self.loads)
+        self.assertEqual("Notes 1", pch["content"])
+        self.assertEqual("Notes 1", pch["content"])
+        self.assertEqual([1], self.loads)
+        with self.assertRaises(KeyError):
+            pch["files"]
+        with self.assertRaises(KeyError):
+            pch["like_count"]
+
+        pch.title = "New"
+        meta = pch.full()
+        self.assertEqual("New", meta["title"])
+        meta["content"] = "Changed"
+        self.assertEqual("Notes 1", pch["content"],
+                         "full() should return a copy.")
+
+    def test_record(self):
+        """ Records should hold the attributes used by the tables,
+        searching and sorting, sharing names with other records.
+        """
+
+        meta = {"id": 100001, "title": "Test",
+                "author": {"id": 1, "name": "".join(["Some", "one"])},
+                "tags": [{"id": 2, "name": "delay"}], "categories": [],
+                "like_count": 0, "view_count": None}
+        pch = PatchRecord.from_meta(meta)
+        other = PatchRecord.from_meta(
+            {"id": 100002, "author": {"name": "".join(["Some", "one"])}})
+
+        self.assertEqual("Someone", pch.author)
+        self.assertIs(pch.author, other.author, "Names should be interned.")
+        self.assertEqual(("delay",), pch.tags)
+        self.assertEqual({"name": "Someone"}, pch["author"])
+        self.assertEqual([{"name": "delay"}], pch["tags"])
+        self.assertEqual([], pch["categories"])
+        self.assertEqual(0, pch["like_count"])
+        self.assertIn("categories", pch)
+        self.assertNotIn("view_count", pch)
+        self.assertNotIn("created_at", pch)
+        self.assertIsNone(pch.get("content"))
+        self.assertEqual(PatchRecord.from_meta(meta), pch)
+        self.assertNotEqual(other, pch)
+
+    def test_search_sort(self):
+        """ Searching and sorting records should give the same results as
+        searching and sorting the metadata they were created from.
+        """
+
+        data = [
+            {"id": 1, "title": "Delay", "author": {"name": "Bob"},
+             "tags": [{"name": "echo"}], "categories": [{"name": "Effect"}],
+             "created_at": "2020-01", "updated_at": "2020-03",
+             "like_count": 3},
+            {"id": 2, "title": "Loop", "tags": [], "categories": [],
+             "created_at": "2020-02", "updated_at": "2020-02"},
+            {"id": 3, "title": "Synth", "author": {"name": "ann"},
+             "tags": [{"name": "delay"}],
+             "categories": [{"name": "Sound"}, {"name": "Effect"}],
+             "created_at": "2020-03", "updated_at": "2020-01",
+             "like_count": 1}
+        ]
+        records = [PatchRecord.from_meta(pch) for pch in data]
+
+        for query in ("e", "delay", "bob", "2020-02", ""):
+            self.assertEqual(
+                [pch["id"] for pch in util.search_patches(data, query)],
+                [pch.id for pch in util.search_patches(records, query)],
+                query)
+        for mode in range(1, 8):
+            util.sort_metadata(mode, data, True)
+            util.sort_metadata(mode, records, True)
+            self.assertEqual([pch["id"] for pch in data],
+                             [pch.id for pch in records], mode)
+
+    def test_bounded(self):
+        """ Only the most recently used metadata should be kept.
+        """
+
+        cache = MetaCache(maxsize=2)
+        cache.get(1, self.load)
+        cache.get(2, self.load)
+        cache.get(1, self.load)
+        cache.get(3, self.load)
+
+        self.assertEqual(2, len(cache))
+        cache.get(1, self.load)
+        cache.get(2, self.load)
+        self.assertEqual([1, 2, 3, 2], self.loads)
+
+        self.assertIsNone(cache.get(4, lambda key: None))
+        self.assertEqual(2, len(cache))
@@ -0,0 +1,230 @@
+import random
+import unittest
+
+import zoia_lib.backend.utilities as util
+from zoia_lib.backend import patch_search
+from zoia_lib.backend.patch_meta import PatchRecord
+from zoia_lib.backend.patch_search import SearchIndex, index_for
+
+
+def scan(data, query):
+    """ Searches the way every patch used to be scanned. """
+
+    query = query.lower()
+    first = []
+    if any(query in cat for cat in ("composition", "effect", "game", "other",
+                                     "sampler", "sequencer", "sound",
+                                     "synthesizer", "utility", "video")):
+        first = [pch for pch in data
+                 if any(query in cat["name"].lower()
+                        for cat in pch.get("categories", []))]
+        first.reverse()
+    rest = [pch for pch in data if pch not in first and (
+        query in pch["title"].lower()
+        or ("author" in pch and query in pch["author"]["name"].lower())
+        or any(query in tag["name"].lower() for tag in pch.get("tags", []))
+        or query in pch["updated_at"].lower()
+        or query in pch["created_at"].lower())]
+
+    return first + rest
+
+
+class TestSearch(unittest.TestCase):
+    """ This class is responsible for testing the index used to search
+    patch metadata.
+
+    Currently, the tests cover matching the results of scanning every
+    patch (including the category-first ordering), ranking results by
+    relevance, tolerating typos, narrowing the results of earlier
+    queries, and keeping the index up to date as the searched list is
+    changed.
+    """
+
+    def setUp(self):
+        rand = random.Random(1)
+        words = ["delay", "Loveless", "echo", "Granular Cloud", "bass",
+                 "ambient drone", "Sequencer", "looper", "kick"]
+        cats = ["Effect", "Sound", "Utility", "Game", "Synthesizer"]
+        self.data = []
+        for i in range(200):
+            meta = {
+                "id": 100000 + i,
+                "title": " ".join(rand.sample(words, 2)),
+                "tags": [{"name": tag} for tag in rand.sample(words, 2)],
+                "categories": [{"name": cat}
+                               for cat in rand.sample(cats, i % 3)],
+                "created_at": "2020-{:02}-01".format(i % 12 + 1),
+                "updated_at": "2021-{:02}-02".format(i % 7 + 1)
+            }
+            if i % 4:
+                meta["author"] = {"name": rand.choice(words).upper()}
+            self.data.append(meta)
+
+    def test_scan(self):
+        """ The index should find exactly what scanning does, in the
+        same order.
+        """
+
+        records = [PatchRecord.from_meta(pch) for pch in self.data]
+        for query in ("", "e", "ef", "eff", "effect", "o", "LOVE", "less d",
+                      "y lo", "2020-1", "-02", "ound", "sound", "xyz",
+                      "granular cloud"):
+            expected = [pch["id"] for pch in scan(self.data, query)]
+            self.assertEqual(expected, [pch["id"] for pch in
+                                        util.search_patches(self.data,
+                                                            query)], query)
+            self.assertEqual(expected, [pch.id for pch in
+                                        util.search_patches(records, query)],
+                             query)
+
+    def test_changes(self):
+        """ Adding, replacing, removing and reordering patches should be
+        reflected by the next search.
+        """
+
+        data = self.data
+        index = index_for(data)
+        self.assertIs(index, index_for(data))
+        util.search_patches(data, "delay")
+        self.assertEqual(len(data), len(index))
+
+        data.append({"id": 1, "title": "Kalimba", "created_at": "",
+                     "updated_at": ""})
+        self.assertEqual([1], [pch["id"] for pch in
+                               util.search_patches(data, "kalim")])
+
+        data[0] = {"id": 2, "title": "Marimba", "created_at": "",
+                   "updated_at": ""}
+        del data[1]
+        data.insert(1, {"id": 3, "title": "Marimba", "created_at": "",
+                        "updated_at": ""})
+        util.sort_metadata(1, data, False)
+        self.assertEqual(scan(data, "rimba"),
+                         util.search_patches(data, "rimba"))
+        self.assertEqual(scan(data, "ay"), util.search_patches(data, "ay"))
+        self.assertEqual(len(data), len(index))
+
+        # Changes made in place need the index to be touched.
+        data.reverse()
+        index.touch()
+        self.assertEqual(scan(data, "e"), util.search_patches(data, "e"))
+
+    def test_remove(self):
+        index = SearchIndex()
+        for pch in self.data[:2]:
+            index.add(pch)
+        index.remove(self.data[0])
+        index.remove(self.data[0])
+        index.sync(self.data[1:2])
+        self.assertEqual(1, len(index))
+        self.assertEqual(scan(self.data[1:2], "e"),
+                         index.search(self.data[1:2], "e"))
+
+    def test_rank(self):
+        """ Ranked searches should put the best matches first, scoring
+        the patch notes as well.
+        """
+
+        notes = {"id": 4, "title": "Pad", "created_at": "", "updated_at": "",
+                 "content": "A delay. Delay, delay and more delay."}
+        data = [
+            {"id": 1, "title": "Loop", "created_at": "", "updated_at": "",
+             "tags": [{"name": "delay"}]},
+            {"id": 2, "title": "Nothing", "created_at": "delay",
+             "updated_at": ""},
+            {"id": 3, "title": "Granular Delay", "created_at": "",
+             "updated_at": ""},
+            PatchRecord.from_meta(notes, 4, lambda key: notes)
+        ]
+
+        ranked = util.search_patches(data, "delay", True)
+        self.assertEqual([3, 4, 1, 2], [pch["id"] for pch in ranked])
+        ranked = util.search_patches(data, "delay", True,
+                                     {"title": 0, "content": 10})
+        self.assertEqual([4, 1, 2, 3], [pch["id"] for pch in ranked],
+                         "Matches that aren't scored come last.")
+        self.assertEqual([3], [pch["id"] for pch in
+                               util.search_patches(data, "gran", True)])
+
+        # Only the best are sorted, the rest keep their order.
+        index = index_for(data)
+        self.assertEqual([3, 1, 2, 4], [pch["id"] for pch in
+                                        index.rank(data, "delay", 1)])
+
+    def test_rank_matches(self):
+        """ Ranked searches should find everything unranked ones do.
+        """
+
+        for query in ("e", "o", "love", "less d", "2020-1", "ound"):
+            self.assertEqual(
+                sorted(pch["id"] for pch in scan(self.data, query)),
+                sorted(pch["id"] for pch in
+                       util.search_patches(self.data, query, True)), query)
+
+    def test_fuzzy(self):
+        """ Queries with typos should find the patches they were meant
+        to, but only should nothing match exactly.
+        """
+
+        data = [
+            {"id": 1, "title": "Step Sequencer", "created_at": "",
+             "updated_at": ""},
+            {"id": 2, "title": "Grain", "created_at": "", "updated_at": "",
+             "tags": [{"name": "granular"}]},
+            {"id": 3, "title": "Sequences", "created_at": "",
+             "updated_at": "", "categories": [{"name": "Sequencer"}]},
+            {"id": 4, "title": "Granola", "created_at": "", "updated_at": "",
+             "author": {"name": "sequencer"}}
+        ]
+
+        def ids(query, **kwargs):
+            kwargs.setdefault("fuzzy", True)
+            return [pch["id"] for pch in
+                    util.search_patches(data, query, **kwargs)]
+
+        self.assertEqual([1, 3, 4], ids("sequncer"))
+        self.assertEqual([2], ids("grannular"))
+        self.assertEqual([1], ids("steb sequncer"),
+                         "Every word should match.")
+        self.assertEqual([], ids("sequncer", fuzzy=False))
+        self.assertEqual([], util.search_patches(data, "sequncer"),
+                         "Only searches that opt in should be fuzzy.")
+        self.assertEqual([], ids("gran xyz"),
+                         "Short words must match exactly.")
+        self.assertEqual([2, 4], ids("gran"))
+
+        # Closest first.
+        self.assertEqual([3, 1, 4], ids("sequenses"))
+
+        data.append({"id": 5, "title": "Sequenzer", "created_at": "",
+                     "updated_at": ""})
+        self.assertEqual([1, 3, 4, 5], ids("sequncer"))
+        del data[0]
+        self.assertEqual([3, 4, 5], ids("sequncer"))
+
+        # Only the closest are returned.
+        self.assertEqual([3, 4], [pch["id"] for pch in
+                                  index_for(data).fuzzy(data, "sequncer", 2)])
+
+    def test_narrow(self):
+        """ Queries extending an earlier one should give the same
+        results as searching from scratch.
+        """
+
+        for query in ("l", "lo", "lov", "love", "lovel", "loveless d",
+                      "o", "oo", "loo", "2", "20", "202", "2020-", "2020-0"):
+            self.assertEqual(scan(self.data, query),
+                             util.search_patches(self.data, query), query)
+
+    def test_view(self):
+        """ A copy of a list should be searched using the index for the
+        list.
+        """
+
+        view = list(self.data)
+        self.data.sort(key=lambda pch: pch["title"])
+        hits = util.search_patches(self.data, "echo", view=view)
+        self.assertEqual(scan(view, "echo"), hits)
+        self.assertNotIn(id(view), patch_search._indexes,
+                         "The copy shouldn't be indexed by itself.")
+        self.assertEqual(len(self.data), len(index_for(self.data)))
@@ -19,6 +19,9 @@ class TestSorting(unittest.TestCase):
      - By download count
      - By view count
      - By date modified
+
+    As well as sorting a list again once patches were added to or
+    removed from it, and sorting by a second key.
     """
 
     def test_sort_edge_cases(self):
@@ -277,3 +280,54 @@ class TestSorting(unittest.TestCase):
                         "Sorted data did not have GOLDFINGER in position 3")
         self.assertTrue(data[4]["title"] == "Subtle Knife",
                         "Sorted data did not have Subtle Knife in position 4")
+
+    def test_sort_index(self):
+        """ Sorting a list again, after patches were added to and
+        removed from it, should give the same order as sorted() does.
+        Patches with the same key keep the order they were in in the
+        list, in reverse as well.
+        """
+
+        data = [{"id": i, "title": "Patch {}".format(i % 7),
+                 "updated_at": "", "like_count": i % 3}
+                for i in range(30)]
+        util.sort_metadata(3, data, False)
+        self.assertEqual(list(range(0, 30, 3)) + list(range(1, 30, 3))
+                         + list(range(2, 30, 3)), [pch["id"] for pch in data])
+        util.sort_metadata(3, data, True)
+        self.assertEqual(list(range(2, 30, 3)) + list(range(1, 30, 3))
+                         + list(range(0, 30, 3)),
+                         [pch["id"] for pch in data])
+        util.sort_metadata(1, data, False)
+
+        # Changes to the list since it was last sorted.
+        data.append({"id": 30, "title": "patch 0", "updated_at": "",
+                     "like_count": 1})
+        del data[3]
+        data[5] = {"id": 31, "title": "Patch 9", "updated_at": "",
+                   "like_count": 0}
+        data.insert(0, {"id": 32, "title": "Patch 1", "updated_at": "",
+                        "like_count": 2})
+        data.reverse()
+
+        keys = {1: lambda pch: pch["title"].upper(),
+                3: lambda pch: pch["like_count"],
+                6: lambda pch: pch["updated_at"].upper()}
+        for mode, key in keys.items():
+            for rev in (False, True, True, False):
+                expected = sorted(data, key=key, reverse=rev)
+                util.sort_metadata(mode, data, rev)
+                self.assertEqual([pch["id"] for pch in expected],
+                                 [pch["id"] for pch in data], (mode, rev))
+
+    def test_sort_second_key(self):
+        """ Sorting by one key and then by another should keep the
+        order of the first among patches with the same second key.
+        """
+
+        data = [{"title": title, "updated_at": "", "like_count": likes}
+                for title, likes in (("c", 1), ("a", 1), ("b", 1), ("d", 2))]
+        util.sort_metadata(1, data, False)
+        util.sort_metadata(3, data, True)
+        self.assertEqual(["d", "a", "b", "c"],
+                         [pch["title"] for pch in data])
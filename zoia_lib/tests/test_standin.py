@@ -0,0 +1,114 @@
+import io
+import json
+import unittest
+import zipfile
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from zoia_lib.tests.ps_standin import PSStandIn, RAR_MARKER
+
+
+class TestStandIn(unittest.TestCase):
+    """ This class is responsible for testing the local stand-in for
+    the PS API that the sync and download code is benchmarked against.
+
+    Currently, the tests cover paged searches, per-patch metadata,
+    patch files and conditional requests, redirects, and error
+    injection.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ps = PSStandIn(patches=60, bin_size=64)
+        cls.url = cls.ps.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ps.stop()
+
+    def get(self, path, headers=None):
+        return urlopen(Request(self.url + path, headers=headers or {}))
+
+    def test_search(self):
+        """ Searches should be paged, ordered and report their totals
+        the same way PS does.
+        """
+
+        r = self.get("patches/?per_page=25&page=3")
+        self.assertEqual("60", r.headers["X-WP-Total"])
+        self.assertEqual("3", r.headers["X-WP-TotalPages"])
+        page = json.loads(r.read())
+        self.assertEqual(10, len(page), "Expected a short last page.")
+        self.assertEqual(100001, page[-1]["id"],
+                         "Expected the oldest patch last.")
+
+        page = json.loads(self.get(
+            "patches/?include=100002,100005&per_page=100").read())
+        self.assertEqual({100002, 100005}, {pch["id"] for pch in page})
+
+        with self.assertRaises(HTTPError) as e:
+            self.get("patches/?per_page=25&page=4")
+        self.assertEqual(400, e.exception.code)
+
+    def test_patch(self):
+        """ Patch metadata should link to files that can be downloaded,
+        and conditional requests should be answered with a 304.
+        """
+
+        meta = json.loads(self.get("patches/100010/").read())
+        self.assertEqual("zoia_patch_100010.zip",
+                         meta["files"][0]["filename"])
+
+        r = urlopen(meta["files"][0]["url"])
+        with zipfile.ZipFile(io.BytesIO(r.read())) as zf:
+            self.assertEqual(3, len(zf.namelist()))
+
+        with self.assertRaises(HTTPError) as e:
+            urlopen(Request(meta["files"][0]["url"], headers={
+                "If-None-Match": r.headers["ETag"]}))
+        self.assertEqual(304, e.exception.code)
+
+        meta = json.loads(self.get("patches/100025/").read())
+        self.assertTrue(urlopen(meta["files"][0]["url"]).read()
+                        .startswith(RAR_MARKER))
+
+        with self.assertRaises(HTTPError) as e:
+            self.get("patches/900000/")
+        self.assertEqual(404, e.exception.code)
+
+    def test_update(self):
+        """ Updated patches should be listed first when ordering by
+        modification date, with a new file URL.
+        """
+
+        old = json.loads(self.get("patches/100003/").read())
+        self.ps.update_patch(100003)
+        new = json.loads(self.get("patches/100003/").read())
+
+        self.assertNotEqual(old["files"][0]["url"], new["files"][0]["url"])
+        page = json.loads(self.get("patches/?orderby=modified").read())
+        self.assertEqual(100003, page[0]["id"])
+
+    def test_redirect(self):
+        """ Requests under a redirected path should be answered with a
+        301 to the same request under the new path.
+        """
+
+        self.ps.redirects["/api/old/"] = "/api/alpha/"
+        try:
+            r = urlopen(self.url.replace("/alpha/", "/old/")
+                        + "patches/100002/?x=1")
+            self.assertEqual(self.url + "patches/100002/?x=1", r.url)
+            self.assertEqual(100002, json.loads(r.read())["id"])
+        finally:
+            del self.ps.redirects["/api/old/"]
+
+    def test_errors(self):
+        """ Requests should fail at the configured error rate.
+        """
+
+        with PSStandIn(patches=1, error_rate=1.0, bin_size=1) as ps:
+            with self.assertRaises(HTTPError) as e:
+                urlopen(ps.url + "patches/")
+            self.assertEqual(503, e.exception.code)
+            self.assertEqual(1, ps.errors)
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from zoia_lib.backend.patch_delete import PatchDelete
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.patch_store import PatchStore
+from zoia_lib.backend.utilities import add_test_patch
+
+
+class TestStore(unittest.TestCase):
+    """ This class is responsible for testing the store that keeps a
+    single copy of each distinct binary.
+
+    Currently, the tests cover sharing binaries between patches, and
+    removing binaries from the store once no patch uses them anymore.
+    """
+
+    def setUp(self):
+        self.back_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.back_path, "Banks"))
+        add_test_patch("22222", 22222, self.back_path)
+        add_test_patch("33333", 33333, self.back_path)
+        add_test_patch("44444", 44444, self.back_path)
+        with open(os.path.join(self.back_path, "44444", "44444.bin"),
+                  "wb") as f:
+            f.write(b"Other")
+
+        self.store = PatchStore()
+        self.store.back_path = self.back_path
+        self.delete = PatchDelete()
+        self.delete.back_path = self.back_path
+        self.digest = hashlib.sha256(b"Test").hexdigest()
+
+    def tearDown(self):
+        PatchIndex.for_path(self.back_path).close()
+        shutil.rmtree(self.back_path)
+
+    def _bin(self, idx):
+        return os.path.join(self.back_path, idx, "{}.bin".format(idx))
+
+    def test_add(self):
+        self.assertEqual(self.digest, self.store.add(self._bin("22222")))
+        self.assertEqual(self.digest, self.store.add(self._bin("33333"),
+                                                     self.digest))
+        self.store.add(self._bin("44444"))
+
+        obj = self.store.path(self.digest)
+        self.assertTrue(os.path.samefile(obj, self._bin("22222")))
+        self.assertTrue(os.path.samefile(obj, self._bin("33333")))
+        self.assertEqual(3, os.stat(obj).st_nlink)
+        with open(self._bin("33333"), "rb") as f:
+            self.assertEqual(b"Test", f.read())
+        self.assertFalse(os.path.samefile(obj, self._bin("44444")))
+
+        # Adding the same binary again changes nothing.
+        self.store.add(self._bin("22222"))
+        self.assertEqual(3, os.stat(obj).st_nlink)
+
+    def test_release(self):
+        for idx in ("22222", "33333"):
+            self.store.add(self._bin(idx))
+        obj = self.store.path(self.digest)
+
+        self.delete.delete_patch("22222")
+        self.assertTrue(os.path.exists(obj))
+        self.delete.delete_full_patch_directory("33333")
+        self.assertFalse(os.path.exists(obj))
+
+        # Binaries that aren't in the store are ignored.
+        self.delete.delete_patch("44444")
+        self.store.release(None)
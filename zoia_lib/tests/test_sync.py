@@ -0,0 +1,211 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from zoia_lib.backend import patch_sync
+from zoia_lib.backend.patch_sync import PatchSync
+
+
+class FakePatchStorage:
+    """ Stands in for the PatchStorage class, serving a catalog that is
+    held in memory and counting the queries made against it.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.full_syncs = 0
+        self.modified_queries = 0
+        self.id_listings = 0
+
+    @property
+    def patch_count(self):
+        return len(self.catalog)
+
+    def get_all_patch_data_init(self, progress=None):
+        self.full_syncs += 1
+        return list(self.catalog)
+
+    def get_patch_ids(self):
+        self.id_listings += 1
+        return [pch["id"] for pch in self.catalog]
+
+    def get_modified_patches(self, since):
+        self.modified_queries += 1
+        return sorted([pch for pch in self.catalog
+                       if pch["updated_at"] >= since],
+                      key=lambda x: x["updated_at"], reverse=True)
+
+
+def make_patch(idx, updated_at, title="Test"):
+    return {"id": idx, "title": title, "updated_at": updated_at}
+
+
+class TestSync(unittest.TestCase):
+    """ This class is responsible for testing the syncing of the PS
+    catalog to the backend application directory.
+
+    Currently, the tests cover the initial full sync, the incremental
+    syncing of new and modified patches, leaving the catalog alone when
+    nothing changed, and falling back to a full sync when patches are
+    deleted from PS (including when uploads make up for them in the
+    patch count).
+    """
+
+    def setUp(self):
+        self.api = FakePatchStorage([
+            make_patch(100001, "2020-06-01T00:00:00+00:00"),
+            make_patch(100002, "2020-06-02T00:00:00+00:00"),
+            make_patch(100003, "2020-06-03T00:00:00+00:00")
+        ])
+        self.sync = PatchSync(self.api)
+        self.sync.back_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.sync.back_path)
+
+    def test_initial_sync(self):
+        """ Syncing without a catalog in the backend should retrieve the
+        entire catalog and save a checkpoint alongside it.
+        """
+
+        data = self.sync.sync()
+
+        self.assertEqual(3, len(data), "Expected the full catalog.")
+        self.assertEqual(1, self.api.full_syncs,
+                         "Expected a single full sync.")
+        with open(os.path.join(self.sync.back_path, "sync.json")) as f:
+            checkpoint = json.loads(f.read())
+        self.assertEqual("2020-06-03T00:00:00+00:00",
+                         checkpoint["last_modified"],
+                         "Checkpoint did not record the newest date.")
+
+    def test_incremental_sync(self):
+        """ Subsequent syncs should only merge in the patches that were
+        uploaded or modified since the previous sync.
+        """
+
+        self.sync.sync()
+
+        # One patch is edited and another one is uploaded.
+        self.api.catalog[0] = make_patch(100001, "2020-06-05T00:00:00+00:00",
+                                         "Edited")
+        self.api.catalog.append(make_patch(100004,
+                                           "2020-06-04T00:00:00+00:00"))
+
+        data = self.sync.sync()
+
+        self.assertEqual(1, self.api.full_syncs,
+                         "Expected no additional full sync.")
+        self.assertEqual(1, self.api.modified_queries,
+                         "Expected a single query for modified patches.")
+        self.assertEqual(4, len(data), "Expected the new patch to be added.")
+        titles = {pch["id"]: pch["title"] for pch in data}
+        self.assertEqual("Edited", titles[100001],
+                         "Expected the edited patch to be replaced.")
+        self.assertEqual(data, self.sync.load_catalog(),
+                         "The merged catalog was not saved.")
+        self.assertEqual(1, self.api.id_listings,
+                         "Expected the ids to be checked after an upload.")
+
+        # Edits alone leave the count as proof enough.
+        self.api.catalog[1] = make_patch(100002, "2020-06-06T00:00:00+00:00")
+        self.sync.sync()
+        self.assertEqual(1, self.api.id_listings)
+
+    def test_unchanged_sync(self):
+        """ Syncing again without any changes on PS should leave the
+        saved catalog as it is.
+        """
+
+        self.sync.sync()
+        path = os.path.join(self.sync.back_path, "catalog.bin")
+        before = os.stat(path)
+
+        data = self.sync.sync()
+
+        after = os.stat(path)
+        self.assertEqual((before.st_ino, before.st_mtime_ns),
+                         (after.st_ino, after.st_mtime_ns),
+                         "The catalog should not have been written.")
+        self.assertEqual(1, self.api.modified_queries)
+        self.assertEqual(0, self.api.id_listings)
+        self.assertEqual(3, len(data))
+
+    def test_deleted_patch_sync(self):
+        """ Should a patch be deleted from PS, the catalog can't be
+        patched up and the entire catalog should be retrieved again.
+        """
+
+        self.sync.sync()
+        del self.api.catalog[1]
+
+        data = self.sync.sync()
+
+        self.assertEqual(2, self.api.full_syncs,
+                         "Expected a second full sync.")
+        self.assertEqual(2, len(data), "Expected the deleted patch to be "
+                                       "dropped from the catalog.")
+
+    def test_legacy_catalog_sync(self):
+        """ A catalog saved without a checkpoint should still be synced
+        incrementally.
+        """
+
+        with open(os.path.join(self.sync.back_path, "data.json"), "w") as f:
+            f.write(json.dumps(self.api.catalog))
+
+        self.sync.sync()
+
+        self.assertEqual(0, self.api.full_syncs,
+                         "Expected no full sync.")
+        self.assertEqual(1, self.api.modified_queries,
+                         "Expected a single query for modified patches.")
+
+    def test_masked_deleted_patch_sync(self):
+        """ A deletion should be noticed even when uploads make up for
+        it in the patch count.
+        """
+
+        self.sync.sync()
+
+        # One upload is found, but the other one carries a date older
+        # than the checkpoint.
+        del self.api.catalog[1]
+        self.api.catalog.append(make_patch(100004,
+                                           "2020-06-04T00:00:00+00:00"))
+        self.api.catalog.append(make_patch(100005,
+                                           "2020-01-01T00:00:00+00:00"))
+
+        data = self.sync.sync()
+
+        self.assertEqual(2, self.api.full_syncs,
+                         "Expected a second full sync.")
+        self.assertEqual([100001, 100003, 100004, 100005],
+                         sorted(pch["id"] for pch in data))
+
+    def test_reconcile_sync(self):
+        """ The ids should be checked against PS once the previous check
+        is old enough, even if nothing was uploaded.
+        """
+
+        self.sync.sync()
+        self.api.catalog[1] = make_patch(100005, "2020-01-01T00:00:00+00:00")
+
+        self.sync.sync()
+        self.assertEqual(1, self.api.full_syncs,
+                         "Expected the deletion to go unnoticed for now.")
+
+        with open(os.path.join(self.sync.back_path, "sync.json")) as f:
+            checkpoint = json.loads(f.read())
+        checkpoint["reconciled"] -= patch_sync.RECONCILE_AGE + 1
+        with open(os.path.join(self.sync.back_path, "sync.json"), "w") as f:
+            f.write(json.dumps(checkpoint))
+
+        data = self.sync.sync()
+        self.assertEqual(1, self.api.id_listings)
+        self.assertEqual(2, self.api.full_syncs,
+                         "Expected a second full sync.")
+        self.assertEqual([100001, 100003, 100005],
+                         sorted(pch["id"] for pch in data))
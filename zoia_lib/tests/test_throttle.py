@@ -0,0 +1,103 @@
+import unittest
+
+from zoia_lib.backend.api_throttle import RateLimiter, RetryPolicy
+
+
+class FakeClock:
+    """ A clock that only moves when told to. """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    """ Stands in for a urllib3 response. """
+
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = {} if headers is None else headers
+
+
+class TestThrottle(unittest.TestCase):
+    """ This class is responsible for testing the rate limiting and
+    retrying of requests made to the PS API.
+
+    Currently, the tests cover the token bucket, pausing the bucket,
+    retrying on statuses and exceptions, and giving up.
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(2, 3, self.clock)
+        self.sleeps = []
+        self.policy = RetryPolicy(max_retries=2, backoff=1,
+                                  exceptions=(ConnectionError,),
+                                  sleep=self.sleeps.append)
+
+    def test_token_bucket(self):
+        """ Requests beyond the burst should wait for tokens to refill.
+        """
+
+        waits = [self.limiter.reserve() for _ in range(5)]
+        self.assertEqual([0, 0, 0, 0.5, 1.0], waits)
+        self.assertEqual(2, self.limiter.stats()["throttled"])
+
+        # After 10 seconds the bucket is full again, but never fuller.
+        self.clock.now = 10
+        waits = [self.limiter.reserve() for _ in range(4)]
+        self.assertEqual([0, 0, 0, 0.5], waits)
+
+    def test_pause(self):
+        """ Pausing the bucket should hold back every request.
+        """
+
+        self.limiter.pause(7)
+        self.assertEqual(7, self.limiter.reserve())
+        self.clock.now = 7
+        self.assertEqual(0, self.limiter.reserve())
+
+    def test_retry(self):
+        """ Transient failures should be retried until a response
+        arrives, honouring Retry-After.
+        """
+
+        outcomes = [ConnectionError(), FakeResponse(429, {"Retry-After": "3"}),
+                    FakeResponse(200)]
+
+        def request():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        r = self.policy.call(request)
+
+        self.assertEqual(200, r.status)
+        self.assertEqual(2, len(self.sleeps))
+        self.assertTrue(0 <= self.sleeps[0] <= 1,
+                        "First backoff was out of range.")
+        self.assertEqual(3, self.sleeps[1], "Retry-After was ignored.")
+        self.assertEqual(2, self.policy.stats()["retries"])
+
+    def test_give_up(self):
+        """ Once the retries are exhausted, the last response should be
+        returned and the last exception raised. Other failures should
+        not be retried at all.
+        """
+
+        r = self.policy.call(lambda: FakeResponse(503))
+        self.assertEqual(503, r.status)
+
+        def request():
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            self.policy.call(request)
+        self.assertEqual(2, self.policy.stats()["gave_up"])
+
+        self.assertEqual(404, self.policy.call(lambda: FakeResponse(404))
+                         .status)
+        self.assertEqual(4, self.policy.stats()["retries"])
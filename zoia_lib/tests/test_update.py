@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from zoia_lib.backend import patch_update, utilities
+from zoia_lib.backend.patch_index import PatchIndex
+from zoia_lib.backend.patch_update import PatchUpdate
+from zoia_lib.backend.utilities import add_test_patch, write_json
+
+
+class TestUpdate(unittest.TestCase):
+    """ This class is responsible for testing how the metadata of saved
+    patches is written.
+
+    Currently, the tests cover atomic writes, and coalescing bursts of
+    edits to the same patch into a single write.
+    """
+
+    def setUp(self):
+        self.back_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.back_path, "Banks"))
+        add_test_patch("22222", 22222, self.back_path)
+        self.update = PatchUpdate()
+        self.update.back_path = self.back_path
+        self.path = os.path.join(self.back_path, "22222", "22222.json")
+
+    def tearDown(self):
+        self.update.flush()
+        PatchIndex.for_path(self.back_path).close()
+        shutil.rmtree(self.back_path)
+
+    def _read(self):
+        with open(self.path, "r") as f:
+            return json.loads(f.read())
+
+    def test_write_atomic(self):
+        """ A failed write should leave the previous contents in place,
+        and no temporary file behind.
+        """
+
+        with mock.patch.object(utilities.os, "replace",
+                               side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                write_json(self.path, {"id": 1})
+        self.assertEqual("Test", self._read()["title"])
+        self.assertEqual(["22222.bin", "22222.json"],
+                         sorted(os.listdir(os.path.dirname(self.path))))
+
+        write_json(self.path, {"id": 1})
+        self.assertEqual({"id": 1}, self._read())
+
+    def test_update_data(self):
+        self.update.update_data("22222", [{"name": "a"}], 1)
+        self.assertEqual([{"name": "a"}], self._read()["tags"])
+        self.assertEqual(("a",), PatchIndex.for_path(
+            self.back_path).patch(22222).tags)
+
+    def test_coalesce(self):
+        """ Queued edits should be written at once, after the last one.
+        """
+
+        with mock.patch.object(patch_update, "write_json",
+                               wraps=write_json) as write:
+            self.update.queue_data("22222", [{"name": "a"}], 1)
+            self.update.queue_data("22222", [{"name": "b"}], 1)
+            self.update.queue_data("22222", [{"name": "c"}], 2)
+            self.assertNotIn("tags", self._read())
+
+            time.sleep(patch_update.COALESCE_DELAY * 3)
+            self.assertEqual(1, write.call_count)
+        meta = self._read()
+        self.assertEqual([{"name": "b"}], meta["tags"])
+        self.assertEqual([{"name": "c"}], meta["categories"])
+
+        # Writing right away includes whatever is still queued.
+        self.update.queue_data("22222", [{"name": "d"}], 1)
+        self.update.update_data("22222", "Notes", 3)
+        meta = self._read()
+        self.assertEqual([{"name": "d"}], meta["tags"])
+        self.assertEqual("Notes", meta["content"])
+
+    def test_flush_deleted(self):
+        """ Queued edits for patches deleted in the meantime are
+        dropped.
+        """
+
+        self.update.queue_data("22222", [{"name": "a"}], 1)
+        shutil.rmtree(os.path.join(self.back_path, "22222"))
+        self.update.flush()
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,90 @@
+import os
+import platform
+import shutil
+import tempfile
+import unittest
+
+from zoia_lib.backend.patch_watch import PatchWatcher, ADDED, MODIFIED, \
+    DELETED
+from zoia_lib.backend.utilities import add_test_patch, write_json
+
+
+class TestWatch(unittest.TestCase):
+    """ This class is responsible for testing the change feed for the
+    patch directories in the backend application directory.
+
+    Currently, the tests cover adding, modifying and deleting patches,
+    both via inotify and by polling, including patches modified again
+    right after a rescan.
+    """
+
+    def setUp(self):
+        self.back_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.back_path, "Banks"))
+        add_test_patch("22222", 22222, self.back_path)
+        add_test_patch("22223", 22223, self.back_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.back_path)
+
+    def watcher(self, use_inotify):
+        watcher = PatchWatcher(use_inotify=use_inotify)
+        watcher.back_path = self.back_path
+        watcher.start()
+        self.addCleanup(watcher.close)
+        return watcher
+
+    def changes(self, watcher):
+        self.assertEqual([], watcher.poll(force=True))
+
+        add_test_patch("22224", 22224, self.back_path)
+        # The way the application writes metadata.
+        write_json(os.path.join(self.back_path, "22223", "22223.json"),
+                   {"id": 22223, "title": "Changed"})
+        shutil.rmtree(os.path.join(self.back_path, "22222"))
+        with open(os.path.join(self.back_path, "data.json"), "w") as f:
+            f.write("[]")
+
+        return sorted(watcher.poll(force=True))
+
+    def test_polling(self):
+        """ Changes should be found by rescanning the backend.
+        """
+
+        watcher = self.watcher(False)
+        self.assertTrue(watcher.polling)
+        self.assertEqual([(ADDED, "22224"), (DELETED, "22222"),
+                          (MODIFIED, "22223")], self.changes(watcher))
+        self.assertEqual([], watcher.poll(),
+                         "Expected to wait before rescanning.")
+
+    def test_polling_racy(self):
+        """ Files rewritten in place should be noticed while their
+        directory was modified too recently for its modification time
+        to be trusted.
+        """
+
+        watcher = self.watcher(False)
+        self.assertEqual([], watcher.poll(force=True))
+        with open(os.path.join(self.back_path, "22223", "22223.json"),
+                  "a") as f:
+            f.write(" ")
+
+        self.assertEqual([(MODIFIED, "22223")], watcher.poll(force=True))
+        self.assertEqual([], watcher.poll(force=True))
+
+    @unittest.skipUnless(platform.system() == "Linux", "Requires inotify.")
+    def test_inotify(self):
+        """ Changes should be reported by inotify, including changes to
+        patches added after starting.
+        """
+
+        watcher = self.watcher(True)
+        self.assertFalse(watcher.polling)
+        self.assertEqual([(ADDED, "22224"), (DELETED, "22222"),
+                          (MODIFIED, "22223")], self.changes(watcher))
+
+        with open(os.path.join(self.back_path, "22224", "22224.json"),
+                  "a") as f:
+            f.write(" ")
+        self.assertEqual([(MODIFIED, "22224")], watcher.poll())